@@ -0,0 +1,51 @@
+from kivy.app import App
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.label import Label
+from kivy.uix.button import Button
+from kivy.uix.textinput import TextInput
+from kivy.uix.popup import Popup
+
+class AccountPopup(Popup):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.title = "Account Details"
+        self.size_hint = (0.8, 0.6)
+        
+        layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        
+        self.username_input = TextInput(hint_text="Username", multiline=False, size_hint_y=None, height=40, write_tab=False)
+        layout.add_widget(Label(text="Username", size_hint_y=None, height=30))
+        layout.add_widget(self.username_input)
+        
+        self.email_input = TextInput(hint_text="Email", multiline=False, size_hint_y=None, height=40, write_tab=False)
+        layout.add_widget(Label(text="Email", size_hint_y=None, height=30))
+        layout.add_widget(self.email_input)
+
+        self.phone_input = TextInput(hint_text="Phone Number", multiline=False, size_hint_y=None, height=40, write_tab=False)
+        layout.add_widget(Label(text="Phone Number", size_hint_y=None, height=30))
+        layout.add_widget(self.phone_input)
+        
+        btn_save = Button(text="Save", size_hint_y=None, height=40)
+        btn_save.bind(on_press=self.save_profile)
+        layout.add_widget(btn_save)
+        
+        self.content = layout
+        self.load_data()
+
+    def load_data(self):
+        app = App.get_running_app()
+        if app:
+            user = app.data_manager.get_user()
+            self.username_input.text = user.get("username", "")
+            self.email_input.text = user.get("email", "")
+            self.phone_input.text = user.get("phone", "")
+
+    def save_profile(self, instance):
+        app = App.get_running_app()
+        if app:
+            app.data_manager.update_user(
+                username=self.username_input.text.strip(), 
+                email=self.email_input.text.strip(),
+                phone=self.phone_input.text.strip()
+            )
+            self.dismiss()
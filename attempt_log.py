@@ -0,0 +1,372 @@
+"""
+Log of blocked attempts (timestamp, host, rule, session).
+
+record() only appends to an in-memory buffer and bumps the per-hour, per-host
+rollup counters, so bursts of thousands of blocks per second cost a lock and
+a couple of dict updates each. A writer thread encodes the buffer and appends
+it to the current segment file in one write, at most every FLUSH_INTERVAL
+seconds (sooner once FLUSH_EVENTS are waiting).
+
+Segments are append-only binary files, one or more per UTC day, rotated when
+the day changes or they reach segment_bytes. Each starts with a header
+(magic, version, day) followed by records:
+    STRING  tag 1, u32 id, u32 length, UTF-8 bytes   (first use of a host or rule)
+    EVENT   tag 2, f64 timestamp, u32 session, u32 host id, u32 rule id
+String ids are per segment, so every segment can be read (or deleted) on its
+own. When a segment is sealed its hourly rollup is written next to it as
+.rollup, so start-up and the stats queries never rescan raw events.
+Retention deletes whole segments: one unlink per expired segment, however
+many events it holds.
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import deque
+from storage import atomic_write
+
+ATTEMPTS_DIR = os.path.join("data", "attempts")
+
+MAGIC = b"RFAL"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHxxI")
+STRING = struct.Struct("<BII")
+EVENT = struct.Struct("<BdIII")
+TAG_STRING = 1
+TAG_EVENT = 2
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+RETENTION_DAYS = 30
+SEGMENT_BYTES = 16 * 1024 * 1024
+FLUSH_INTERVAL = 1.0
+FLUSH_EVENTS = 4096
+
+SEGMENT_SUFFIX = ".seg"
+ROLLUP_SUFFIX = ".rollup"
+
+
+def read_segment(path):
+    """
+    Yields (timestamp, session, host, rule) for every complete event in a segment.
+    A record cut short by a crash ends the segment.
+    :raises ValueError: if the file isn't a segment
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        return
+    magic, version, _ = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{path} is not an attempt log segment")
+    strings = []
+    pos = HEADER.size
+    end = len(data)
+    while pos < end:
+        tag = data[pos]
+        if tag == TAG_STRING:
+            if pos + STRING.size > end:
+                return
+            _, string_id, length = STRING.unpack_from(data, pos)
+            pos += STRING.size
+            if pos + length > end:
+                return
+            strings.append(data[pos:pos + length].decode())
+            pos += length
+        elif tag == TAG_EVENT:
+            if pos + EVENT.size > end:
+                return
+            _, ts, session, host_id, rule_id = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            yield ts, session, strings[host_id], strings[rule_id]
+        else:
+            logging.warning(f"Corrupt record in {path} at offset {pos}")
+            return
+
+
+def _add_rollup(rollup, hour, hosts):
+    counts = rollup.get(hour)
+    if counts is None:
+        rollup[hour] = dict(hosts)
+        return
+    for host, count in hosts.items():
+        counts[host] = counts.get(host, 0) + count
+
+
+class AttemptLog:
+    def __init__(self, directory=ATTEMPTS_DIR, retention_days=RETENTION_DAYS, segment_bytes=SEGMENT_BYTES,
+                 flush_interval=FLUSH_INTERVAL):
+        """
+        Opens the log, loading the rollups of existing segments, and starts the writer thread.
+        :param retention_days: Days of events kept; older segments are deleted
+        :param segment_bytes: Size at which a segment is sealed and a new one started
+        """
+        self.directory = directory
+        self.retention_days = retention_days
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = []
+        self._recorded = 0
+        self._written = 0
+        self._flush_requested = False
+        self._closing = False
+        # {hour start: {host: count}}; record(ts=...) may add hours out of order
+        self._hourly = {}
+        # (day, path) of every segment on disk, in creation order; the last may be active
+        self._segments = deque()
+        self._next_seq = 0
+
+        # Writer thread state
+        self._file = None
+        self._segment_day = None
+        self._segment_size = 0
+        self._segment_ids = {}
+        self._segment_rollup = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._writer = threading.Thread(target=self._write_loop, name="attempt-log", daemon=True)
+        self._writer.start()
+
+    def _load(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                segments.append((int(name[:-len(SEGMENT_SUFFIX)]), os.path.join(self.directory, name)))
+        segments.sort()
+        hourly = {}
+        for seq, path in segments:
+            self._next_seq = seq + 1
+            try:
+                with open(path, "rb") as f:
+                    magic, version, day = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC or version != FORMAT_VERSION:
+                    raise ValueError("bad header")
+                rollup = self._load_rollup(path)
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning(f"Skipping unreadable attempt log segment {path}: {e}")
+                continue
+            for hour, hosts in rollup.items():
+                _add_rollup(hourly, hour, hosts)
+            self._segments.append((day, path))
+        self._hourly = dict(sorted(hourly.items()))
+        self._expire(time.time())
+
+    def _load_rollup(self, path):
+        rollup_file = path[:-len(SEGMENT_SUFFIX)] + ROLLUP_SUFFIX
+        if os.path.exists(rollup_file):
+            with open(rollup_file) as f:
+                return {int(hour): hosts for hour, hosts in json.load(f).items()}
+        # Left unsealed by a crash: count it once and seal it
+        rollup = {}
+        for ts, _, host, _ in read_segment(path):
+            counts = rollup.setdefault(int(ts // HOUR) * HOUR, {})
+            counts[host] = counts.get(host, 0) + 1
+        atomic_write(rollup_file, json.dumps(rollup))
+        return rollup
+
+    def record(self, host, rule, session=0, ts=None):
+        """
+        Records one blocked attempt.
+        :param rule: The blocklist rule that matched
+        :param session: Id of the blocking session (see BlockingService)
+        :param ts: Unix timestamp, now by default
+        """
+        if ts is None:
+            ts = time.time()
+        hour = int(ts // HOUR) * HOUR
+        with self._lock:
+            if self._closing:
+                return
+            pending = self._pending
+            pending.append((ts, host, rule or "", session))
+            self._recorded += 1
+            counts = self._hourly.get(hour)
+            if counts is None:
+                counts = self._hourly[hour] = {}
+            counts[host] = counts.get(host, 0) + 1
+            if len(pending) == 1 or len(pending) == FLUSH_EVENTS:
+                self._changed.notify()
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every attempt recorded so far is written to its segment.
+        :return: False if the timeout expired first
+        """
+        with self._changed:
+            target = self._recorded
+            self._flush_requested = True
+            self._changed.notify_all()
+            return self._changed.wait_for(lambda: self._written >= target or not self._writer.is_alive(), timeout)
+
+    def close(self):
+        """Writes what is buffered, seals the current segment and stops the writer."""
+        with self._changed:
+            self._closing = True
+            self._changed.notify_all()
+        self._writer.join()
+
+    def _write_loop(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._pending or self._closing)
+                urgent = lambda: self._closing or self._flush_requested or len(self._pending) >= FLUSH_EVENTS
+                # Let a burst collect so it goes out in one write
+                self._changed.wait_for(urgent, self.flush_interval)
+                batch, self._pending = self._pending, []
+                self._flush_requested = False
+                closing = self._closing
+            if batch:
+                try:
+                    self._write(batch)
+                except OSError as e:
+                    logging.error(f"Could not write blocked attempts, {len(batch)} dropped: {e}")
+            with self._changed:
+                self._written += len(batch)
+                self._changed.notify_all()
+                if closing and not self._pending:
+                    break
+        try:
+            self._seal()
+        except OSError as e:
+            logging.error(f"Could not seal attempt log segment: {e}")
+
+    def _write(self, batch):
+        out = bytearray()
+        ids = self._segment_ids
+        rollup = self._segment_rollup
+        for ts, host, rule, session in batch:
+            day = int(ts // DAY)
+            if self._file is None or day != self._segment_day or self._segment_size + len(out) >= self.segment_bytes:
+                self._append(out)
+                out = bytearray()
+                self._rotate(day)
+                ids = self._segment_ids
+                rollup = self._segment_rollup
+            host_id = ids.get(host)
+            if host_id is None:
+                host_id = ids[host] = len(ids)
+                raw = host.encode()
+                out += STRING.pack(TAG_STRING, host_id, len(raw))
+                out += raw
+            rule_id = ids.get(rule)
+            if rule_id is None:
+                rule_id = ids[rule] = len(ids)
+                raw = rule.encode()
+                out += STRING.pack(TAG_STRING, rule_id, len(raw))
+                out += raw
+            out += EVENT.pack(TAG_EVENT, ts, session & 0xFFFFFFFF, host_id, rule_id)
+            counts = rollup.get(int(ts // HOUR) * HOUR)
+            if counts is None:
+                counts = rollup[int(ts // HOUR) * HOUR] = {}
+            counts[host] = counts.get(host, 0) + 1
+        self._append(out)
+
+    def _append(self, out):
+        if out:
+            self._file.write(out)
+            self._file.flush()
+            self._segment_size += len(out)
+
+    def _rotate(self, day):
+        self._seal()
+        path = os.path.join(self.directory, f"{self._next_seq:08d}{SEGMENT_SUFFIX}")
+        self._next_seq += 1
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, day))
+        self._segment_day = day
+        self._segment_size = HEADER.size
+        self._segment_ids = {}
+        self._segment_rollup = {}
+        with self._lock:
+            self._segments.append((day, path))
+            self._expire(day * DAY)
+
+    def _seal(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        path = self._file.name
+        self._file.close()
+        self._file = None
+        atomic_write(path[:-len(SEGMENT_SUFFIX)] + ROLLUP_SUFFIX, json.dumps(self._segment_rollup))
+
+    def _expire(self, now):
+        """Deletes segments and rollup hours past retention. Called with the lock held."""
+        cutoff_day = int(now // DAY) - self.retention_days + 1
+        active = self._file.name if self._file else None
+        # Neither is necessarily in time order (events can be recorded with past timestamps),
+        # so both are scanned whole: a few hundred hours and segments at most
+        kept = deque()
+        for day, path in self._segments:
+            if day >= cutoff_day or path == active:
+                kept.append((day, path))
+                continue
+            for name in (path, path[:-len(SEGMENT_SUFFIX)] + ROLLUP_SUFFIX):
+                try:
+                    os.unlink(name)
+                except FileNotFoundError:
+                    pass
+        self._segments = kept
+        cutoff = cutoff_day * DAY
+        for hour in [hour for hour in self._hourly if hour < cutoff]:
+            del self._hourly[hour]
+
+    def expire(self, now=None):
+        """Applies the retention policy now instead of at the next rotation."""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+
+    def top_hosts(self, n=10, since=None, until=None):
+        """
+        Most blocked hosts, from the hourly rollups.
+        :param since: Unix timestamp; counted from the start of its hour
+        :param until: Unix timestamp; hours starting before it are counted
+        :return: Up to n (host, count) pairs, most blocked first
+        """
+        totals = {}
+        with self._lock:
+            for hour, hosts in self._hourly.items():
+                if (since is not None and hour + HOUR <= since) or (until is not None and hour >= until):
+                    continue
+                for host, count in hosts.items():
+                    totals[host] = totals.get(host, 0) + count
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    def top_hosts_this_week(self, n=10, now=None):
+        """:return: The n most blocked hosts over the last seven days"""
+        now = time.time() if now is None else now
+        return self.top_hosts(n, since=now - WEEK)
+
+    def hourly_counts(self, since=None, until=None):
+        """:return: [(hour start, blocked attempts)] in time order"""
+        with self._lock:
+            return sorted((hour, sum(hosts.values())) for hour, hosts in self._hourly.items()
+                          if (since is None or hour + HOUR > since) and (until is None or hour < until))
+
+    def iter_events(self, since=None, until=None):
+        """
+        Yields raw (timestamp, session, host, rule) events in [since, until), oldest
+        segment first. Flushes the buffer first; this reads the segment files.
+        """
+        self.flush()
+        with self._lock:
+            segments = list(self._segments)
+        for day, path in segments:
+            if (since is not None and (day + 1) * DAY <= since) or (until is not None and day * DAY >= until):
+                continue
+            try:
+                events = list(read_segment(path))
+            except FileNotFoundError:
+                continue  # Expired while we were reading
+            for event in events:
+                if (since is None or event[0] >= since) and (until is None or event[0] < until):
+                    yield event
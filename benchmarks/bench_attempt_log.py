@@ -0,0 +1,59 @@
+"""
+Recording rate of AttemptLog under a burst, time for the writer to catch up,
+and the cost of the stats queries once a week of rollups has built up.
+
+Usage: python benchmarks/bench_attempt_log.py [events]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from attempt_log import WEEK, AttemptLog
+
+HOSTS = 2000
+
+
+def run(events=1000000):
+    directory = tempfile.mkdtemp()
+    try:
+        log = AttemptLog(directory, retention_days=100000)
+        hosts = [f"tracker{i}.example.com" for i in range(HOSTS)]
+        now = time.time()
+        # Spread over the last week so the rollups cover 168 hours
+        step = WEEK / events
+        start = time.perf_counter()
+        for i in range(events):
+            host = hosts[i % HOSTS]
+            log.record(host, host, 1, now - WEEK + i * step)
+        recorded = time.perf_counter() - start
+        log.flush()
+        flushed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        top = log.top_hosts_this_week(10, now=now)
+        query = time.perf_counter() - start
+        start = time.perf_counter()
+        hourly = log.hourly_counts(since=now - WEEK)
+        hourly_query = time.perf_counter() - start
+        log.close()
+
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"{events} events: record {events / recorded:,.0f}/s ({recorded / events * 1e6:.2f} us each), "
+              f"on disk after {flushed:.2f}s, {size / events:.1f} bytes/event")
+        print(f"top 10 this week: {query * 1000:.2f}ms (top: {top[0]}), "
+              f"{len(hourly)} hourly buckets: {hourly_query * 1000:.2f}ms")
+
+        start = time.perf_counter()
+        log = AttemptLog(directory, retention_days=100000)
+        print(f"reopen from rollups: {(time.perf_counter() - start) * 1000:.1f}ms")
+        log.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
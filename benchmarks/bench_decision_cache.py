@@ -0,0 +1,85 @@
+"""
+Host verdict cache under skewed traffic: lookups per second through the
+DomainMatcher and the compiled blocklist with and without the cache, the hit
+rate on a Zipf-distributed host stream, and how much of the hot set survives
+a burst of one-off hosts.
+
+The in-memory trie is about as fast as a cache probe once host normalization
+is memoized, so the gain is on the compiled (mmap) blocklist the daemon
+resumes from, and on any matcher slower than a few dict lookups.
+
+Usage: python benchmarks/bench_decision_cache.py [lookups]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from compiled_blocklist import CompiledMatcher, compile_blocklist
+from decision_cache import DECISION_CACHE_SIZE, DecisionCache
+from domain_matcher import DomainMatcher
+
+RULES = 100000
+DISTINCT_HOSTS = 50000
+ZIPF_S = 1.1
+
+
+def zipf_stream(count, rng):
+    """Host names drawn with probability proportional to 1 / rank^ZIPF_S."""
+    hosts = [f"www.site{i}.example{i % 97}.com" if i % 3 else f"cdn{i}.static.net" for i in range(DISTINCT_HOSTS)]
+    weights = [1 / (rank + 1) ** ZIPF_S for rank in range(DISTINCT_HOSTS)]
+    return rng.choices(hosts, weights, k=count)
+
+
+def rate(matcher, stream):
+    match = matcher.match
+    start = time.perf_counter()
+    for host in stream:
+        match(host)
+    return len(stream) / (time.perf_counter() - start)
+
+
+def run(lookups=500000):
+    rng = random.Random(21)
+    rules = [f"site{i}.example{i % 97}.com" for i in range(0, 2 * RULES, 2)]
+    stream = zipf_stream(lookups, rng)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "blocklist.bin")
+        compile_blocklist(rules, path)
+        for name, matcher in (("trie", DomainMatcher(rules)), ("compiled", CompiledMatcher(path))):
+            plain = rate(matcher, stream)
+            cache = DecisionCache()
+            cached = rate(cache.view(matcher), stream)
+            stats = cache.stats()
+            print(f"{name:>8}: {plain:>10,.0f} lookups/s uncached, {cached:>10,.0f} cached "
+                  f"({cached / plain:.1f}x, hit rate {stats['hit_rate']:.1%}, {stats['size']} entries)")
+
+        # A burst of one-off hosts between two rounds of the hot set
+        cache = DecisionCache()
+        view = cache.view(DomainMatcher(rules))
+        hot = stream[:DECISION_CACHE_SIZE * 4]
+        for host in hot:
+            view.match(host)
+        for i in range(DECISION_CACHE_SIZE * 5):
+            view.match(f"random{i}.tracker.example")
+        before = cache.misses
+        for host in hot:
+            view.match(host)
+        print(f"after {DECISION_CACHE_SIZE * 5} one-off hosts: {1 - (cache.misses - before) / len(hot):.1%} "
+              f"of the hot stream still hits, {cache.rejected} one-offs not admitted")
+
+        start = time.perf_counter()
+        for _ in range(100000):
+            cache.invalidate()
+        print(f"invalidate: {(time.perf_counter() - start) / 100000 * 1e9:.0f} ns")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
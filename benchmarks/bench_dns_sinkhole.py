@@ -0,0 +1,51 @@
+"""
+Query rate and per-query overhead of the DNS sinkhole against a local stub upstream.
+
+Usage: python benchmarks/bench_dns_sinkhole.py [queries]
+"""
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tests')))
+
+from dns_sinkhole import DnsSinkhole
+from domain_matcher import DomainMatcher
+from test_dns_sinkhole import StubUpstream, make_query
+
+
+def measure(sock, address, queries):
+    start = time.perf_counter()
+    for query in queries:
+        sock.sendto(query, address)
+        sock.recvfrom(512)
+    return time.perf_counter() - start
+
+
+def run(count=20000):
+    upstream = StubUpstream()
+    sinkhole = DnsSinkhole(listen=("127.0.0.1", 0), upstream=upstream.address)
+    sinkhole.start(DomainMatcher(f"blocked{i}.com" for i in range(100000)))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(5)
+
+    cases = [
+        ("stub upstream direct", upstream.address, [make_query("cached.com", i & 0xFFFF) for i in range(count)]),
+        ("sinkhole cached", sinkhole.address, [make_query("cached.com", i & 0xFFFF) for i in range(count)]),
+        ("sinkhole blocked", sinkhole.address, [make_query(f"www.blocked{i % 1000}.com", i & 0xFFFF) for i in range(count)]),
+        ("sinkhole uncached", sinkhole.address, [make_query(f"host{i}.example.org", i & 0xFFFF) for i in range(count // 4)]),
+    ]
+    try:
+        for name, address, queries in cases:
+            elapsed = measure(sock, address, queries)
+            print(f"{name:<22} {len(queries) / elapsed:9.0f} q/s  {elapsed / len(queries) * 1e6:7.1f} us/query")
+    finally:
+        sock.close()
+        sinkhole.stop()
+        upstream.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,48 @@
+"""
+Lookup latency of DomainMatcher as the rule count grows.
+
+Usage: python benchmarks/bench_domain_matcher.py [max_rules]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from domain_matcher import DomainMatcher
+
+TLDS = ["com", "net", "org", "io", "co.uk", "de"]
+LOOKUPS = 200000
+
+
+def make_domains(count, seed=1):
+    rng = random.Random(seed)
+    return [f"site{i}-{rng.randrange(1 << 30):x}.{TLDS[i % len(TLDS)]}" for i in range(count)]
+
+
+def run(max_rules=1000000):
+    domains = make_domains(max_rules)
+    rng = random.Random(2)
+    size = 1000
+    while size <= max_rules:
+        rules = domains[:size]
+        start = time.perf_counter()
+        matcher = DomainMatcher(rules)
+        build = time.perf_counter() - start
+
+        hits = [f"m.{rng.choice(rules)}" for _ in range(LOOKUPS // 2)]
+        misses = [f"www.other{i}.com" for i in range(LOOKUPS // 2)]
+        hosts = hits + misses
+        rng.shuffle(hosts)
+
+        start = time.perf_counter()
+        for host in hosts:
+            matcher.is_blocked(host)
+        elapsed = time.perf_counter() - start
+        print(f"{size:>9} rules  build {build:7.2f}s  lookup {elapsed / len(hosts) * 1e9:7.0f} ns/op")
+        size *= 10
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
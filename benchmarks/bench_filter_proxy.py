@@ -0,0 +1,125 @@
+"""
+Local load test for the filtering proxy.
+
+Reports CONNECT tunnels/s for many concurrent short-lived clients, bulk
+tunnel throughput, and keep-alive plain HTTP requests/s.
+
+Usage: python benchmarks/bench_filter_proxy.py [concurrency]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from domain_matcher import DomainMatcher
+from filter_proxy import FilterProxy
+
+TUNNELS = 2000
+BULK_BYTES = 256 * 1024 * 1024
+HTTP_REQUESTS = 5000
+HTTP_BODY = b"x" * 1024
+
+
+async def echo(reader, writer):
+    while True:
+        data = await reader.read(262144)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+    writer.close()
+
+
+async def sink(reader, writer):
+    total = 0
+    while True:
+        data = await reader.read(262144)
+        if not data:
+            break
+        total += len(data)
+    writer.write(str(total).encode())
+    writer.close()
+
+
+async def origin(reader, writer):
+    try:
+        while True:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(HTTP_BODY) + HTTP_BODY)
+    except asyncio.IncompleteReadError:
+        writer.close()
+
+
+async def open_tunnel(proxy_addr, port):
+    reader, writer = await asyncio.open_connection(*proxy_addr)
+    writer.write(f"CONNECT 127.0.0.1:{port} HTTP/1.1\r\n\r\n".encode())
+    await reader.readuntil(b"\r\n\r\n")
+    return reader, writer
+
+
+async def tunnel_rate(proxy_addr, port, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            reader, writer = await open_tunnel(proxy_addr, port)
+            writer.write(b"ping")
+            await reader.readexactly(4)
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(TUNNELS)))
+    return TUNNELS / (time.perf_counter() - start)
+
+
+async def throughput(proxy_addr, port):
+    reader, writer = await open_tunnel(proxy_addr, port)
+    chunk = b"\0" * 1048576
+    start = time.perf_counter()
+    for _ in range(BULK_BYTES // len(chunk)):
+        writer.write(chunk)
+        await writer.drain()
+    writer.write_eof()
+    total = int(await reader.read())
+    return total / (time.perf_counter() - start) / 1e6
+
+
+async def http_rate(proxy_addr, port, concurrency):
+    async def client(count):
+        reader, writer = await asyncio.open_connection(*proxy_addr)
+        request = f"GET http://127.0.0.1:{port}/ HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode()
+        for _ in range(count):
+            writer.write(request)
+            await reader.readuntil(b"\r\n\r\n")
+            await reader.readexactly(len(HTTP_BODY))
+        writer.close()
+
+    clients = min(concurrency, 50)
+    start = time.perf_counter()
+    await asyncio.gather(*(client(HTTP_REQUESTS // clients) for _ in range(clients)))
+    return HTTP_REQUESTS / (time.perf_counter() - start)
+
+
+async def main(concurrency):
+    servers = [await asyncio.start_server(handler, "127.0.0.1", 0) for handler in (echo, sink, origin)]
+    echo_port, sink_port, origin_port = (s.sockets[0].getsockname()[1] for s in servers)
+    proxy = FilterProxy(listen=("127.0.0.1", 0))
+    proxy.start(DomainMatcher(f"blocked{i}.com" for i in range(100000)))
+    try:
+        print(f"tunnels        {await tunnel_rate(proxy.address, echo_port, concurrency):9.0f} conn/s "
+              f"({concurrency} concurrent)")
+        print(f"tunnel bulk    {await throughput(proxy.address, sink_port):9.1f} MB/s")
+        print(f"http keepalive {await http_rate(proxy.address, origin_port, concurrency):9.0f} req/s "
+              f"(upstream connections reused: {proxy._pool.reused})")
+    finally:
+        proxy.stop()
+        # Let the servers see the pooled connections close before the loop ends
+        await asyncio.sleep(0.2)
+        for server in servers:
+            server.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
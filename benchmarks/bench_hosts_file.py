@@ -0,0 +1,59 @@
+"""
+Hosts file enforcement on a large blocklist: the time to apply added or
+removed sites by writing only the difference, against regenerating the whole
+managed section.
+
+Usage: python benchmarks/bench_hosts_file.py [rules]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from domain_matcher import DomainMatcher
+from hosts_file import HostsFileBackend
+
+CHANGES = 20
+
+
+def timed(action, count=CHANGES):
+    start = time.perf_counter()
+    for i in range(count):
+        action(i)
+    return (time.perf_counter() - start) / count
+
+
+def run(count=150000):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "hosts")
+        with open(path, "w") as f:
+            f.write("127.0.0.1 localhost\n::1 localhost\n")
+        rules = [f"site{i}.example{i % 97}.com" for i in range(count)]
+        backend = HostsFileBackend(path)
+        start = time.perf_counter()
+        backend.start(DomainMatcher(rules))
+        print(f"{count} rules: {os.path.getsize(path) / 1e6:.1f} MB, "
+              f"{len(backend.hosts()) * len(backend.addresses)} lines written in {time.perf_counter() - start:.2f}s")
+
+        full = timed(lambda i: backend._write_full(), 5)
+        add = timed(lambda i: backend.apply_changes(None, [f"new{i}.example.com"], []))
+        remove = timed(lambda i: backend.apply_changes(None, [], [rules[i * (count // CHANGES)]]))
+        many = timed(lambda i: backend.apply_changes(None, [], rules[-(i + 1) * 1000:][:1000]), 5)
+        print(f"full rewrite:       {full * 1000:7.1f} ms")
+        print(f"diff, add 1:        {add * 1000:7.1f} ms ({full / add:.1f}x faster, block copy)")
+        print(f"diff, remove 1:     {remove * 1000:7.1f} ms ({full / remove:.1f}x faster, block copy)")
+        print(f"diff, remove 1000:  {many * 1000:7.1f} ms ({full / many:.1f}x faster, line by line)")
+        start = time.perf_counter()
+        backend.apply_changes(None, [rules[1]], [])
+        print(f"no-op change:       {(time.perf_counter() - start) * 1e6:7.1f} us (file untouched)")
+        backend.stop()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 150000)
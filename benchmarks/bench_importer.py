@@ -0,0 +1,55 @@
+"""
+Throughput of the streaming blocklist importer on a generated hosts file.
+
+Usage: python benchmarks/bench_importer.py [entries]
+"""
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from importer import import_sites
+from models import DataManager
+from sqlite_backend import SqliteBackend
+
+
+def write_hosts(path, entries):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt") as f:
+        f.write("# Generated hosts file\n127.0.0.1 localhost\n")
+        for i in range(entries):
+            f.write(f"0.0.0.0 ads{i}.tracker{i % 997}.example.com\n")
+            if i % 10 == 0:
+                # Duplicates, as merged public lists have
+                f.write(f"0.0.0.0 ads{i // 2}.tracker{(i // 2) % 997}.example.com\n")
+
+
+def run(entries=200000):
+    directory = tempfile.mkdtemp()
+    try:
+        for name in ("hosts.txt", "hosts.txt.gz"):
+            source = os.path.join(directory, name)
+            write_hosts(source, entries)
+            for label, make in (
+                    ("json", lambda: DataManager(os.path.join(directory, "data.json"))),
+                    ("sqlite", lambda: DataManager(backend=SqliteBackend(os.path.join(directory, "data.db"))))):
+                dm = make()
+                start = time.perf_counter()
+                stats = import_sites(dm, [source])
+                dm.close()
+                total = time.perf_counter() - start
+                print(f"{name:>13} -> {label:<6} {stats.lines_per_second:>10,.0f} lines/s  "
+                      f"{stats.added} added  {total:.2f}s incl. close")
+                for leftover in os.listdir(directory):
+                    if leftover.startswith("data"):
+                        os.remove(os.path.join(directory, leftover))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,53 @@
+"""
+Cost of recording a metric, enabled and disabled, next to the lookup it
+instruments. Recording should stay well under a microsecond.
+
+Usage: python benchmarks/bench_metrics.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from domain_matcher import DomainMatcher
+from metrics import Registry
+
+
+def measure(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def run(iterations=1000000):
+    registry = Registry()
+    lookups = registry.counter("lookups_total", "Lookups")
+    blocks = registry.labeled_counter("blocks_total", "Blocks", "rule")
+    latency = registry.histogram("latency_seconds", "Latency")
+    matcher = DomainMatcher(f"site{i}.com" for i in range(10000))
+
+    def baseline():
+        pass
+
+    def timed():
+        with latency.time():
+            pass
+
+    cases = [
+        ("counter.inc()", lookups.inc),
+        ("labeled.inc(rule)", lambda: blocks.inc("site42.com")),
+        ("histogram.observe()", lambda: latency.observe(0.0003)),
+        ("histogram.time()", timed),
+        ("matcher.match() (reference)", lambda: matcher.match("www.site42.com")),
+    ]
+    empty = measure(baseline, iterations)
+    for state in ("enabled", "disabled"):
+        for name, fn in cases:
+            print(f"{state:>8}  {name:<28} {measure(fn, iterations) - empty:7.1f} ns/op")
+        registry.disable()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,82 @@
+"""
+Compiling a very large blocklist in-process against a pool of worker
+processes, checking that every worker count writes the same file. Also times
+the two parallel rounds one shard at a time, for the speedup to expect where
+each worker gets a CPU of its own.
+
+Usage: python benchmarks/bench_parallel_compile.py [rules ...] [--workers N ...]
+"""
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from compiled_blocklist import (_encoded_records, _pack_encoded, available_cpus, compile_blocklist)
+
+
+def make_rules(count):
+    rules = [f"host{i}.tracker{i % 5003}.example{i % 89}.net" for i in range(count)]
+    # Some rules in the other modes, and duplicates to drop
+    rules[::50] = [f"=exact{i}.example.org" for i in range(len(rules[::50]))]
+    rules[1::50] = [f"*.wild{i}.example.org" for i in range(len(rules[1::50]))]
+    rules[2::25] = rules[3::25][:len(rules[2::25])]
+    return rules
+
+
+def timed(action):
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+def shard_times(rules, workers):
+    """
+    Runs the two parallel rounds one shard at a time.
+    :return: (seconds for all shards, seconds for the slowest shard of each round)
+    """
+    size = -(-len(rules) // workers)
+    slices = [rules[i:i + size] for i in range(0, len(rules), size)]
+    encoded, first = [], []
+    for part in slices:
+        first.append(timed(lambda: encoded.append(_encoded_records(part, workers))))
+    second = [timed(lambda: _pack_encoded(bucket)) for bucket in zip(*encoded)]
+    return sum(first) + sum(second), max(first) + max(second)
+
+
+def run(sizes=(1000000, 5000000), worker_counts=(2, 4)):
+    directory = tempfile.mkdtemp()
+    print(f"{available_cpus()} CPUs available")
+    try:
+        for count in sizes:
+            rules = make_rules(count)
+            single = os.path.join(directory, "single.bin")
+            base = timed(lambda: compile_blocklist(rules, single, workers=1))
+            print(f"{count:>9} rules  1 worker (in-process) {base:6.2f}s")
+            for workers in worker_counts:
+                path = os.path.join(directory, f"pool{workers}.bin")
+                elapsed = timed(lambda: compile_blocklist(rules, path, workers=workers))
+                assert filecmp.cmp(single, path, shallow=False), "parallel compile wrote a different file"
+                line = f"{'':>15}{workers} workers {elapsed:16.2f}s ({base / elapsed:.2f}x)"
+                if workers > available_cpus():
+                    # The shards took turns on too few CPUs: keep the measured serial part (splitting,
+                    # transfers, concatenation) and count only the slowest shard of each round
+                    total, slowest = shard_times(rules, workers)
+                    estimate = elapsed - total + slowest
+                    line += f"; with a CPU each ~{estimate:.2f}s ({base / estimate:.2f}x)"
+                print(line)
+            del rules
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", nargs="*", type=int, default=[1000000, 5000000])
+    parser.add_argument("--workers", nargs="*", type=int, default=[2, 4])
+    args = parser.parse_args()
+    run(args.sizes, args.workers)
@@ -0,0 +1,65 @@
+"""
+Query cost of Schedule as the number of schedules grows. Compile time grows
+with the schedule count; is_required and next_transition should stay flat.
+
+Usage: python benchmarks/bench_scheduler.py [max_schedules]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scheduler import DAY, Schedule
+
+QUERIES = 50000
+
+
+def make_schedules(count, seed=1):
+    rng = random.Random(seed)
+    origin = datetime(2030, 1, 7)
+    schedules = []
+    for i in range(count):
+        start = rng.randrange(24 * 60)
+        if i % 2:
+            end = (start + rng.randrange(1, 180)) % (24 * 60)
+            schedules.append({"type": "weekly", "days": rng.sample(range(7), rng.randint(1, 3)),
+                              "start": f"{start // 60:02}:{start % 60:02}",
+                              "end": f"{end // 60:02}:{end % 60:02}"})
+        else:
+            begin = origin + timedelta(days=rng.randrange(365), minutes=start)
+            schedules.append({"type": "once", "start": begin.isoformat(),
+                              "end": (begin + timedelta(minutes=rng.randrange(1, 180))).isoformat()})
+    return schedules
+
+
+def run(max_schedules=100000):
+    rng = random.Random(2)
+    origin = datetime(2030, 1, 7).timestamp()
+    times = [origin + rng.randrange(365 * DAY) for _ in range(QUERIES)]
+    size = 10
+    while size <= max_schedules:
+        schedules = make_schedules(size)
+        start = time.perf_counter()
+        schedule = Schedule(schedules)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for t in times:
+            schedule.is_required(t)
+        required = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for t in times:
+            schedule.next_transition(t)
+        transition = time.perf_counter() - start
+        print(f"{size:>8} schedules  compile {build * 1000:8.1f}ms  "
+              f"is_required {required / QUERIES * 1e6:5.2f} us/op  "
+              f"next_transition {transition / QUERIES * 1e6:5.2f} us/op")
+        size *= 10
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
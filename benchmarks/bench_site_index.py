@@ -0,0 +1,48 @@
+"""
+Search-as-you-type latency of SiteIndex, and the cost of the RecycleView data
+rebuild that follows each keystroke.
+
+Usage: python benchmarks/bench_site_index.py [sites]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from site_index import SiteIndex
+
+TLDS = ["com", "net", "org", "io", "co.uk", "de"]
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def run(count=100000):
+    rng = random.Random(1)
+    sites = [f"site{i}-{rng.randrange(1 << 20):x}.{TLDS[i % len(TLDS)]}" for i in range(count)]
+    start = time.perf_counter()
+    index = SiteIndex(sites)
+    print(f"{count} sites  build {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    # Typing "site12" one key at a time, then substring-only queries
+    for query in ("s", "si", "sit", "site", "site1", "site12", "-ab", ".co.uk", "zzz"):
+        elapsed, results = timed(lambda: index.search(query))
+        rows, _ = timed(lambda: [{"text": site} for site in results])
+        print(f"  search {query!r:>9}  {elapsed * 1000:7.2f}ms  {len(results):>6} hits  "
+              f"+ rows {rows * 1000:6.2f}ms")
+
+    elapsed, _ = timed(lambda: (index.add("zz-new.example.com"), index.remove("zz-new.example.com")), 1000)
+    print(f"  add+remove {elapsed * 1e6:.1f}us")
+    elapsed, _ = timed(lambda: (index.add("zz-new.example.com"), index.search("-ab"),
+                                index.remove("zz-new.example.com")), 20)
+    print(f"  add+substring search (blob rebuild) {elapsed * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
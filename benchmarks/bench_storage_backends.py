@@ -0,0 +1,72 @@
+"""
+Compares the JSON, journaled JSON and SQLite DataManager backends.
+
+For each blocklist size it measures bulk load, cold open, membership checks,
+a single add+remove at that size, and fetching one 50-entry page by prefix.
+
+Usage: python benchmarks/bench_storage_backends.py [sizes...]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models import DataManager
+from sqlite_backend import SqliteBackend
+
+SIZES = [10000, 100000, 1000000]
+CHECKS = 20000
+EDITS = 3
+
+
+def backends(directory):
+    json_file = os.path.join(directory, "plain.json")
+    journal_file = os.path.join(directory, "journaled.json")
+    db_file = os.path.join(directory, "sites.db")
+    return [
+        ("json", lambda: DataManager(data_file=json_file)),
+        ("journaled", lambda: DataManager(data_file=journal_file, journaled=True)),
+        ("sqlite", lambda: DataManager(backend=SqliteBackend(db_file))),
+    ]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def run(sizes):
+    print(f"{'backend':<10} {'sites':>8} {'bulk add':>9} {'open':>8} {'has_site':>10} {'add+remove':>11} {'page':>9}")
+    for size in sizes:
+        sites = [f"site{i}.example{i % 97}.com" for i in range(size)]
+        directory = tempfile.mkdtemp(prefix="refocus-bench-")
+        try:
+            for name, make in backends(directory):
+                dm = make()
+                bulk, _ = timed(lambda: dm.add_sites(sites))
+                dm.close()
+
+                open_time, dm = timed(make)
+                probes = sites[::max(1, size // CHECKS)][:CHECKS]
+                check, _ = timed(lambda: [dm.has_site(site) for site in probes])
+
+                def edit():
+                    for i in range(EDITS):
+                        dm.add_site(f"new{i}.org")
+                        dm.remove_site(f"new{i}.org")
+                edit_time, _ = timed(edit)
+                page, _ = timed(lambda: dm.get_blocked_sites(limit=50, prefix="site12"))
+                dm.close()
+                print(f"{name:<10} {size:>8} {bulk:>8.2f}s {open_time:>7.2f}s "
+                      f"{check / len(probes) * 1e6:>8.2f}us {edit_time / EDITS * 1e3:>9.2f}ms "
+                      f"{page * 1e3:>7.2f}ms")
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or SIZES)
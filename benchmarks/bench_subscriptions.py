@@ -0,0 +1,69 @@
+"""
+Refreshing a large subscribed blocklist: an unchanged list (validators, then
+content hash) against a list with a few changed entries merged as a delta into
+storage and a running session, against rebuilding the session blocklist.
+
+Usage: python benchmarks/bench_subscriptions.py [sites]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from blocking_service import BlockingService
+from domain_matcher import DomainMatcher
+from models import DataManager
+from subscriptions import SubscriptionManager
+
+CHANGED = 100
+
+
+def write_list(path, sites):
+    with open(path, "w") as f:
+        f.writelines(f"0.0.0.0 {site}\n" for site in sites)
+
+
+def timed(action):
+    start = time.perf_counter()
+    result = action()
+    return time.perf_counter() - start, result
+
+
+def run(count=100000):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "list.txt")
+        sites = [f"site{i}.example{i % 97}.com" for i in range(count)]
+        write_list(path, sites)
+        dm = DataManager(os.path.join(directory, "user_data.json"), journaled=True)
+        manager = SubscriptionManager(dm)
+        dm.add_subscription("big", path)
+        first, _ = timed(manager.refresh)
+        service = BlockingService(dm)
+        service.start_blocking(30, [], strict=False)
+        print(f"{count} sites: first refresh {first:.2f}s")
+
+        not_modified, outcome = timed(lambda: manager.refresh(["big"]))
+        print(f"not modified:       {not_modified * 1000:8.1f} ms ({outcome['big']})")
+        os.utime(path)
+        unchanged, outcome = timed(lambda: manager.refresh(["big"]))
+        print(f"same content:       {unchanged * 1000:8.1f} ms ({outcome['big']}, hashed but not parsed)")
+
+        sites[:CHANGED] = [f"new{i}.example.com" for i in range(CHANGED)]
+        write_list(path, sites)
+        delta, outcome = timed(lambda: (manager.refresh(["big"]), service.is_active()))
+        assert service.is_blocked("new1.example.com") and not service.is_blocked("site1.example1.com")
+        print(f"{CHANGED} replaced:       {delta * 1000:8.1f} ms (fetch, parse, delta merge, session updated)")
+        rebuild, _ = timed(lambda: DomainMatcher(dm.get_all_sites()))
+        print(f"session rebuild:    {rebuild * 1000:8.1f} ms (what a full resync costs on top of fetch and parse)")
+        service.stop_blocking(force=True)
+        dm.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,98 @@
+"""
+Load generator for the daemon's query API.
+
+Runs concurrent client processes that send batched check() requests and
+reports lookups/s and request latency. Without --socket it starts an
+in-process daemon with an active session over a generated blocklist.
+
+Usage: python benchmarks/daemon_load.py [--socket PATH] [--clients 4] [--batch 100]
+                                         [--pipeline 1] [--duration 5] [--sites 100000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from daemon_client import DaemonClient
+
+
+def client_worker(socket_path, batch, pipeline, duration, seed, results):
+    rng = random.Random(seed)
+    hosts = [f"www.site{rng.randrange(200000)}.example.com" for _ in range(batch * 16)]
+    batches = [hosts[i:i + batch] for i in range(0, len(hosts), batch)]
+    client = DaemonClient(socket_path)
+    latencies = []
+    lookups = 0
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        group = [batches[(i + j) % len(batches)] for j in range(pipeline)]
+        i += pipeline
+        start = time.perf_counter()
+        client.check_many(group)
+        latencies.append(time.perf_counter() - start)
+        lookups += batch * pipeline
+    client.close()
+    results.put((lookups, latencies))
+
+
+def start_local_daemon(directory, sites):
+    from blocking_service import BlockingService
+    from daemon import BlockingDaemon
+    service = BlockingService()
+    service.start_blocking(60, [f"site{i}.example.com" for i in range(sites)], strict=False)
+    daemon = BlockingDaemon(service, socket_path=os.path.join(directory, "refocus.sock"))
+    daemon.start()
+    return daemon
+
+
+def run(args):
+    directory = tempfile.mkdtemp()
+    daemon = None
+    socket_path = args.socket
+    try:
+        if not socket_path:
+            daemon = start_local_daemon(directory, args.sites)
+            socket_path = daemon.socket_path
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=client_worker,
+                                           args=(socket_path, args.batch, args.pipeline, args.duration, seed, results))
+                   for seed in range(args.clients)]
+        for worker in workers:
+            worker.start()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+    finally:
+        if daemon:
+            daemon.stop()
+        shutil.rmtree(directory)
+
+    lookups = sum(count for count, _ in collected)
+    latencies = sorted(latency for _, series in collected for latency in series)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{args.clients} clients  batch {args.batch}  pipeline {args.pipeline}: "
+          f"{lookups / args.duration:,.0f} lookups/s  "
+          f"request p50 {p50 * 1000:.2f}ms  p99 {p99 * 1000:.2f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", help="Daemon socket; default starts a local daemon")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=100, help="Hosts per check() request")
+    parser.add_argument("--pipeline", type=int, default=1, help="Requests in flight per client")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--sites", type=int, default=100000, help="Blocklist size for the local daemon")
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
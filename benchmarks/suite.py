@@ -0,0 +1,345 @@
+"""
+Benchmark suite: persistence, add_site, session state checks, host matching,
+URL rule matching, hosts file updates and headless app startup, in one run
+with machine-readable results.
+
+Every measurement is a named value with a unit and a direction (lower or
+higher is better). Results can be written as JSON and compared against an
+earlier run; a measurement that got worse by more than the threshold is a
+regression and makes the exit status 1.
+
+Usage: python benchmarks/suite.py [--quick] [--only NAME[,NAME]] [--output results.json]
+                                  [--baseline baseline.json] [--threshold 0.2]
+
+    # Record a baseline, then check a change against it
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --baseline baseline.json
+
+--output - prints the JSON to stdout (and the table to stderr).
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from blocking_service import BlockingService
+from domain_matcher import DomainMatcher
+from hosts_file import HostsFileBackend
+from models import DEFAULT_DATA, DataManager
+from sqlite_backend import SqliteBackend
+from url_rules import UrlRuleEngine, url_text
+
+FORMAT_VERSION = 1
+THRESHOLD = 0.2
+
+LOWER = "lower"
+HIGHER = "higher"
+
+
+def result(name, value, unit, better=LOWER):
+    return {"name": name, "value": value, "unit": unit, "better": better}
+
+
+def best_of(repeat, fn):
+    """:return: Shortest of `repeat` timed runs of fn(), in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_sites(count, offset=0):
+    return [f"site{i}.example{i % 97}.com" for i in range(offset, offset + count)]
+
+
+def write_data_file(path, sites):
+    data = json.loads(json.dumps(DEFAULT_DATA))
+    data["blocked_sites"] = sites
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+
+
+def bench_persistence(directory, quick):
+    """Cold load and full save of the JSON data file as the blocklist grows."""
+    for size in ([1000, 10000] if quick else [1000, 10000, 100000]):
+        path = os.path.join(directory, f"load{size}.json")
+        write_data_file(path, make_sites(size))
+        repeat = 3 if size > 10000 else 5
+        yield result(f"persistence.load[sites={size}]", best_of(repeat, lambda: DataManager(path)), "s")
+        dm = DataManager(path)
+        yield result(f"persistence.save[sites={size}]", best_of(repeat, dm.save_data), "s")
+        dm.close()
+
+
+def add_site_backends(directory, size):
+    base = os.path.join(directory, f"add{size}")
+    return [
+        ("json-batch", lambda: DataManager(base + "-batch.json")),
+        ("journaled", lambda: DataManager(base + "-journal.json", journaled=True)),
+        ("write-behind", lambda: DataManager(base + "-behind.json", write_behind=True)),
+        ("sqlite", lambda: DataManager(backend=SqliteBackend(base + ".db"))),
+    ]
+
+
+def bench_add_site(directory, quick):
+    """
+    Per-call cost of add_site into lists of growing size. A per-call time that
+    grows with the existing list means bulk adds have gone quadratic.
+    """
+    adds = 500 if quick else 2000
+    for size in ([0, 10000] if quick else [0, 10000, 100000]):
+        new_sites = make_sites(adds, offset=size)
+        for mode, open_manager in add_site_backends(directory, size):
+            dm = open_manager()
+            dm.add_sites(make_sites(size))
+            dm.flush()
+            start = time.perf_counter()
+            if mode == "json-batch":
+                with dm.batch():
+                    for url in new_sites:
+                        dm.add_site(url)
+            else:
+                for url in new_sites:
+                    dm.add_site(url)
+            dm.flush()
+            elapsed = time.perf_counter() - start
+            dm.close()
+            yield result(f"add_site[{mode},existing={size}]", elapsed / adds * 1e6, "us/op")
+
+
+def bench_state_checks(directory, quick):
+    """Call rates of is_active and get_remaining_time during a session."""
+    calls = 20000 if quick else 200000
+    dm = DataManager(os.path.join(directory, "state.json"))
+    service = BlockingService(dm)
+    service.start_blocking(60, make_sites(100), strict=False)
+    try:
+        for name, fn in (("is_active", service.is_active), ("get_remaining_time", service.get_remaining_time)):
+            def loop():
+                for _ in range(calls):
+                    fn()
+            yield result(f"state.{name}", calls / best_of(3, loop), "calls/s", HIGHER)
+    finally:
+        service.stop_blocking(force=True)
+        dm.close()
+
+
+def bench_matching(directory, quick):
+    """Host lookups per second, straight on the matcher and through the service."""
+    rules = make_sites(10000 if quick else 100000)
+    hosts = [f"www.{site}" if i % 2 else f"other{i}.example.net" for i, site in enumerate(rules[:20000])]
+    matcher = DomainMatcher(rules)
+
+    def direct():
+        for host in hosts:
+            matcher.is_blocked(host)
+    yield result(f"match.matcher[rules={len(rules)}]", len(hosts) / best_of(3, direct), "hosts/s", HIGHER)
+
+    dm = DataManager(os.path.join(directory, "match.json"))
+    service = BlockingService(dm)
+    service.start_blocking(60, rules, strict=False)
+    try:
+        def single():
+            for host in hosts:
+                service.is_blocked(host)
+        yield result(f"match.is_blocked[rules={len(rules)}]", len(hosts) / best_of(3, single), "hosts/s", HIGHER)
+        yield result(f"match.check_hosts[rules={len(rules)}]",
+                     len(hosts) / best_of(3, lambda: service.check_hosts(hosts)), "hosts/s", HIGHER)
+    finally:
+        service.stop_blocking(force=True)
+        dm.close()
+
+
+def bench_url_rules(directory, quick):
+    """Compiling URL rules, scanning URLs against them and changing one rule."""
+    size = 1000 if quick else 10000
+    rules = [f"/{word}{i}/" for i, word in enumerate(["shorts", "reels", "feed", "story"] * (size // 4))]
+    urls = [url_text(f"www.site{i % 500}.example.com", f"/feed/item{i}?ref=home") for i in range(20000)]
+    yield result(f"url_rules.compile[rules={size}]", best_of(3, lambda: UrlRuleEngine(rules)), "s")
+    engine = UrlRuleEngine(rules)
+
+    def scan():
+        for url in urls:
+            engine.match(url)
+    yield result(f"url_rules.match[rules={size}]", len(urls) / best_of(3, scan), "urls/s", HIGHER)
+
+    def change():
+        engine.add("/extra/rule")
+        engine.remove("/extra/rule")
+    yield result(f"url_rules.add_remove[rules={size}]", best_of(5, change), "s")
+
+
+def bench_hosts_file(directory, quick):
+    """Writing the hosts file section, then applying one added and one removed site to it."""
+    rules = make_sites(10000 if quick else 150000)
+    path = os.path.join(directory, "hosts")
+    backend = HostsFileBackend(path)
+    backend.start(DomainMatcher(rules))
+    try:
+        yield result(f"hosts_file.full[rules={len(rules)}]", best_of(3, backend._write_full), "s")
+        counter = itertools.count()
+
+        def add():
+            backend.apply_changes(None, [f"new{next(counter)}.example.com"], [])
+        yield result(f"hosts_file.diff_add[rules={len(rules)}]", best_of(5, add), "s")
+        removals = iter(rules)
+        yield result(f"hosts_file.diff_remove[rules={len(rules)}]",
+                     best_of(5, lambda: backend.apply_changes(None, [], [next(removals)])), "s")
+    finally:
+        backend.stop()
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import main
+imported = time.perf_counter()
+app = main.RefocusApp()
+app.fast_start = {fast!r}
+layout = app.build()
+shown = time.perf_counter()
+if app.fast_start:
+    # Run the deferred phases back to back, as Clock would on the next frames
+    app._on_first_frame(0)
+    app._load_data(0)
+    app._build_body(0)
+ready = time.perf_counter()
+app.on_stop()
+print(json.dumps({{"import": imported - start, "shown": shown - start, "ready": ready - start}}))
+"""
+
+
+def bench_startup(directory, quick):
+    """
+    Headless RefocusApp start in a fresh interpreter: time to the first frame's
+    layout (shown) and to a fully built screen with data loaded (ready).
+    """
+    size = 10000
+    os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+    write_data_file(os.path.join(directory, "data", "user_data.json"), make_sites(size))
+    env = dict(os.environ, KIVY_NO_WINDOW="1", KIVY_NO_ARGS="1", KIVY_NO_CONSOLELOG="1")
+    for fast in (True, False):
+        runs = []
+        for _ in range(2 if quick else 5):
+            out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(root=ROOT, fast=fast)],
+                                 cwd=directory, env=env, capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        mode = "fast" if fast else "eager"
+        for phase in ("import", "shown", "ready"):
+            if phase == "import" and not fast:
+                continue
+            yield result(f"startup.{phase}[{mode},sites={size}]", min(run[phase] for run in runs), "s")
+
+
+BENCHMARKS = {
+    "persistence": bench_persistence,
+    "add_site": bench_add_site,
+    "state": bench_state_checks,
+    "matching": bench_matching,
+    "url_rules": bench_url_rules,
+    "hosts_file": bench_hosts_file,
+    "startup": bench_startup,
+}
+
+
+def run(names=None, quick=False, log=print):
+    """
+    Runs the named benchmarks (all by default), each in its own scratch directory.
+    :return: Results document, as written by --output
+    """
+    results = []
+    for name in names or BENCHMARKS:
+        directory = tempfile.mkdtemp()
+        try:
+            for measurement in BENCHMARKS[name](directory, quick):
+                log(f"{measurement['name']:<45} {measurement['value']:>14.4f} {measurement['unit']}")
+                results.append(measurement)
+        finally:
+            shutil.rmtree(directory)
+    return {
+        "version": FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "quick": quick,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    """
+    Compares two results documents, measurement by measurement.
+    :param threshold: Fractional slowdown tolerated before a change is a regression
+    :return: List of (name, baseline value, current value, change, regressed). change is
+             the fractional slowdown, negative for improvements.
+    """
+    before = {m["name"]: m for m in baseline["results"]}
+    rows = []
+    for measurement in current["results"]:
+        old = before.get(measurement["name"])
+        if old is None or not old["value"] or not measurement["value"]:
+            continue
+        if measurement["better"] == HIGHER:
+            change = old["value"] / measurement["value"] - 1
+        else:
+            change = measurement["value"] / old["value"] - 1
+        rows.append((measurement["name"], old["value"], measurement["value"], change, change > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Refocus benchmark suite.")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes, for a fast smoke run")
+    parser.add_argument("--only", help=f"Comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--output", help="Write the results as JSON to this file ('-' for stdout)")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Slowdown fraction counted as a regression (default %(default)s)")
+    args = parser.parse_args(argv)
+    # Session start/stop log lines would interleave with the results
+    logging.getLogger().setLevel(logging.WARNING)
+
+    names = args.only.split(",") if args.only else None
+    unknown = set(names or ()) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    out = sys.stderr if args.output == "-" else sys.stdout
+    document = run(names, args.quick, log=lambda line: print(line, file=out))
+    if args.output == "-":
+        json.dump(document, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = 0
+    print(f"\nCompared with {args.baseline} (regression threshold {args.threshold:.0%}):", file=out)
+    for name, old, new, change, regressed in compare(document, baseline, args.threshold):
+        regressions += regressed
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<45} {old:>14.4f} -> {new:>14.4f} {change:>+8.1%} {flag}", file=out)
+    print(f"{regressions} regression(s)", file=out)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,54 +1,299 @@
+import itertools
 import logging
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import metrics
+from blocklist_snapshot import BlocklistSnapshot, LayeredMatcher, apply_changes
+from compiled_blocklist import CompiledBlocklistError, ensure_compiled, load_matcher
+from decision_cache import DECISION_CACHE_SIZE, DecisionCache
+from domain_matcher import DomainMatcher
+from url_rules import UrlRuleEngine
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Events passed to on_state_change listeners
+EVENT_START = "start"
+EVENT_STOP = "stop"
+EVENT_EXPIRE = "expire"
+
+LOOKUPS = metrics.labeled_counter("refocus_lookups_total", "Hosts checked against the blocklist", "source")
+BLOCKS = metrics.labeled_counter("refocus_blocks_total", "Blocked lookups by matching rule", "rule")
+CHECK_SECONDS = metrics.histogram("refocus_check_seconds", "Time to check one batch of hosts")
+SESSION_TRANSITIONS = metrics.labeled_counter("refocus_session_transitions_total",
+                                              "Blocking sessions started, stopped or expired", "event")
+
 class BlockingService:
-    def __init__(self, data_manager=None):
+    def __init__(self, data_manager=None, backends=None, compiled_file=None, attempt_log=None,
+                 decision_cache_size=DECISION_CACHE_SIZE):
+        """
+        :param data_manager: DataManager holding the persisted session state
+        :param backends: Enforcement backends (e.g. DnsSinkhole) started and
+                         stopped with the session. Each provides start(matcher) and stop().
+        :param compiled_file: Compiled blocklist (see compiled_blocklist.py) used to resume
+                              a persisted session without loading every site into memory
+        :param attempt_log: AttemptLog recording every blocked lookup, here and in the backends
+        :param decision_cache_size: Hosts whose verdict is cached (see decision_cache.py), 0 to disable
+        """
         self.data_manager = data_manager
+        self.backends = list(backends) if backends else []
+        self.compiled_file = compiled_file
+        self.attempt_log = attempt_log
         self._is_active = False
         self._block_until = None
-        self._blocked_sites = []
-        
+        self._deadline = None  # time.monotonic() value at which the session ends
+        self._strict = True
+        # Verdicts shared by is_blocked, check_hosts and the backends
+        self._decisions = DecisionCache(decision_cache_size)
+        # The session blocklist; replaced, never modified, so readers need no lock
+        self._snapshot = None
+        self._publish(DomainMatcher())
+        # DataManager.sites_generation the session blocklist has caught up with
+        self._sites_generation = None
+        # Kept across sessions, so a changed rule set is patched rather than recompiled
+        self._url_rules = UrlRuleEngine()
+        self._url_rules_generation = None
+        self._listeners = []
+        self._expiry_timer = None
+        self._compile_thread = None
+        self._lock = threading.RLock()
+        # Held depth of _lock, and the events to send once it is released
+        self._lock_depth = 0
+        self._events = []
+        # DataManager.state_generation the in-memory state was last synced with
+        self._state_generation = None
+
         # Sync with persisted state
         if self.data_manager:
+            self._sync_state()
+
+    def on_state_change(self, callback):
+        """
+        Registers callback(event, service), called on EVENT_START, EVENT_STOP and
+        EVENT_EXPIRE. Expiry is reported from a timer thread.
+        :return: A function that unregisters the callback
+        """
+        self._listeners.append(callback)
+        return lambda: self._listeners.remove(callback)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds the lock. State changes made meanwhile queue their events in self._events, which
+        are sent once the outermost holder releases it, so listeners never run under the lock.
+        """
+        events = ()
+        with self._lock:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if not self._lock_depth:
+                    events, self._events = self._events, []
+        for event in events:
+            self._notify(event)
+
+    def _notify(self, event):
+        SESSION_TRANSITIONS.inc(event)
+        for callback in list(self._listeners):
+            try:
+                callback(event, self)
+            except Exception:
+                logging.exception(f"State listener failed on {event}")
+
+    def _sync_state(self):
+        """Re-reads the persisted session, if it changed since we last looked."""
+        generation = getattr(self.data_manager, "state_generation", None)
+        if generation is not None and generation == self._state_generation:
+            return
+        with self._locked():
+            self._state_generation = generation
+
             state = self.data_manager.get_blocking_state()
-            if state.get("blocking_active"):
-                until_str = state.get("block_until")
-                if until_str:
-                    try:
-                        self._block_until = datetime.fromisoformat(until_str)
-                        if datetime.now() > self._block_until:
-                            self.stop_blocking(force=True)
-                        else:
-                            self._is_active = True
-                            self._blocked_sites = self.data_manager.get_blocked_sites()
-                    except ValueError:
-                        self.stop_blocking(force=True)
+            until_str = state.get("block_until")
+            if not state.get("blocking_active") or not until_str:
+                if self._is_active:
+                    self.stop_blocking(force=True)
+                return
+            try:
+                until = datetime.fromisoformat(until_str)
+            except ValueError:
+                self.stop_blocking(force=True)
+                return
+            remaining = (until - datetime.now()).total_seconds()
+            if remaining <= 0:
+                self.stop_blocking(force=True)
+                return
+            self._apply_persisted_session(until, remaining, state.get("strict_mode", True))
+
+    def _sync_url_rules(self):
+        """Applies changes to the DataManager's URL rules, if any since we last looked."""
+        generation = getattr(self.data_manager, "url_rules_generation", None)
+        if generation is not None and generation == self._url_rules_generation:
+            return
+        with self._locked():
+            self._url_rules_generation = generation
+            self._url_rules.update(self.data_manager.get_url_rules())
+
+    def update_url_rules(self, rules):
+        """
+        Replaces the URL rules (see url_rules.py) without a DataManager; with one,
+        they follow its get_url_rules(). Only the difference is recompiled.
+        """
+        with self._locked():
+            self._url_rules.update(rules)
+
+    def _sync_sites(self):
+        """
+        Applies edits to the DataManager's sites, if any since we last looked, to the
+        running session. A strict session keeps blocking sites removed meanwhile.
+        """
+        generation = getattr(self.data_manager, "sites_generation", None)
+        if generation == self._sites_generation:
+            return
+        with self._locked():
+            generation = getattr(self.data_manager, "sites_generation", None)
+            since, self._sites_generation = self._sites_generation, generation
+            changes = None
+            if isinstance(since, int) and hasattr(self.data_manager, "site_changes_since"):
+                changes = self.data_manager.site_changes_since(since)
+            if changes is None:
+                # Removals can't be told apart from sites the session was started with
+                changes = [(self._stored_sites(), ())]
+            current = matcher = self._snapshot.matcher
+            all_added, all_removed = [], []
+            for added, removed in changes:
+                if self._strict:
+                    removed = ()
+                matcher = apply_changes(matcher, added, removed)
+                all_added.extend(added)
+                all_removed.extend(removed)
+            if matcher is not current:
+                self._publish(matcher)
+                self._enforce_blocking((all_added, all_removed))
+                if all_removed and isinstance(matcher, LayeredMatcher):
+                    self._recompile()
+
+    def _recompile(self):
+        """
+        Brings the compiled file up to date with the stored sites on a background thread,
+        for the next session to open. The running one keeps its layered matcher.
+        """
+        if self._compile_thread is not None and self._compile_thread.is_alive():
+            return
+        self._compile_thread = threading.Thread(target=self._compile, name="compile-blocklist", daemon=True)
+        self._compile_thread.start()
+
+    def _compile(self):
+        try:
+            ensure_compiled(self.data_manager, self.compiled_file)
+        except OSError as e:
+            logging.error(f"Could not compile blocklist: {e}")
+
+    def _publish(self, matcher):
+        """Makes matcher the session blocklist, in one reference swap."""
+        previous = self._snapshot
+        # The new view retires every verdict cached for the previous matcher
+        self._snapshot = BlocklistSnapshot(previous.version + 1 if previous else 0, matcher,
+                                           self._decisions.view(matcher))
+
+    def snapshot(self):
+        """
+        :return: The current BlocklistSnapshot. It never changes, so a caller checking
+                 many hosts can hold it for a consistent answer without locking.
+        """
+        return self._snapshot
+
+    def decision_cache_stats(self):
+        """:return: Size, hits, misses and hit rate of the host verdict cache"""
+        return self._decisions.stats()
+
+    def _apply_persisted_session(self, until, remaining, strict):
+        was_active = self._is_active
+        self._block_until = until
+        self._strict = strict
+        self._set_deadline(time.monotonic() + remaining)
+        if not was_active:
+            self._is_active = True
+            self._sites_generation = getattr(self.data_manager, "sites_generation", None)
+            matcher = self._load_compiled_matcher()
+            if matcher is None:
+                matcher = DomainMatcher(self._stored_sites())
+            self._publish(matcher)
+            self._sync_url_rules()
+            self._enforce_blocking()
+
+    def _stored_sites(self):
+        """:return: Every stored site, manual and subscribed"""
+        if hasattr(self.data_manager, "get_all_sites"):
+            return self.data_manager.get_all_sites()
+        return self.data_manager.get_blocked_sites()
+
+    def _load_compiled_matcher(self):
+        if not self.compiled_file:
+            return None
+        try:
+            return load_matcher(self.data_manager, self.compiled_file)
+        except (OSError, CompiledBlocklistError) as e:
+            logging.error(f"Could not load compiled blocklist: {e}")
+            return None
+
+    def _set_deadline(self, deadline):
+        self._deadline = deadline
+        if self._expiry_timer:
+            self._expiry_timer.cancel()
+        self._expiry_timer = threading.Timer(max(0, deadline - time.monotonic()), self._check_expiry)
+        self._expiry_timer.daemon = True
+        self._expiry_timer.start()
+
+    def _check_expiry(self):
+        with self._locked():
+            if not self._is_active or time.monotonic() < self._deadline:
+                return
+            self._end_session(EVENT_EXPIRE)
 
     def start_blocking(self, duration_minutes, sites, strict=True):
         """
         Starts the blocking session.
         :param duration_minutes: Duration in minutes
-        :param sites: List of sites to block
+        :param sites: List of sites to block. Subscribed blocklists are blocked too.
         :param strict: If True, blocking cannot be stopped early
         """
-        self._block_until = datetime.now() + timedelta(minutes=duration_minutes)
-        self._blocked_sites = sites
-        self._is_active = True
-        
-        if self.data_manager:
-            self.data_manager.update_blocking_state(
-                active=True,
-                until=self._block_until.isoformat(),
-                strict=strict
-            )
+        with self._locked():
+            self._block_until = datetime.now() + timedelta(minutes=duration_minutes)
+            self._set_deadline(time.monotonic() + duration_minutes * 60)
+            self._strict = strict
+            subscribed = ()
+            if hasattr(self.data_manager, "get_subscribed_sites"):
+                subscribed = self.data_manager.get_subscribed_sites()
+            self._publish(DomainMatcher(itertools.chain(sites, subscribed)))
+            # Edits made to the stored sites from here on apply to this session
+            self._sites_generation = getattr(self.data_manager, "sites_generation", None)
+            self._is_active = True
+
+            if self.data_manager:
+                self.data_manager.update_blocking_state(
+                    active=True,
+                    until=self._block_until.isoformat(),
+                    strict=strict
+                )
+                self._state_generation = getattr(self.data_manager, "state_generation", None)
+                # A strict session must survive the app being killed right away
+                if strict and not self.data_manager.flush(timeout=5):
+                    logging.warning("Blocking state could not be persisted in time.")
+                self._sync_url_rules()
+
+            logging.info(f"Blocking started for {duration_minutes} minutes. Strict: {strict}")
+            if len(sites) <= 20:
+                logging.info(f"Sites blocked: {', '.join(sites)}")
+            else:
+                logging.info(f"Sites blocked: {len(sites)}")
 
-        logging.info(f"Blocking started for {duration_minutes} minutes. Strict: {strict}")
-        logging.info(f"Sites blocked: {', '.join(sites)}")
-        
-        self._enforce_blocking()
+            self._enforce_blocking()
+            self._events.append(EVENT_START)
 
     def stop_blocking(self, force=False):
         """
@@ -56,64 +301,60 @@ class BlockingService:
         :param force: If True, bypasses strict check (for internal use/expiration)
         :return: True if stopped, False if denied by strict mode
         """
-        if not force and self.data_manager:
-            state = self.data_manager.get_blocking_state()
-            strict = state.get("strict_mode", True)
-            until_str = state.get("block_until")
-            if strict and until_str:
-                try:
-                    until = datetime.fromisoformat(until_str)
-                    if datetime.now() < until:
-                        logging.warning("Attempt to stop strict blocking denied.")
-                        return False # Cannot stop
-                except ValueError:
-                    pass
+        with self._locked():
+            was_active = self._is_active
+            active = self.is_active()
+            if was_active and not active:
+                return True  # Expired or stopped elsewhere meanwhile, and already ended by is_active()
+            if not force and self.data_manager and active and self._strict:
+                logging.warning("Attempt to stop strict blocking denied.")
+                return False # Cannot stop
+            self._end_session(EVENT_STOP)
+        return True
 
+    def _end_session(self, event):
+        """Ends the session and queues event for listeners. Call with the lock held."""
         self._is_active = False
         self._block_until = None
-        self._blocked_sites = []
-        
+        self._deadline = None
+        self._publish(DomainMatcher())
+        if self._expiry_timer:
+            self._expiry_timer.cancel()
+            self._expiry_timer = None
+
         if self.data_manager:
             self.data_manager.update_blocking_state(active=False, until=None, strict=True)
-        
-        logging.info("Blocking stopped.")
+            self._state_generation = getattr(self.data_manager, "state_generation", None)
+
+        logging.info("Blocking expired." if event == EVENT_EXPIRE else "Blocking stopped.")
         self._lift_blocking()
-        return True
+        self._events.append(event)
 
     def is_active(self):
         """
-        Checks if blocking is currently active.
+        Checks if blocking is currently active. Only an int comparison and a
+        monotonic clock read unless the persisted state has changed.
         """
         if self.data_manager:
-            state = self.data_manager.get_blocking_state()
-            if not state.get("blocking_active"):
-                return False
-            
-            until_str = state.get("block_until")
-            if until_str:
-                try:
-                    until = datetime.fromisoformat(until_str)
-                    if datetime.now() > until:
-                        self.stop_blocking(force=True)
-                        return False
-                    return True
-                except ValueError:
-                    self.stop_blocking(force=True)
+            self._sync_state()
+            if self._is_active:
+                self._sync_url_rules()
+                self._sync_sites()
+        deadline = self._deadline
+        if not self._is_active or deadline is None:
+            return False
+        if time.monotonic() >= deadline:
+            with self._locked():
+                if not self._is_active:
                     return False
-        
-        # Fallback for when data_manager is not present (e.g. basic tests)
-        if self._is_active and self._block_until:
-            if datetime.now() > self._block_until:
-                self.stop_blocking(force=True)
-                return False
-            return True
-            
-        return False
+                self._end_session(EVENT_EXPIRE)
+            return False
+        return True
 
     def get_remaining_time(self):
-        if self.is_active() and self._block_until:
-            remaining = self._block_until - datetime.now()
-            return max(timedelta(0), remaining)
+        deadline = self.get_deadline()
+        if deadline is not None:
+            return timedelta(seconds=max(0, deadline - time.monotonic()))
         return timedelta(0)
 
     def get_block_until(self):
@@ -121,10 +362,97 @@ class BlockingService:
             return self._block_until
         return None
 
-    def _enforce_blocking(self):
-        # Placeholder for actual blocking logic
-        pass
+    def get_deadline(self):
+        """:return: time.monotonic() value at which the session ends, or None if inactive"""
+        if self.is_active():
+            return self._deadline
+        return None
+
+    def is_blocked(self, host):
+        """
+        Checks whether a host is blocked by the current session.
+        Subdomains of a blocked site are blocked too.
+        """
+        if not self.is_active():
+            return False
+        LOOKUPS.inc("service")
+        rule = self._snapshot.view.match(host)
+        if rule is None:
+            return False
+        BLOCKS.inc(rule)
+        if self.attempt_log is not None:
+            self._record_attempt(host, rule)
+        return True
+
+    def is_url_blocked(self, host, path=""):
+        """
+        Checks a request against the current session's blocklist and URL rules.
+        :param path: Request path and query, e.g. "/shorts/abc"
+        """
+        if not self.is_active():
+            return False
+        LOOKUPS.inc("service")
+        rule = self._snapshot.view.match(host)
+        if rule is None:
+            rule = self._url_rules.match_url(host, path)
+            if rule is None:
+                return False
+        BLOCKS.inc(rule)
+        if self.attempt_log is not None:
+            self._record_attempt(host, rule)
+        return True
+
+    def check_hosts(self, hosts):
+        """
+        Batched is_blocked: checks the session once for the whole batch.
+        :return: List of 0/1 flags, 1 where the host is blocked
+        """
+        if not self.is_active():
+            return [0] * len(hosts)
+        start = time.perf_counter()
+        match = self._snapshot.view.match
+        flags = []
+        for host in hosts:
+            rule = match(host)
+            if rule is None:
+                flags.append(0)
+            else:
+                BLOCKS.inc(rule)
+                if self.attempt_log is not None:
+                    self._record_attempt(host, rule)
+                flags.append(1)
+        LOOKUPS.inc("service", len(hosts))
+        CHECK_SECONDS.observe(time.perf_counter() - start)
+        return flags
+
+    def is_strict(self):
+        """:return: Whether the active session is strict (False when inactive)"""
+        return self.is_active() and self._strict
+
+    def _record_attempt(self, host, rule):
+        until = self._block_until
+        # The session's end time identifies it, and survives restarts with the persisted state
+        self.attempt_log.record(host, rule, int(until.timestamp()) if until else 0)
+
+    def _enforce_blocking(self, changes=None):
+        """
+        Starts the backends on the current blocklist, or hands it to those already running.
+        :param changes: (added, removed) rules since the previous blocklist, passed on to
+                        backends with an apply_changes(matcher, added, removed) method
+        """
+        for backend in self.backends:
+            if self.attempt_log is not None:
+                backend.on_block = self._record_attempt
+            if hasattr(backend, "url_rules"):
+                backend.url_rules = self._url_rules
+            try:
+                if changes is not None and hasattr(backend, "apply_changes"):
+                    backend.apply_changes(self._snapshot.view, *changes)
+                else:
+                    backend.start(self._snapshot.view)
+            except OSError as e:
+                logging.error(f"Could not start {type(backend).__name__}: {e}")
 
     def _lift_blocking(self):
-        # Placeholder for actual unblocking logic
-        pass
+        for backend in self.backends:
+            backend.stop()
@@ -0,0 +1,98 @@
+"""
+Versioned, immutable views of the session blocklist.
+
+BlockingService publishes the blocklist as a BlocklistSnapshot held in a
+single attribute. An edit never changes a published snapshot: it derives the
+next version (the trie is copied along the edited paths only, see
+DomainMatcher.with_changes) and replaces the reference, which is atomic.
+Readers take the current snapshot with one attribute read and no lock, and get
+a consistent blocklist for as long as they hold it; an old version is freed
+when its last reader drops it.
+"""
+from domain_matcher import DomainMatcher, normalize_host
+
+
+class LayeredMatcher:
+    """
+    A read-only matcher (a CompiledMatcher) edited since it was opened, with
+    DomainMatcher's lookup interface: rules removed from the base are masked
+    and rules added go to a DomainMatcher on top.
+    """
+
+    def __init__(self, base, extra, removed=frozenset()):
+        """
+        :param extra: DomainMatcher of the rules added
+        :param removed: Rules of the base (normalized) that no longer apply
+        """
+        self.base = base
+        self.extra = extra
+        self.removed = removed
+
+    def __len__(self):
+        return len(self.base) - len(self.removed) + len(self.extra)
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def match(self, host):
+        rule = self.base.match(host, self.removed) if self.removed else self.base.match(host)
+        return rule if rule is not None else self.extra.match(host)
+
+    def is_blocked(self, host):
+        return self.match(host) is not None
+
+    def rules(self):
+        yield from (rule for rule in self.base.rules() if rule not in self.removed)
+        yield from self.extra.rules()
+
+
+def apply_changes(matcher, added=(), removed=()):
+    """
+    Derives a matcher with the rules removed and then added, leaving `matcher` as it was.
+    A read-only matcher is layered (see LayeredMatcher) rather than rebuilt.
+    :return: The new matcher, or `matcher` itself if nothing changed
+    """
+    if isinstance(matcher, DomainMatcher):
+        return matcher.with_changes(added, removed)
+    if isinstance(matcher, LayeredMatcher):
+        base, extra, masked = matcher.base, matcher.extra, matcher.removed
+    else:
+        base, extra, masked = matcher, DomainMatcher(), frozenset()
+    removed = [normalize_host(rule) for rule in removed]
+    added = [normalize_host(rule) for rule in added]
+    in_base = {rule for rule in added if base.has_rule(rule)}
+    new_masked = masked.union(rule for rule in removed if base.has_rule(rule)).difference(in_base)
+    new_extra = extra.with_changes([rule for rule in added if rule not in in_base], removed)
+    if new_extra is extra and new_masked == masked:
+        return matcher
+    return LayeredMatcher(base, new_extra, new_masked)
+
+
+class BlocklistSnapshot:
+    """
+    One version of the blocklist: the matcher and the cached view readers query.
+    Neither is modified after the snapshot is published.
+    """
+    __slots__ = ("version", "matcher", "view")
+
+    def __init__(self, version, matcher, view):
+        """
+        :param version: Increases with every snapshot a service publishes
+        :param matcher: DomainMatcher, CompiledMatcher or LayeredMatcher
+        :param view: `matcher` behind the verdict cache (see decision_cache.py)
+        """
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "matcher", matcher)
+        object.__setattr__(self, "view", view)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BlocklistSnapshot is immutable")
+
+    def __len__(self):
+        return len(self.matcher)
+
+    def match(self, host):
+        return self.view.match(host)
+
+    def is_blocked(self, host):
+        return self.view.match(host) is not None
@@ -0,0 +1,252 @@
+"""
+Canonical forms of blocklist entries and looked-up hosts.
+
+Input side, canonicalize_site() turns what a user types or a list contains
+("https://www.YouTube.com/watch", "Bücher.de.", "=M.Example.com:443") into
+the rule stored in the blocklist ("youtube.com", "xn--bcher-kva.de",
+"=m.example.com"). It strips the scheme, credentials, port, path, trailing
+dot and a leading "www.", converts IDNs to punycode, and rejects entries that
+are only a public suffix ("co.uk"), which would block a whole registry.
+
+Other subdomains are kept on purpose rather than reduced to the registrable
+domain, so a rule can block part of a site: "mail.google.com" blocks Gmail
+but not Google search. The public suffix list is only used to refuse
+over-broad entries.
+
+Lookup side, canonical_host() only lower-cases, strips the trailing dot and
+punycode-encodes non-ASCII names. It is memoized in an LRU cache, so hot
+hosts cost one dict lookup.
+
+Public suffixes come from the built-in list below, or from a copy of the
+Public Suffix List (https://publicsuffix.org/list/) at PUBLIC_SUFFIX_FILE if
+one is installed. Either is parsed once into PublicSuffixIndex.
+"""
+import logging
+import os
+from functools import lru_cache
+
+try:
+    import idna  # IDNA 2008 / UTS 46, if installed
+except ImportError:
+    idna = None
+
+PUBLIC_SUFFIX_FILE = os.path.join("data", "public_suffix_list.dat")
+
+HOST_CACHE_SIZE = 65536
+
+# Bumped when canonicalize_site changes, so stored blocklists are migrated again
+CANONICAL_VERSION = 1
+
+WWW = "www."
+
+# A compact subset of the Public Suffix List: generic and common country TLDs,
+# their usual second-level registries, and popular hosting platforms.
+BUILTIN_SUFFIXES = """
+com net org edu gov mil int info biz name pro mobi app dev io ai co me tv cc ws xyz online site top club
+shop store tech blog cloud page link live news
+ac ad ae ar at au be bg br by ca ch cl cn cz de dk ee es eu fi fr gr hk hr hu id ie il in ir is it jp
+kr kz lt lu lv mx my nl no nz ph pk pl pt ro rs ru sa se sg si sk th tr tw ua uk us vn za
+co.uk org.uk me.uk ltd.uk plc.uk net.uk ac.uk gov.uk nhs.uk police.uk sch.uk
+com.au net.au org.au edu.au gov.au id.au asn.au
+co.nz net.nz org.nz govt.nz ac.nz school.nz
+co.jp ne.jp or.jp ac.jp go.jp ad.jp ed.jp gr.jp lg.jp
+com.cn net.cn org.cn gov.cn edu.cn ac.cn
+com.br net.br org.br gov.br edu.br
+co.in net.in org.in gov.in ac.in firm.in gen.in ind.in
+co.za org.za gov.za ac.za net.za
+com.mx org.mx gob.mx edu.mx net.mx
+com.ar gob.ar org.ar net.ar
+com.tr org.tr net.tr gov.tr edu.tr
+co.kr or.kr ne.kr go.kr ac.kr
+com.tw org.tw net.tw gov.tw edu.tw
+com.hk org.hk net.hk gov.hk edu.hk
+com.sg org.sg net.sg gov.sg edu.sg
+co.il org.il net.il ac.il gov.il
+com.my org.my net.my gov.my edu.my
+com.ph org.ph net.ph gov.ph edu.ph
+co.id or.id ac.id go.id web.id
+com.ua org.ua net.ua gov.ua
+com.ru org.ru net.ru
+com.es org.es nom.es gob.es edu.es
+com.pl net.pl org.pl
+com.pt org.pt gov.pt
+com.sa net.sa org.sa gov.sa edu.sa
+com.vn net.vn org.vn gov.vn edu.vn
+co.th or.th ac.th go.th in.th
+com.pk net.pk org.pk gov.pk edu.pk
+*.ck !www.ck
+*.bd *.np *.kh
+github.io gitlab.io blogspot.com herokuapp.com appspot.com azurewebsites.net cloudfront.net
+netlify.app vercel.app pages.dev workers.dev web.app firebaseapp.com
+"""
+
+
+class PublicSuffixIndex:
+    """Public suffix rules as three sets: plain rules, wildcard parents and exceptions."""
+
+    def __init__(self, lines):
+        """:param lines: Rules in Public Suffix List syntax; comments and blank lines are ignored"""
+        rules, wildcards, exceptions = set(), set(), set()
+        for line in lines:
+            for rule in line.split():
+                if rule.startswith("//"):
+                    break
+                if rule.startswith("!"):
+                    exceptions.add(normalize_name(rule[1:]))
+                elif rule.startswith("*."):
+                    wildcards.add(normalize_name(rule[2:]))
+                else:
+                    rules.add(normalize_name(rule))
+        self.rules = frozenset(rules)
+        self.wildcards = frozenset(wildcards)
+        self.exceptions = frozenset(exceptions)
+
+    def __len__(self):
+        return len(self.rules) + len(self.wildcards) + len(self.exceptions)
+
+    def public_suffix(self, host):
+        """
+        :param host: Canonical host name
+        :return: Its public suffix, e.g. "co.uk" for "www.example.co.uk"
+        """
+        # Unlisted TLDs are public suffixes too (the PSL's implicit "*" rule)
+        pos = host.rfind(".")
+        best = host[pos + 1:]
+        # Walk outwards one label at a time; the longest matching rule wins
+        while pos >= 0:
+            parent = host[pos + 1:]
+            dot = host.rfind(".", 0, pos)
+            candidate = host[dot + 1:]
+            if candidate in self.exceptions:
+                return parent
+            if candidate in self.rules or parent in self.wildcards:
+                best = candidate
+            pos = dot
+        return best
+
+    def registrable_domain(self, host):
+        """:return: The public suffix plus one label ("example.co.uk"), or None if host is a public suffix"""
+        suffix = self.public_suffix(host)
+        if len(suffix) >= len(host):
+            return None
+        dot = host.rfind(".", 0, len(host) - len(suffix) - 1)
+        return host[dot + 1:]
+
+    def is_public_suffix(self, host):
+        return self.public_suffix(host) == host
+
+
+_index = None
+
+
+def public_suffixes():
+    """:return: The PublicSuffixIndex, built on first use"""
+    global _index
+    if _index is None:
+        if os.path.exists(PUBLIC_SUFFIX_FILE):
+            with open(PUBLIC_SUFFIX_FILE, encoding="utf-8") as f:
+                _index = PublicSuffixIndex(f)
+            logging.info(f"Loaded {len(_index)} public suffix rules from {PUBLIC_SUFFIX_FILE}")
+        else:
+            _index = PublicSuffixIndex(BUILTIN_SUFFIXES.splitlines())
+    return _index
+
+
+def _to_ascii(host):
+    if idna is not None:
+        try:
+            return idna.encode(host, uts46=True).decode("ascii")
+        except idna.IDNAError:
+            pass
+    return host.encode("idna").decode("ascii")
+
+
+def normalize_name(host):
+    """
+    Lower-cases a host name, strips surrounding whitespace and the trailing dot,
+    and punycode-encodes IDNs. Never raises; a name IDNA rejects is only lower-cased.
+    """
+    host = host.strip().lower().rstrip(".")
+    if not host.isascii():
+        try:
+            host = _to_ascii(host)
+        except UnicodeError:
+            pass
+    return host
+
+
+# Lookup-side normalization, memoized for hot hosts
+canonical_host = lru_cache(maxsize=HOST_CACHE_SIZE)(normalize_name)
+
+
+def _strip_url(entry):
+    """Reduces a URL (or bare host with port/path) to its host name."""
+    scheme = entry.find("://")
+    if scheme >= 0:
+        entry = entry[scheme + 3:]
+    end = len(entry)
+    for separator in "/?#":
+        i = entry.find(separator)
+        if 0 <= i < end:
+            end = i
+    entry = entry[:end]
+    at = entry.rfind("@")
+    if at >= 0:
+        entry = entry[at + 1:]
+    colon = entry.rfind(":")
+    if colon >= 0 and entry[colon + 1:].isdigit():
+        entry = entry[:colon]
+    return entry
+
+
+def canonicalize_site(entry):
+    """
+    Input-side canonicalization of a blocklist entry. The "=" (exact) and "*."
+    (subdomains only) prefixes of DomainMatcher rules are kept, and so are
+    subdomains other than "www.": the entry is not reduced to its registrable domain.
+    :return: The canonical rule
+    :raises ValueError: if the entry has no usable host name or is only a public suffix
+    """
+    entry = entry.strip()
+    prefix = ""
+    if entry.startswith("="):
+        prefix, entry = "=", entry[1:].strip()
+    elif entry.startswith("*."):
+        prefix, entry = "*.", entry[2:]
+    host = _strip_url(entry).strip().lower().rstrip(".")
+    if not host.isascii():
+        try:
+            host = _to_ascii(host)
+        except UnicodeError as e:
+            raise ValueError(f"Invalid domain name: {entry!r}") from e
+    if not host or host.startswith(".") or ".." in host or any(c in host for c in " /\\*=:@"):
+        raise ValueError(f"Invalid domain name: {entry!r}")
+
+    index = public_suffixes()
+    if not prefix and host.startswith(WWW) and not index.is_public_suffix(host[len(WWW):]):
+        host = host[len(WWW):]
+    if index.is_public_suffix(host):
+        raise ValueError(f"{host} is a public suffix; blocking it would block every site under it")
+    return prefix + host
+
+
+def canonicalize_sites(entries):
+    """
+    Canonicalizes many entries, dropping invalid ones and duplicates.
+    :return: (canonical rules in first-seen order, number of entries dropped)
+    """
+    seen = set()
+    rules = []
+    dropped = 0
+    for entry in entries:
+        try:
+            rule = canonicalize_site(entry)
+        except ValueError:
+            dropped += 1
+            continue
+        if rule in seen:
+            dropped += 1
+            continue
+        seen.add(rule)
+        rules.append(rule)
+    return rules, dropped
@@ -0,0 +1,365 @@
+"""
+Compiled, memory-mapped blocklist.
+
+DomainMatcher holds every rule as Python objects, which costs start-up time
+and memory proportional to the list. A compiled blocklist is a binary file
+the matcher maps and queries in place, so opening it costs the same for ten
+rules or ten million and lookups allocate nothing per entry.
+
+File layout (native byte order, recorded in the header):
+    header     HEADER struct, padded to HEADER_SIZE bytes
+    hashes     count x u32   crc32 of each rule's domain, sorted
+    offsets    count+1 x u32 start of each rule in the strings blob
+    strings    per rule: one mode byte followed by the UTF-8 domain
+
+A lookup hashes each suffix of the host, binary-searches the hash array and
+compares the (few) candidates byte for byte. The header carries a checksum of
+everything after it and the fingerprint of the blocklist it was compiled
+from, so a stale or damaged file is rebuilt from the DataManager.
+
+Compiling is CPU-bound, so a long list is compiled by a pool of processes, in
+two rounds. First, each worker takes a slice of the input, normalizes it and
+sorts the records into hash-range buckets. Then each worker dedupes, sorts and
+packs one bucket. Buckets cover disjoint hash ranges, so the packed buckets
+are simply concatenated, and the file comes out byte for byte the same
+whatever the number of workers.
+"""
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from canonical import canonical_host
+from concurrent.futures import ProcessPoolExecutor
+from domain_matcher import EXACT, SUBDOMAIN, WILDCARD, normalize_host
+from storage import atomic_write
+
+COMPILED_FILE = os.path.join("data", "blocklist.bin")
+
+MAGIC = b"RFBL"
+FORMAT_VERSION = 1
+# magic, format version, big-endian flag, rule count, strings size, checksum, fingerprint
+HEADER = struct.Struct("<4sHBxIII64s")
+HEADER_SIZE = 96
+
+MODE_CODES = {SUBDOMAIN: 0, WILDCARD: 1, EXACT: 2}
+MODE_PREFIXES = {0: "", 1: "*.", 2: "="}
+_MODE_BYTES = {mode: bytes((code,)) for mode, code in MODE_CODES.items()}
+_BIG_ENDIAN = sys.byteorder == "big"
+
+# Shorter lists are compiled in-process: starting the workers would cost more than they save
+PARALLEL_MIN_RULES = 200000
+
+# Compiled files whose checksum this process has checked, by CompiledMatcher.file_id
+_verified = set()
+
+# The rules being compiled in parallel, for forked workers to read instead of having them pickled over
+_fork_rules = None
+
+
+class CompiledBlocklistError(ValueError):
+    """The file is missing, from another format version, or damaged."""
+
+
+def available_cpus():
+    """:return: Number of CPUs this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def compile_blocklist(rules, path, fingerprint="", workers=None):
+    """
+    Compiles rules (DomainMatcher syntax) into a blocklist file, atomically replacing path.
+    :param fingerprint: Identifies the source the rules came from, see DataManager.sites_fingerprint
+    :param workers: Processes to compile with; None for one per CPU. Lists shorter than
+                    PARALLEL_MIN_RULES are compiled in-process regardless.
+    :return: Number of distinct rules written
+    """
+    if not isinstance(rules, (list, tuple)):
+        rules = list(rules)
+    if workers is None:
+        workers = available_cpus()
+    if workers > 1 and len(rules) >= PARALLEL_MIN_RULES:
+        shards = _compile_parallel(rules, workers)
+    else:
+        shards = [_pack(_records(rules, 1)[0])]
+
+    hashes = b"".join(shard[0] for shard in shards)
+    lengths = itertools.chain.from_iterable(array("I", shard[1]) for shard in shards)
+    offsets = array("I", itertools.accumulate(lengths, initial=0))
+    strings = b"".join(shard[2] for shard in shards)
+    count = len(offsets) - 1
+    body = b"".join((hashes, offsets.tobytes(), strings))
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, _BIG_ENDIAN, count, len(strings),
+                         zlib.crc32(body), fingerprint.encode()[:64])
+    atomic_write(path, header.ljust(HEADER_SIZE, b"\0") + body)
+    return count
+
+
+def _records(rules, buckets):
+    """
+    Turns rules into records: the big-endian crc32 of the domain, the mode code and
+    the domain, which sort in file order as plain bytes.
+    :return: One list of records per bucket, bucket i holding the i-th hash range
+    """
+    parts = [[] for _ in range(buckets)]
+    for rule in rules:
+        rule = normalize_host(rule)
+        if rule.startswith("="):
+            mode, domain = _MODE_BYTES[EXACT], rule[1:]
+        elif rule.startswith("*."):
+            mode, domain = _MODE_BYTES[WILDCARD], rule[2:]
+        else:
+            mode, domain = _MODE_BYTES[SUBDOMAIN], rule
+        if domain:
+            domain = domain.encode()
+            h = zlib.crc32(domain)
+            parts[h * buckets >> 32].append(h.to_bytes(4, "big") + mode + domain)
+    return parts
+
+
+def _pack(records):
+    """:return: (hashes, string lengths, strings) of the distinct records, sorted, as bytes"""
+    records = sorted(set(records))
+    hashes = array("I", b"".join([record[:4] for record in records]))
+    if not _BIG_ENDIAN:
+        hashes.byteswap()
+    lengths = array("I", [len(record) - 4 for record in records])
+    return hashes.tobytes(), lengths.tobytes(), b"".join([record[4:] for record in records])
+
+
+def _compile_parallel(rules, workers):
+    """:return: The packed buckets, in hash order, compiled in-process if the pool fails"""
+    global _fork_rules
+    size = -(-len(rules) // workers)
+    ranges = [(i, i + size) for i in range(0, len(rules), size)]
+    methods = multiprocessing.get_all_start_methods()
+    # Forked workers inherit the rules for free, but only a single-threaded process forks
+    # safely: a lock another thread holds (logging's, say) would stay locked in the child
+    if "fork" in methods and threading.active_count() == 1:
+        context = multiprocessing.get_context("fork")
+        _fork_rules, slices, encode = rules, ranges, _encoded_range
+    else:
+        if "forkserver" in methods:
+            context = multiprocessing.get_context("forkserver")
+            # Workers only need this module, not whatever __main__ imports
+            context.set_forkserver_preload([__name__])
+        else:
+            context = multiprocessing.get_context("spawn")
+        slices, encode = [rules[start:end] for start, end in ranges], _encoded_records
+    try:
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            # slices x buckets -> buckets x slices
+            buckets = zip(*pool.map(encode, slices, itertools.repeat(workers)))
+            return list(pool.map(_pack_encoded, buckets))
+    except Exception as e:
+        # No sem_open (ImportError), no processes left (OSError), a worker killed (BrokenProcessPool).
+        # A bug in the compile itself fails again in-process rather than being hidden.
+        logging.warning(f"Compiling in-process, the worker pool failed: {e!r}")
+        return [_pack(_records(rules, 1)[0])]
+    finally:
+        _fork_rules = None
+
+
+def _encoded_range(bounds, buckets):
+    """_encoded_records for the rules[start:end] a forked worker inherited."""
+    start, end = bounds
+    return _encoded_records(_fork_rules[start:end], buckets)
+
+
+def _encoded_records(rules, buckets):
+    """_records for a worker: each bucket as (record lengths, joined records), which pickle as two strings."""
+    return [(array("I", map(len, part)).tobytes(), b"".join(part)) for part in _records(rules, buckets)]
+
+
+def _pack_encoded(parts):
+    """_pack for a worker, over one bucket of every slice's _encoded_records."""
+    records = []
+    for lengths, joined in parts:
+        offsets = array("I", itertools.accumulate(array("I", lengths), initial=0))
+        records.extend(map(joined.__getitem__, map(slice, offsets, offsets[1:])))
+    return _pack(records)
+
+
+def read_header(path):
+    """
+    :return: (count, strings size, checksum, fingerprint)
+    :raises CompiledBlocklistError: if the file is missing or not a compatible blocklist
+    """
+    try:
+        with open(path, "rb") as f:
+            raw = f.read(HEADER_SIZE)
+    except OSError as e:
+        raise CompiledBlocklistError(str(e))
+    if len(raw) < HEADER_SIZE:
+        raise CompiledBlocklistError("Truncated header")
+    magic, version, big_endian, count, strings_size, checksum, fingerprint = HEADER.unpack_from(raw)
+    if magic != MAGIC or version != FORMAT_VERSION or big_endian != _BIG_ENDIAN:
+        raise CompiledBlocklistError(f"Unsupported blocklist format in {path}")
+    return count, strings_size, checksum, fingerprint.rstrip(b"\0").decode()
+
+
+class CompiledMatcher:
+    """Read-only matcher over a compiled blocklist, with DomainMatcher's lookup interface."""
+
+    def __init__(self, path, verify=False):
+        """
+        :param verify: Also check the body checksum, which reads the whole file
+        :raises CompiledBlocklistError: if the file can't be used
+        """
+        self.path = path
+        self._count, strings_size, self._checksum, self.fingerprint = read_header(path)
+        expected_size = HEADER_SIZE + 4 * (2 * self._count + 1) + strings_size
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_size != expected_size:
+                raise CompiledBlocklistError(f"Truncated blocklist {path}")
+            # Identifies this version of the file: a rebuild replaces it with a new inode
+            self.file_id = (st.st_dev, st.st_ino, st.st_mtime_ns)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        offsets_start = HEADER_SIZE + 4 * self._count
+        strings_start = offsets_start + 4 * (self._count + 1)
+        self._hashes = view[HEADER_SIZE:offsets_start].cast("I")
+        self._offsets = view[offsets_start:strings_start].cast("I")
+        self._strings = view[strings_start:]
+        view.release()
+        if verify:
+            try:
+                self.verify()
+            except CompiledBlocklistError:
+                self.close()
+                raise
+
+    def verify(self):
+        """:raises CompiledBlocklistError: if the body doesn't match the header checksum"""
+        if zlib.crc32(self._mmap[HEADER_SIZE:]) != self._checksum:
+            raise CompiledBlocklistError(f"Checksum mismatch in {self.path}")
+
+    def close(self):
+        self._hashes.release()
+        self._offsets.release()
+        self._strings.release()
+        self._mmap.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def _find(self, domain, is_host, skip=None):
+        """:return: Index of the rule on `domain` that applies and isn't in skip, or -1"""
+        hashes = self._hashes
+        h = zlib.crc32(domain)
+        i = bisect_left(hashes, h)
+        while i < self._count and hashes[i] == h:
+            start, end = self._offsets[i], self._offsets[i + 1]
+            mode = self._strings[start]
+            if (mode == 0 or (mode == 2) == is_host) and self._strings[start + 1:end] == domain:
+                if not skip or self._rule(i) not in skip:
+                    return i
+            i += 1
+        return -1
+
+    def match(self, host, skip=None):
+        """
+        Finds the rule blocking a host, checking its shortest suffix first like DomainMatcher.
+        :param skip: Rules (normalized) to pass over, e.g. ones removed since the file was compiled
+        :return: The matching rule in normalized form, or None
+        """
+        name = canonical_host(host).encode()
+        if not name:
+            return None
+        dot = name.rfind(b".")
+        while dot >= 0:
+            i = self._find(name[dot + 1:], False, skip)
+            if i >= 0:
+                return self._rule(i)
+            dot = name.rfind(b".", 0, dot)
+        i = self._find(name, True, skip)
+        return self._rule(i) if i >= 0 else None
+
+    def has_rule(self, rule):
+        """:return: True if the file holds rule (DomainMatcher syntax)"""
+        rule = normalize_host(rule)
+        if rule.startswith("="):
+            mode, domain = 2, rule[1:]
+        elif rule.startswith("*."):
+            mode, domain = 1, rule[2:]
+        else:
+            mode, domain = 0, rule
+        domain = domain.encode()
+        hashes = self._hashes
+        h = zlib.crc32(domain)
+        i = bisect_left(hashes, h)
+        while i < self._count and hashes[i] == h:
+            start, end = self._offsets[i], self._offsets[i + 1]
+            if self._strings[start] == mode and self._strings[start + 1:end] == domain:
+                return True
+            i += 1
+        return False
+
+    def is_blocked(self, host):
+        return self.match(host) is not None
+
+    def rules(self):
+        """:return: Iterator over the rules, in normalized form"""
+        return map(self._rule, range(self._count))
+
+    def _rule(self, i):
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return MODE_PREFIXES[self._strings[start]] + bytes(self._strings[start + 1:end]).decode()
+
+
+def load_matcher(data_manager, path=COMPILED_FILE):
+    """
+    Opens the compiled blocklist for the DataManager's current sites (manual and
+    subscribed), compiling it first if it is missing, damaged or was built from
+    a different blocklist. The checksum is checked the first time this process
+    opens each version of the file, so a damaged one is caught at start-up and
+    after every rebuild without reading the whole file on every open.
+    """
+    fingerprint = data_manager.sites_fingerprint()
+    try:
+        matcher = CompiledMatcher(path)
+        if matcher.fingerprint == fingerprint:
+            if matcher.file_id not in _verified:
+                try:
+                    matcher.verify()
+                except CompiledBlocklistError:
+                    matcher.close()
+                    raise
+                _verified.add(matcher.file_id)
+            return matcher
+        matcher.close()
+    except CompiledBlocklistError as e:
+        logging.info(f"Rebuilding compiled blocklist: {e}")
+    compile_blocklist(data_manager.get_all_sites(), path, fingerprint)
+    matcher = CompiledMatcher(path, verify=True)
+    _verified.add(matcher.file_id)
+    return matcher
+
+
+def ensure_compiled(data_manager, path=COMPILED_FILE):
+    """
+    Recompiles the blocklist file if the DataManager's sites changed since it was built.
+    Costs one header read when nothing changed.
+    :return: True if the file was rebuilt
+    """
+    fingerprint = data_manager.sites_fingerprint()
+    try:
+        if read_header(path)[3] == fingerprint:
+            return False
+    except CompiledBlocklistError:
+        pass
+    compile_blocklist(data_manager.get_all_sites(), path, fingerprint)
+    return True
@@ -0,0 +1,266 @@
+"""
+Headless Refocus daemon.
+
+Owns the DataManager, BlockingService (with its DNS and proxy backends) and
+the schedule engine, independent of the UI, and answers queries from local
+clients over a Unix domain socket. The protocol is described in
+daemon_client.py. Nothing here imports Kivy.
+
+Usage: python daemon.py [--socket data/refocus.sock] [--db user_data.db] [--metrics-port 9464]
+
+Metrics (see metrics.py) are served on http://127.0.0.1:9464/metrics and are
+also available to clients through the "metrics" call. --metrics-port 0 turns
+the HTTP endpoint off; REFOCUS_METRICS=0 turns recording off.
+"""
+import argparse
+import asyncio
+import errno
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from daemon_client import (FRAME_HEADER, MAX_FRAME, OP_CALL, OP_CHECK, OP_ERROR, SOCKET_FILE,
+                           encode_frame)
+
+# Methods OP_CALL may invoke, on the service or the data manager
+SERVICE_METHODS = {"start_blocking", "stop_blocking"}
+DATA_METHODS = {"get_user", "update_user", "get_blocked_sites", "count_sites", "has_site",
+                "add_site", "add_sites", "remove_site", "get_url_rules", "add_url_rule", "remove_url_rule",
+                "get_subscriptions", "add_subscription", "remove_subscription", "flush"}
+
+
+class BlockingDaemon:
+    def __init__(self, blocking_service, data_manager=None, socket_path=SOCKET_FILE, attempt_log=None):
+        self.blocking_service = blocking_service
+        self.data_manager = data_manager
+        self.socket_path = socket_path
+        self.attempt_log = attempt_log
+
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._check_executor = None
+
+        self.connections = 0
+        self.requests = 0
+        self.lookups = 0
+
+    def start(self):
+        """
+        Starts serving on a background thread.
+        :raises OSError: if the socket cannot be bound
+        """
+        if self._thread:
+            return
+        ready = threading.Event()
+        errors = []
+        self._thread = threading.Thread(target=self._run, args=(ready, errors), name="daemon-ipc", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            self._thread.join()
+            self._thread = None
+            raise errors[0]
+        logging.info(f"Daemon listening on {self.socket_path}")
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, ready, errors):
+        loop = self._loop = asyncio.new_event_loop()
+        # One thread: calls still run one at a time, as they did on the loop
+        loop.set_default_executor(ThreadPoolExecutor(1, thread_name_prefix="daemon-call"))
+        # Checks get their own thread so they don't queue behind a slow call
+        self._check_executor = ThreadPoolExecutor(1, thread_name_prefix="daemon-check")
+        try:
+            self._remove_stale_socket()
+            # Bind owner-only: a chmod after bind leaves a window where anyone may connect
+            umask = os.umask(0o077)
+            try:
+                self._server = loop.run_until_complete(
+                    asyncio.start_unix_server(self._handle_client, self.socket_path))
+            finally:
+                os.umask(umask)
+        except OSError as e:
+            errors.append(e)
+        ready.set()
+        if not errors:
+            loop.run_forever()
+            loop.run_until_complete(self._close())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        self._check_executor.shutdown()
+        loop.close()
+        self._server = None
+
+    def _remove_stale_socket(self):
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            # Left behind by a daemon that didn't shut down cleanly
+            os.unlink(self.socket_path)
+        else:
+            raise OSError(errno.EADDRINUSE, f"A daemon is already listening on {self.socket_path}")
+        finally:
+            probe.close()
+
+    async def _close(self):
+        self._server.close()
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    async def _handle_client(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                length, opcode = FRAME_HEADER.unpack(header)
+                if length > MAX_FRAME:
+                    writer.write(encode_frame(OP_ERROR, b"Frame too large"))
+                    break
+                body = await reader.readexactly(length)
+                self.requests += 1
+                writer.write(await self._dispatch(opcode, body))
+                # Pipelined requests are answered in one write once the buffer is large enough
+                if writer.transport.get_write_buffer_size() > 65536:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, opcode, body):
+        try:
+            if opcode == OP_CHECK:
+                hosts = body.decode().split("\n") if body else []
+                self.lookups += len(hosts)
+                # check_hosts may take the service lock to pick up edits; wait for it off the loop
+                flags = await asyncio.get_running_loop().run_in_executor(
+                    self._check_executor, self.blocking_service.check_hosts, hosts)
+                return encode_frame(OP_CHECK, bytes(flags))
+            if opcode == OP_CALL:
+                request = json.loads(body)
+                # Calls may write files or compile; lookups on other connections go on meanwhile
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, self._call, request["method"], request.get("args", []))
+                return encode_frame(OP_CALL, json.dumps(result).encode())
+            return encode_frame(OP_ERROR, f"Unknown opcode {opcode}".encode())
+        except Exception as e:
+            logging.exception("Daemon request failed")
+            return encode_frame(OP_ERROR, f"{type(e).__name__}: {e}".encode())
+
+    def _call(self, method, args):
+        if method == "status":
+            return self.status()
+        if method == "metrics":
+            return metrics.REGISTRY.snapshot()
+        if method == "decision_cache":
+            return self.blocking_service.decision_cache_stats()
+        if method == "top_blocked" and self.attempt_log is not None:
+            return self.attempt_log.top_hosts_this_week(*args)
+        if method == "stop_blocking":
+            # Never forced: a client can't end a strict session
+            return self.blocking_service.stop_blocking()
+        if method in SERVICE_METHODS:
+            return getattr(self.blocking_service, method)(*args)
+        if method in DATA_METHODS and self.data_manager is not None:
+            return getattr(self.data_manager, method)(*args)
+        raise ValueError(f"Unknown method {method}")
+
+    def status(self):
+        service = self.blocking_service
+        active = service.is_active()
+        until = service.get_block_until()
+        return {
+            "active": active,
+            "remaining": service.get_remaining_time().total_seconds() if active else None,
+            "block_until": until.isoformat() if until else None,
+            "strict": service.is_strict(),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Refocus blocking without the UI.")
+    parser.add_argument("--socket", default=SOCKET_FILE, help="Unix socket to serve the query API on")
+    parser.add_argument("--db", help="Use this SQLite database instead of the JSON data file")
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_ADDR[1],
+                        help="Localhost port for the Prometheus endpoint (0 to disable)")
+    parser.add_argument("--hosts-file", metavar="PATH",
+                        help="Also enforce through this hosts file, e.g. /etc/hosts (needs write access)")
+    args = parser.parse_args(argv)
+
+    from attempt_log import AttemptLog
+    from blocking_service import BlockingService
+    from compiled_blocklist import COMPILED_FILE
+    from dns_sinkhole import DnsSinkhole
+    from filter_proxy import FilterProxy
+    from models import DATA_FILE, DataManager
+    from scheduler import ScheduleEngine
+    from subscriptions import SubscriptionManager
+
+    if args.db:
+        from sqlite_backend import SqliteBackend
+        # A new database starts from the JSON data file, if there is one
+        data_manager = DataManager(backend=SqliteBackend(args.db, json_file=DATA_FILE))
+    else:
+        data_manager = DataManager(shared=True)
+    attempt_log = AttemptLog()
+    backends = [DnsSinkhole(), FilterProxy()]
+    if args.hosts_file:
+        from hosts_file import HostsFileBackend
+        backends.append(HostsFileBackend(args.hosts_file))
+    service = BlockingService(data_manager, backends=backends, compiled_file=COMPILED_FILE,
+                              attempt_log=attempt_log)
+    engine = ScheduleEngine(service, data_manager)
+    subscriptions = SubscriptionManager(data_manager)
+    daemon = BlockingDaemon(service, data_manager, args.socket, attempt_log)
+
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = metrics.MetricsServer(listen=(metrics.METRICS_ADDR[0], args.metrics_port))
+    daemon.start()
+    engine.start()
+    subscriptions.start()
+    try:
+        if metrics_server:
+            try:
+                metrics_server.start()
+            except OSError as e:
+                logging.warning(f"Metrics endpoint unavailable: {e}")
+                metrics_server = None
+        while not stopping.wait(3600):
+            pass
+    finally:
+        if metrics_server:
+            metrics_server.stop()
+        subscriptions.stop()
+        engine.stop()
+        daemon.stop()
+        attempt_log.close()
+        data_manager.close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    raise SystemExit(main())
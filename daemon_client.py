@@ -0,0 +1,184 @@
+"""
+Client side of the Refocus daemon protocol (see daemon.py).
+
+Every message is a frame: a 5-byte header (u32 body length, u8 opcode, big
+endian) followed by the body.
+    OP_CHECK  body: host names joined by "\\n"
+              reply: one byte per host, 1 if blocked
+    OP_CALL   body: JSON {"method": name, "args": [...]}
+              reply: JSON result
+    OP_ERROR  reply only; body: UTF-8 error message
+Clients may pipeline requests; replies come back in order.
+
+RemoteBlockingService and RemoteDataManager wrap a DaemonClient in the
+interfaces the UI already uses, so the app can run as a thin client.
+"""
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+SOCKET_FILE = os.path.join("data", "refocus.sock")
+
+FRAME_HEADER = struct.Struct("!IB")
+MAX_FRAME = 16 * 1024 * 1024
+
+OP_CHECK = 1
+OP_CALL = 2
+OP_ERROR = 255
+
+
+class DaemonError(Exception):
+    """The daemon rejected a request."""
+
+
+def encode_frame(opcode, body):
+    return FRAME_HEADER.pack(len(body), opcode) + body
+
+
+class DaemonClient:
+    def __init__(self, socket_path=SOCKET_FILE, timeout=5):
+        """
+        Connects to a running daemon. Safe to share between threads.
+        :raises OSError: if no daemon is listening on socket_path
+        """
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(socket_path)
+        self._file = self._sock.makefile("rb")
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def _request(self, opcode, body):
+        with self._lock:
+            self._sock.sendall(encode_frame(opcode, body))
+            return self._read_reply()
+
+    def _read_reply(self):
+        header = self._file.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            raise ConnectionError("Daemon closed the connection")
+        length, opcode = FRAME_HEADER.unpack(header)
+        body = self._file.read(length)
+        if len(body) < length:
+            raise ConnectionError("Daemon closed the connection")
+        if opcode == OP_ERROR:
+            raise DaemonError(body.decode())
+        return body
+
+    def check(self, hosts):
+        """:return: List of booleans, True where the host is blocked right now"""
+        if not hosts:
+            return []
+        return [flag == 1 for flag in self._request(OP_CHECK, "\n".join(hosts).encode())]
+
+    def check_many(self, batches):
+        """Pipelines several check() batches in one round trip. :return: One result list per batch"""
+        with self._lock:
+            self._sock.sendall(b"".join(encode_frame(OP_CHECK, "\n".join(hosts).encode()) for hosts in batches))
+            return [[flag == 1 for flag in self._read_reply()] for _ in batches]
+
+    def call(self, method, *args):
+        body = json.dumps({"method": method, "args": args}).encode()
+        return json.loads(self._request(OP_CALL, body))
+
+
+class RemoteBlockingService:
+    """BlockingService interface backed by the daemon."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def _status(self):
+        return self.client.call("status")
+
+    def is_active(self):
+        return self._status()["active"]
+
+    def get_deadline(self):
+        remaining = self._status()["remaining"]
+        return None if remaining is None else time.monotonic() + remaining
+
+    def get_remaining_time(self):
+        return timedelta(seconds=self._status()["remaining"] or 0)
+
+    def get_block_until(self):
+        until = self._status()["block_until"]
+        return datetime.fromisoformat(until) if until else None
+
+    def start_blocking(self, duration_minutes, sites, strict=True):
+        self.client.call("start_blocking", duration_minutes, sites, strict)
+
+    def stop_blocking(self):
+        return self.client.call("stop_blocking")
+
+    def is_blocked(self, host):
+        return self.client.check([host])[0]
+
+    def on_state_change(self, callback):
+        # The daemon doesn't push events; the UI picks up changes from get_deadline()
+        return lambda: None
+
+
+class RemoteDataManager:
+    """The parts of the DataManager interface the UI uses, backed by the daemon."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_user(self):
+        return self.client.call("get_user")
+
+    def update_user(self, username=None, email=None, phone=None):
+        self.client.call("update_user", username, email, phone)
+
+    def get_blocked_sites(self, offset=0, limit=None, prefix=None):
+        return self.client.call("get_blocked_sites", offset, limit, prefix)
+
+    def count_sites(self):
+        return self.client.call("count_sites")
+
+    def has_site(self, url):
+        return self.client.call("has_site", url)
+
+    def add_site(self, url):
+        self.client.call("add_site", url)
+
+    def add_sites(self, urls):
+        return self.client.call("add_sites", list(urls))
+
+    def remove_site(self, url):
+        self.client.call("remove_site", url)
+
+    def get_subscriptions(self):
+        return self.client.call("get_subscriptions")
+
+    def add_subscription(self, name, source, interval=None):
+        if interval is None:
+            return self.client.call("add_subscription", name, source)
+        return self.client.call("add_subscription", name, source, interval)
+
+    def remove_subscription(self, name):
+        return self.client.call("remove_subscription", name)
+
+    def flush(self, timeout=None):
+        return self.client.call("flush")
+
+    def close(self):
+        self.client.close()
+
+
+def connect(socket_path=SOCKET_FILE):
+    """:return: A DaemonClient, or None if no daemon is running"""
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        return DaemonClient(socket_path)
+    except OSError:
+        return None
@@ -0,0 +1,214 @@
+"""
+Host -> verdict cache in front of the blocklist matcher.
+
+Lookups are heavily skewed: a few hosts (CDNs, analytics, the blocked sites
+themselves) make up most of them. The cache remembers which rule, if any,
+matched each recently seen host, so a repeat lookup is one dict probe instead
+of normalization plus a matcher walk.
+
+Every entry is stamped with the generation it was computed in. invalidate()
+bumps the generation, which retires every entry at once without touching
+them; stale entries are overwritten or evicted as new hosts come in.
+
+Eviction is CLOCK (a cheap LRU approximation: a hit only bumps a counter in
+the entry), with TinyLFU admission once the cache is full: a count-min sketch
+of lookup frequencies keeps a host seen once from evicting one seen more
+often, so a burst of one-off hosts can't flush the hot set. Misses are
+counted in the sketch directly; hits are folded in as the clock hand passes.
+
+Reads take no lock and may run on any number of threads; inserts are
+serialized. A result computed before an invalidation is never stored after it.
+"""
+import threading
+import metrics
+
+DECISION_CACHE_SIZE = 4096
+
+# Sketch counters per row for each cached host; fewer make one-off hosts collide into looking popular
+SKETCH_WIDTH = 8
+# Sketch counters saturate here and are halved after SAMPLE_FACTOR x maxsize increments
+SKETCH_MAX = 15
+SAMPLE_FACTOR = 10
+_HALVE = bytes(count >> 1 for count in range(256))
+
+LOOKUPS = metrics.labeled_counter("refocus_decision_cache_total", "Host verdict cache lookups by result", "result")
+
+
+class FrequencySketch:
+    """Count-min sketch with four rows of saturating byte counters and periodic aging."""
+
+    def __init__(self, size):
+        self.width = 1 << max(4, (SKETCH_WIDTH * size - 1).bit_length())
+        self._mask = self.width - 1
+        self._counts = bytearray(4 * self.width)
+        self._additions = 0
+        self._sample = SAMPLE_FACTOR * size
+
+    def _slots(self, key):
+        h = hash(key)
+        mask, width = self._mask, self.width
+        return h & mask, width + (h >> 16 & mask), 2 * width + (h >> 32 & mask), 3 * width + (h >> 48 & mask)
+
+    def add(self, key, count=1):
+        """:return: The key's estimated frequency after counting it"""
+        counts = self._counts
+        a, b, c, d = self._slots(key)
+        estimate = SKETCH_MAX
+        for slot in (a, b, c, d):
+            value = counts[slot] + count
+            if value < SKETCH_MAX:
+                counts[slot] = value
+                if value < estimate:
+                    estimate = value
+            else:
+                counts[slot] = SKETCH_MAX
+        self._additions += 1
+        if self._additions >= self._sample:
+            # Halve everything so old popularity fades
+            self._counts = self._counts.translate(_HALVE)
+            self._additions //= 2
+            estimate >>= 1
+        return estimate
+
+    def estimate(self, key):
+        counts = self._counts
+        a, b, c, d = self._slots(key)
+        return min(counts[a], counts[b], counts[c], counts[d])
+
+
+class DecisionCache:
+    def __init__(self, maxsize=DECISION_CACHE_SIZE):
+        """:param maxsize: Hosts remembered at most; 0 disables caching"""
+        self.maxsize = maxsize
+        self.generation = 0
+        # host -> [generation, rule, hits since the clock hand last passed]
+        self._entries = {}
+        self._ring = []
+        self._hand = 0
+        self._sketch = FrequencySketch(max(maxsize, 1))
+        self._lock = threading.Lock()
+        self._owner = None
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        # Hits and misses already added to LOOKUPS; the metric is updated off the hit path
+        self._published = (0, 0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self):
+        """Retires every cached verdict in O(1). Call after changing what the matcher would answer."""
+        self.generation += 1
+
+    def view(self, matcher):
+        """
+        :return: A CachedMatcher answering from this cache in front of `matcher`.
+                 Earlier views stop storing results, and the cache is invalidated.
+        """
+        view = CachedMatcher(matcher, self)
+        with self._lock:
+            self._owner = view
+            self.generation += 1
+        return view
+
+    def put(self, view, host, rule, generation):
+        """Stores a verdict computed by `view` in `generation`, unless either is out of date."""
+        with self._lock:
+            self._publish()
+            if not self.maxsize or view is not self._owner or generation != self.generation:
+                return
+            frequency = self._sketch.add(host)
+            entry = self._entries.get(host)
+            if entry is not None:
+                self._entries[host] = [generation, rule, 0]
+            elif len(self._ring) < self.maxsize:
+                self._entries[host] = [generation, rule, 0]
+                self._ring.append(host)
+            else:
+                self._replace(host, rule, generation, frequency)
+
+    def _replace(self, host, rule, generation, frequency):
+        """Evicts a CLOCK victim for host, if the sketch says host is the more popular one."""
+        ring, entries = self._ring, self._entries
+        hand = self._hand
+        while True:
+            victim = entries[ring[hand]]
+            if victim[0] != generation or not victim[2]:
+                break
+            self._sketch.add(ring[hand], victim[2])
+            victim[2] = 0
+            hand = (hand + 1) % len(ring)
+        self._hand = (hand + 1) % len(ring)
+        if victim[0] == generation and frequency <= self._sketch.estimate(ring[hand]):
+            self.rejected += 1
+            return
+        del entries[ring[hand]]
+        entries[host] = [generation, rule, 0]
+        ring[hand] = host
+
+    def _publish(self):
+        hits, misses = self.hits, self.misses
+        published_hits, published_misses = self._published
+        if hits > published_hits:
+            LOOKUPS.inc("hit", hits - published_hits)
+        if misses > published_misses:
+            LOOKUPS.inc("miss", misses - published_misses)
+        self._published = (hits, misses)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._ring.clear()
+            self._hand = 0
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            self._publish()
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "rejected": self.rejected,
+        }
+
+
+class CachedMatcher:
+    """A matcher (DomainMatcher interface) answering repeat lookups from a DecisionCache."""
+
+    def __init__(self, matcher, cache):
+        self.matcher = matcher
+        self.cache = cache
+
+    def __len__(self):
+        return len(self.matcher)
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def match(self, host):
+        cache = self.cache
+        if cache._owner is not self:
+            # Superseded: the cached verdicts are another matcher's
+            return self.matcher.match(host)
+        generation = cache.generation
+        entry = cache._entries.get(host)
+        if entry is not None and entry[0] == generation:
+            entry[2] += 1
+            cache.hits += 1
+            return entry[1]
+        cache.misses += 1
+        rule = self.matcher.match(host)
+        cache.put(self, host, rule, generation)
+        return rule
+
+    def is_blocked(self, host):
+        return self.match(host) is not None
+
+    def rules(self):
+        return self.matcher.rules()
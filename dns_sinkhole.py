@@ -0,0 +1,374 @@
+"""
+Local DNS resolver that sinkholes blocked names.
+
+Queries for hosts matched by the session's DomainMatcher are answered locally
+(NXDOMAIN, or 0.0.0.0 / :: when running in "zero" mode). Everything else is
+forwarded to an upstream resolver. Upstream answers are cached for their TTL,
+negative answers for the SOA minimum, and identical queries that arrive while
+one is already in flight are attached to it instead of being forwarded again.
+
+The resolver runs its own asyncio loop on a background thread so it can be
+started and stopped from the (synchronous) BlockingService.
+"""
+import asyncio
+import logging
+import random
+import struct
+import threading
+import time
+import metrics
+
+LISTEN_ADDR = ("127.0.0.1", 5353)
+UPSTREAM_ADDR = ("1.1.1.1", 53)
+
+BLOCK_NXDOMAIN = "nxdomain"
+BLOCK_ZERO = "zero"
+
+BLOCK_TTL = 60
+NEGATIVE_TTL = 60
+MAX_TTL = 3600
+UPSTREAM_TIMEOUT = 2.0
+CACHE_SIZE = 10000
+
+QTYPE_A = 1
+QTYPE_SOA = 6
+QTYPE_AAAA = 28
+QTYPE_OPT = 41
+QCLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+_FLAG_QR = 0x8000
+_FLAG_TC = 0x0200
+_FLAG_RD = 0x0100
+_FLAG_RA = 0x0080
+_OPCODE_MASK = 0x7800
+
+_HEADER = struct.Struct("!HHHHHH")
+_RR_FIXED = struct.Struct("!HHIH")
+_TTL = struct.Struct("!I")
+
+LOOKUPS = metrics.labeled_counter("refocus_lookups_total", "Hosts checked against the blocklist", "source")
+BLOCKS = metrics.labeled_counter("refocus_blocks_total", "Blocked lookups by matching rule", "rule")
+CACHE_LOOKUPS = metrics.labeled_counter("refocus_dns_cache_total", "Allowed DNS queries by cache result", "result")
+UPSTREAM_SECONDS = metrics.histogram("refocus_dns_upstream_seconds", "Upstream resolver response time")
+
+
+def parse_query(data):
+    """
+    Parses the header and single question of a DNS query.
+    :return: (qid, flags, qname, qtype, qclass, question_end)
+    :raises ValueError: if the packet is not a well-formed single-question query
+    """
+    try:
+        qid, flags, qdcount = struct.unpack_from("!HHH", data)
+        if qdcount != 1:
+            raise ValueError("expected exactly one question")
+        labels = []
+        pos = 12
+        length = data[pos]
+        while length:
+            if length & 0xC0:
+                raise ValueError("compressed question name")
+            labels.append(data[pos + 1:pos + 1 + length])
+            pos += 1 + length
+            length = data[pos]
+        qtype, qclass = struct.unpack_from("!HH", data, pos + 1)
+        qname = b".".join(labels).decode("ascii").lower()
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"malformed DNS packet: {e}")
+    return qid, flags, qname, qtype, qclass, pos + 5
+
+
+def parse_query_response(data):
+    """Like parse_query, but for packets that carry the QR (response) bit."""
+    try:
+        flags = struct.unpack_from("!H", data, 2)[0]
+    except struct.error as e:
+        raise ValueError(f"malformed DNS packet: {e}")
+    if not flags & _FLAG_QR:
+        raise ValueError("not a DNS response")
+    return parse_query(data)
+
+
+def _skip_name(data, pos):
+    length = data[pos]
+    while length:
+        if length & 0xC0 == 0xC0:
+            return pos + 2
+        pos += 1 + length
+        length = data[pos]
+    return pos + 1
+
+
+def parse_response_ttl(data, question_end):
+    """
+    Works out how long an upstream response may be cached.
+    :return: (ttl, ttl_offsets) where ttl_offsets locate every RR TTL field,
+             or (None, None) if the response must not be cached
+    """
+    try:
+        _, flags, _, ancount, nscount, arcount = _HEADER.unpack_from(data)
+        rcode = flags & 0x000F
+        if flags & _FLAG_TC or rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+            return None, None
+        pos = question_end
+        answer_ttl = None
+        negative_ttl = NEGATIVE_TTL
+        offsets = []
+        for index in range(ancount + nscount + arcount):
+            pos = _skip_name(data, pos)
+            rtype, _, ttl, rdlength = _RR_FIXED.unpack_from(data, pos)
+            if rtype != QTYPE_OPT:
+                offsets.append(pos + 4)
+                if index < ancount:
+                    answer_ttl = ttl if answer_ttl is None else min(answer_ttl, ttl)
+                elif rtype == QTYPE_SOA and index < ancount + nscount:
+                    minimum = _TTL.unpack_from(data, pos + 10 + rdlength - 4)[0]
+                    negative_ttl = min(ttl, minimum)
+            pos += 10 + rdlength
+    except (IndexError, struct.error):
+        return None, None
+    ttl = answer_ttl if answer_ttl is not None and rcode == RCODE_NOERROR else negative_ttl
+    return min(ttl, MAX_TTL), offsets
+
+
+def build_response(query, question_end, rcode=RCODE_NOERROR, answer=None, ttl=BLOCK_TTL):
+    """
+    Builds a response to a query from its own header and question.
+    :param answer: Optional (qtype, rdata) for a single answer record
+    """
+    qid, flags = struct.unpack_from("!HH", query)
+    flags = _FLAG_QR | (flags & (_OPCODE_MASK | _FLAG_RD)) | _FLAG_RA | rcode
+    ancount = 1 if answer else 0
+    parts = [_HEADER.pack(qid, flags, 1, ancount, 0, 0), query[12:question_end]]
+    if answer:
+        rtype, rdata = answer
+        parts.append(b"\xc0\x0c" + _RR_FIXED.pack(rtype, QCLASS_IN, ttl, len(rdata)) + rdata)
+    return b"".join(parts)
+
+
+class _ListenProtocol(asyncio.DatagramProtocol):
+    def __init__(self, sinkhole):
+        self.sinkhole = sinkhole
+
+    def connection_made(self, transport):
+        self.sinkhole._listen_transport = transport
+
+    def datagram_received(self, data, addr):
+        self.sinkhole._handle_query(data, addr)
+
+
+class _UpstreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self, sinkhole):
+        self.sinkhole = sinkhole
+
+    def connection_made(self, transport):
+        self.sinkhole._upstream_transport = transport
+
+    def datagram_received(self, data, addr):
+        self.sinkhole._handle_upstream(data)
+
+    def error_received(self, exc):
+        logging.warning(f"DNS upstream error: {exc}")
+
+
+class DnsSinkhole:
+    def __init__(self, listen=LISTEN_ADDR, upstream=UPSTREAM_ADDR, block_mode=BLOCK_NXDOMAIN,
+                 cache_size=CACHE_SIZE, upstream_timeout=UPSTREAM_TIMEOUT):
+        """
+        :param listen: (host, port) to serve DNS on
+        :param upstream: (host, port) of the resolver allowed queries are forwarded to
+        :param block_mode: BLOCK_NXDOMAIN or BLOCK_ZERO
+        """
+        if block_mode not in (BLOCK_NXDOMAIN, BLOCK_ZERO):
+            raise ValueError(f"Unknown block mode: {block_mode}")
+        self.listen = listen
+        self.upstream = upstream
+        self.block_mode = block_mode
+        self.cache_size = cache_size
+        self.upstream_timeout = upstream_timeout
+        self.matcher = None
+        # Called as on_block(host, rule) for every blocked query, e.g. by BlockingService
+        self.on_block = None
+
+        # (qname, qtype, qclass) -> (expires, response, question_end, ttl_offsets)
+        self._cache = {}
+        # (qname, qtype, qclass) -> [(qid, question section, addr), ...] waiting on one upstream query.
+        # Each client gets its own question back: resolvers using 0x20 casing check it.
+        self._inflight = {}
+        # upstream id -> (key, timeout handle, send time)
+        self._pending = {}
+
+        self._loop = None
+        self._thread = None
+        self._listen_transport = None
+        self._upstream_transport = None
+
+        self.queries = 0
+        self.blocked = 0
+        self.cache_hits = 0
+        self.forwarded = 0
+
+    @property
+    def address(self):
+        """The (host, port) actually bound, useful when listening on port 0."""
+        if self._listen_transport is None:
+            return None
+        return self._listen_transport.get_extra_info("sockname")[:2]
+
+    def is_running(self):
+        return self._thread is not None
+
+    def start(self, matcher):
+        """
+        Starts serving on a background thread, or swaps the matcher if already running.
+        :raises OSError: if the listen or upstream socket cannot be opened
+        """
+        self.matcher = matcher
+        if self._thread:
+            return
+        ready = threading.Event()
+        errors = []
+        self._thread = threading.Thread(target=self._run, args=(ready, errors), name="dns-sinkhole", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            self._thread.join()
+            self._thread = None
+            raise errors[0]
+        logging.info(f"DNS sinkhole listening on {self.address}, upstream {self.upstream}")
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self.matcher = None
+        logging.info("DNS sinkhole stopped.")
+
+    def _run(self, ready, errors):
+        loop = self._loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(loop.create_datagram_endpoint(
+                lambda: _UpstreamProtocol(self), remote_addr=self.upstream))
+            loop.run_until_complete(loop.create_datagram_endpoint(
+                lambda: _ListenProtocol(self), local_addr=self.listen))
+        except OSError as e:
+            errors.append(e)
+        ready.set()
+        if not errors:
+            loop.run_forever()
+        for transport in (self._listen_transport, self._upstream_transport):
+            if transport:
+                transport.close()
+        for _, handle, _ in self._pending.values():
+            handle.cancel()
+        self._pending.clear()
+        self._inflight.clear()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+        self._listen_transport = self._upstream_transport = None
+
+    def _handle_query(self, data, addr):
+        try:
+            qid, flags, qname, qtype, qclass, question_end = parse_query(data)
+        except ValueError:
+            return
+        if flags & _FLAG_QR:
+            return
+        self.queries += 1
+
+        matcher = self.matcher
+        if matcher is not None:
+            LOOKUPS.inc("dns")
+            rule = matcher.match(qname)
+            if rule is not None:
+                BLOCKS.inc(rule)
+                if self.on_block is not None:
+                    self.on_block(qname, rule)
+                self.blocked += 1
+                self._listen_transport.sendto(self._blocked_response(data, question_end, qtype), addr)
+                return
+
+        key = (qname, qtype, qclass)
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires, response, cached_end, offsets = entry
+            remaining = int(expires - time.monotonic())
+            if remaining > 0:
+                self.cache_hits += 1
+                CACHE_LOOKUPS.inc("hit")
+                buf = bytearray(response)
+                buf[0:2] = data[0:2]
+                buf[12:cached_end] = data[12:question_end]
+                shift = question_end - cached_end
+                for offset in offsets:
+                    _TTL.pack_into(buf, offset + shift, remaining)
+                self._listen_transport.sendto(buf, addr)
+                return
+            del self._cache[key]
+        CACHE_LOOKUPS.inc("miss")
+
+        waiter = (qid, data[12:question_end], addr)
+        waiters = self._inflight.get(key)
+        if waiters is not None:
+            waiters.append(waiter)
+            return
+        self._inflight[key] = [waiter]
+        self._forward(key, data, question_end)
+
+    def _blocked_response(self, query, question_end, qtype):
+        if self.block_mode == BLOCK_NXDOMAIN:
+            return build_response(query, question_end, RCODE_NXDOMAIN)
+        if qtype == QTYPE_A:
+            return build_response(query, question_end, answer=(QTYPE_A, bytes(4)))
+        if qtype == QTYPE_AAAA:
+            return build_response(query, question_end, answer=(QTYPE_AAAA, bytes(16)))
+        return build_response(query, question_end)
+
+    def _forward(self, key, query, question_end):
+        upstream_id = random.getrandbits(16)
+        while upstream_id in self._pending:
+            upstream_id = random.getrandbits(16)
+        handle = self._loop.call_later(self.upstream_timeout, self._upstream_timed_out, upstream_id)
+        self._pending[upstream_id] = (key, handle, time.perf_counter())
+        self.forwarded += 1
+        self._upstream_transport.sendto(struct.pack("!H", upstream_id) + query[2:])
+
+    def _upstream_timed_out(self, upstream_id):
+        key, _, _ = self._pending.pop(upstream_id)
+        logging.warning(f"DNS upstream timed out for {key[0]}")
+        for qid, question, addr in self._inflight.pop(key, ()):
+            header = _HEADER.pack(qid, _FLAG_QR | _FLAG_RD | _FLAG_RA | RCODE_SERVFAIL, 1, 0, 0, 0)
+            self._reply(header + question, addr)
+
+    def _handle_upstream(self, data):
+        try:
+            upstream_id, _, qname, qtype, qclass, question_end = parse_query_response(data)
+        except ValueError:
+            return
+        pending = self._pending.get(upstream_id)
+        if pending is None or pending[0] != (qname, qtype, qclass):
+            return
+        key, handle, sent = self._pending.pop(upstream_id)
+        handle.cancel()
+        UPSTREAM_SECONDS.observe(time.perf_counter() - sent)
+
+        ttl, offsets = parse_response_ttl(data, question_end)
+        if ttl:
+            if len(self._cache) >= self.cache_size:
+                del self._cache[next(iter(self._cache))]
+            self._cache[key] = (time.monotonic() + ttl, data, question_end, offsets)
+
+        header, answers = data[2:12], data[question_end:]
+        for qid, question, addr in self._inflight.pop(key, ()):
+            self._reply(struct.pack("!H", qid) + header + question + answers, addr)
+
+    def _reply(self, data, addr):
+        if self._listen_transport is not None:
+            self._listen_transport.sendto(data, addr)
+
@@ -0,0 +1,194 @@
+"""
+Host matching for the blocklist.
+
+Rules are compiled into a trie keyed on reversed domain labels, so
+"m.facebook.com" is looked up as com -> facebook -> m. A lookup walks at most
+one node per label of the host, no matter how many rules are loaded.
+
+Supported rule syntax:
+    facebook.com     blocks facebook.com and every subdomain of it
+    *.facebook.com   blocks subdomains only (m.facebook.com, not facebook.com)
+    =facebook.com    blocks exactly facebook.com
+
+Looked-up hosts go through canonical.canonical_host (memoized), so case,
+trailing dots and IDNs match the canonical rules stored in the blocklist.
+
+with_changes() derives an edited copy without touching the original, sharing
+every trie node the edit doesn't pass through, so a published matcher can be
+read without locks while the next version is being built.
+"""
+from canonical import canonical_host, normalize_name
+
+# Markers stored next to the child labels of a trie node. None of them can
+# appear as a real label of a (normalized) host name.
+SUBDOMAIN = ""
+WILDCARD = "*"
+EXACT = "="
+
+
+def normalize_host(host):
+    """Lower-cases a host name, strips surrounding whitespace and the trailing dot, and punycode-encodes IDNs."""
+    return normalize_name(host)
+
+
+def parse_rule(rule):
+    """
+    Splits a rule string into its match mode and reversed labels.
+    :return: (mode, labels) or None if the rule is empty or malformed
+    """
+    rule = normalize_host(rule)
+    if rule.startswith("="):
+        mode, rule = EXACT, rule[1:]
+    elif rule.startswith("*."):
+        mode, rule = WILDCARD, rule[2:]
+    else:
+        mode = SUBDOMAIN
+    if not rule:
+        return None
+    labels = rule.split(".")
+    # An empty label ("foo..com") would be stored under the SUBDOMAIN marker and block all of .com
+    if any(label in ("", WILDCARD, EXACT) for label in labels):
+        return None
+    labels.reverse()
+    return mode, labels
+
+
+class DomainMatcher:
+    def __init__(self, rules=()):
+        self._root = {}
+        self._count = 0
+        # id -> node for the nodes this matcher may write to once it shares nodes
+        # with another matcher (see with_changes); None while it shares nothing
+        self._owned = None
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def _find(self, labels):
+        node = self._root
+        for label in labels:
+            node = node.get(label)
+            if node is None:
+                return None
+        return node
+
+    def _writable(self, parent, label):
+        """:return: parent's child node for label, copied first if it may be shared"""
+        child = parent[label]
+        owned = self._owned
+        if owned is not None and id(child) not in owned:
+            child = parent[label] = dict(child)
+            owned[id(child)] = child
+        return child
+
+    def add(self, rule):
+        """
+        Adds a rule to the matcher.
+        :return: True if the rule was new
+        """
+        parsed = parse_rule(rule)
+        if parsed is None:
+            return False
+        mode, labels = parsed
+        found = self._find(labels)
+        if found is not None and mode in found:
+            return False
+        node = self._root
+        for label in labels:
+            if label in node:
+                node = self._writable(node, label)
+            else:
+                child = node[label] = {}
+                if self._owned is not None:
+                    self._owned[id(child)] = child
+                node = child
+        node[mode] = rule
+        self._count += 1
+        return True
+
+    def remove(self, rule):
+        """
+        Removes a rule from the matcher, pruning nodes left empty.
+        :return: True if the rule was present
+        """
+        parsed = parse_rule(rule)
+        if parsed is None:
+            return False
+        mode, labels = parsed
+        found = self._find(labels)
+        if found is None or mode not in found:
+            return False
+        path = [self._root]
+        for label in labels:
+            path.append(self._writable(path[-1], label))
+        del path[-1][mode]
+        self._count -= 1
+        for depth in range(len(labels), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][labels[depth - 1]]
+        return True
+
+    def with_changes(self, added=(), removed=()):
+        """
+        Copy-on-write edit: returns a new matcher with the rules removed and then
+        added, copying only the nodes on their paths. This matcher is left as it
+        was, so lookups running on it see neither half-done nor finished edits.
+        :return: The new matcher, or this one if nothing changed
+        """
+        matcher = DomainMatcher()
+        matcher._root = dict(self._root)
+        matcher._count = self._count
+        matcher._owned = {id(matcher._root): matcher._root}
+        changed = False
+        for rule in removed:
+            changed = matcher.remove(rule) or changed
+        for rule in added:
+            changed = matcher.add(rule) or changed
+        if not changed:
+            return self
+        # Everything below the root is now shared with the new matcher
+        self._owned = {id(self._root): self._root}
+        return matcher
+
+    def rules(self):
+        """:return: Iterator over the rules, as they were added"""
+        stack = [self._root]
+        while stack:
+            for value in stack.pop().values():
+                if isinstance(value, dict):
+                    stack.append(value)
+                else:
+                    yield value
+
+    def match(self, host):
+        """
+        Finds the rule blocking a host.
+        :param host: Host name, e.g. "m.facebook.com"
+        :return: The matching rule as it was added, or None
+        """
+        labels = canonical_host(host).split(".")
+        node = self._root
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return None
+            rule = node.get(SUBDOMAIN)
+            if rule is not None:
+                return rule
+            if i:
+                # Labels remain below this node, so it is a strict subdomain
+                rule = node.get(WILDCARD)
+                if rule is not None:
+                    return rule
+            else:
+                return node.get(EXACT)
+        return None
+
+    def is_blocked(self, host):
+        return self.match(host) is not None
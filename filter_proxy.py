@@ -0,0 +1,505 @@
+"""
+Filtering HTTP/CONNECT forward proxy.
+
+Plain HTTP requests are checked against the Host header (and the authority of
+an absolute request URI). CONNECT tunnels are checked against the CONNECT
+target and, without decrypting anything, against the SNI in the TLS
+ClientHello the client sends first. URL rules (see url_rules.py) are matched
+against the host and, for plain HTTP, the request path. Blocked requests get a
+403 (or, once TLS has started, a closed connection).
+
+Allowed tunnels are handed over to a pair of BufferedProtocol relays that
+receive into a preallocated buffer and pass each read, as one bytes copy, to the
+peer transport, so Python only runs once per read rather than per byte.
+Plain HTTP upstream connections are kept alive and pooled per host.
+
+Like DnsSinkhole, the proxy runs its own asyncio loop on a background thread.
+"""
+import asyncio
+import logging
+import struct
+import threading
+import metrics
+
+LISTEN_ADDR = ("127.0.0.1", 8888)
+
+MAX_HEAD_SIZE = 64 * 1024
+MAX_CLIENT_HELLO_SIZE = 64 * 1024
+RELAY_BUFFER_SIZE = 256 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+CONNECT_TIMEOUT = 10.0
+POOL_SIZE = 8
+
+LOOKUPS = metrics.labeled_counter("refocus_lookups_total", "Hosts checked against the blocklist", "source")
+BLOCKS = metrics.labeled_counter("refocus_blocks_total", "Blocked lookups by matching rule", "rule")
+POOL_LOOKUPS = metrics.labeled_counter("refocus_proxy_pool_total", "Upstream connections by pool result", "result")
+
+HOP_BY_HOP_HEADERS = {
+    "connection", "proxy-connection", "keep-alive", "proxy-authorization",
+    "proxy-authenticate", "te", "trailer", "upgrade",
+}
+
+_TLS_HANDSHAKE = 0x16
+_TLS_CLIENT_HELLO = 0x01
+_TLS_EXT_SERVER_NAME = 0x0000
+
+
+def blocked_response(host):
+    body = f"Blocked by Refocus: {host}\n".encode()
+    return (b"HTTP/1.1 403 Forbidden\r\n"
+            b"Content-Type: text/plain\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Connection: close\r\n\r\n" + body)
+
+
+def split_host_port(authority, default_port):
+    """Splits "host[:port]" (or "[v6]:port") into (host, port)."""
+    if authority.startswith("["):
+        host, _, rest = authority[1:].partition("]")
+        port = rest[1:] if rest.startswith(":") else ""
+    elif authority.count(":") == 1:
+        host, _, port = authority.partition(":")
+    else:
+        host, port = authority, ""
+    try:
+        return host, int(port) if port else default_port
+    except ValueError:
+        raise ValueError(f"Bad port in {authority!r}")
+
+
+def parse_head(head):
+    """
+    Parses a request or response head.
+    :return: (start line parts, [(name, value), ...])
+    """
+    lines = head.decode("latin-1").split("\r\n")
+    start = lines[0].split(" ", 2)
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise ValueError(f"Malformed header line: {line!r}")
+        headers.append((name.strip(), value.strip()))
+    return start, headers
+
+
+def get_header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def build_head(start_line, headers, connection):
+    lines = [start_line]
+    lines.extend(f"{key}: {value}" for key, value in headers if key.lower() not in HOP_BY_HOP_HEADERS)
+    lines.append(f"Connection: {connection}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def parse_client_hello_sni(data):
+    """
+    Extracts the server name from a TLS ClientHello handshake message.
+    :param data: Handshake message bytes (record headers already stripped)
+    :return: The SNI host name, or None if the message carries none
+    """
+    try:
+        if data[0] != _TLS_CLIENT_HELLO:
+            return None
+        pos = 4 + 2 + 32                               # header, client_version, random
+        pos += 1 + data[pos]                           # session_id
+        pos += 2 + struct.unpack_from("!H", data, pos)[0]  # cipher_suites
+        pos += 1 + data[pos]                           # compression_methods
+        end = pos + 2 + struct.unpack_from("!H", data, pos)[0]
+        pos += 2
+        while pos + 4 <= end:
+            ext_type, ext_len = struct.unpack_from("!HH", data, pos)
+            pos += 4
+            if ext_type == _TLS_EXT_SERVER_NAME:
+                list_end = pos + 2 + struct.unpack_from("!H", data, pos)[0]
+                pos += 2
+                while pos + 3 <= list_end:
+                    name_type, name_len = struct.unpack_from("!BH", data, pos)
+                    pos += 3
+                    if name_type == 0:
+                        return data[pos:pos + name_len].decode("ascii").lower()
+                    pos += name_len
+                return None
+            pos += ext_len
+    except (IndexError, struct.error, UnicodeDecodeError):
+        return None
+    return None
+
+
+async def read_client_hello(reader):
+    """
+    Reads TLS records from a client until the whole ClientHello has arrived.
+    :return: (raw bytes read, handshake message) or (raw bytes, None) for non-TLS traffic
+    """
+    first = await reader.read(5)
+    if len(first) < 5 or first[0] != _TLS_HANDSHAKE:
+        return first, None
+    raw = bytearray(first)
+    message = bytearray()
+    header = first
+    while True:
+        length = struct.unpack_from("!H", header, 3)[0]
+        payload = await reader.readexactly(length)
+        raw += payload
+        message += payload
+        if len(message) >= 4:
+            needed = 4 + int.from_bytes(message[1:4], "big")
+            if len(message) >= needed or needed > MAX_CLIENT_HELLO_SIZE:
+                return bytes(raw), bytes(message)
+        header = await reader.readexactly(5)
+        raw += header
+
+
+class _Relay(asyncio.BufferedProtocol):
+    """One direction of a spliced tunnel: everything read is written to `peer`."""
+
+    def __init__(self, proxy, peer, stream_writer=None):
+        self.proxy = proxy
+        self.peer = peer
+        # A StreamWriter closes its transport when garbage collected, so the
+        # writer of a handed-over client connection must live as long as we do
+        self.stream_writer = stream_writer
+        self.transport = None
+        self.eof = False
+        self._buffer = memoryview(bytearray(RELAY_BUFFER_SIZE))
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.proxy._relays.add(self)
+
+    def get_buffer(self, sizehint):
+        return self._buffer
+
+    def buffer_updated(self, nbytes):
+        # Copied: since Python 3.12 the transport queues unsent data without copying it,
+        # and the next read would overwrite it in the shared buffer
+        self.peer.write(bytes(self._buffer[:nbytes]))
+        self.proxy.bytes_relayed += nbytes
+
+    def eof_received(self):
+        # Pass the half-close on and keep the other direction flowing until
+        # both sides are done
+        self.eof = True
+        if self.peer.get_protocol().eof or not self.peer.can_write_eof():
+            self.peer.close()
+            return False
+        self.peer.write_eof()
+        return True
+
+    def connection_lost(self, exc):
+        self.proxy._relays.discard(self)
+        self.peer.close()
+
+    # Called for our own transport's write buffer, which the peer relay fills
+    def pause_writing(self):
+        self.peer.pause_reading()
+
+    def resume_writing(self):
+        self.peer.resume_reading()
+
+
+class UpstreamPool:
+    """Idle keep-alive upstream connections, keyed by (host, port)."""
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = {}
+        self.reused = 0
+
+    async def acquire(self, host, port):
+        """:return: (reader, writer, reused)"""
+        idle = self._idle.get((host, port))
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                self.reused += 1
+                POOL_LOOKUPS.inc("hit")
+                return reader, writer, True
+            writer.close()
+        POOL_LOOKUPS.inc("miss")
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+        return reader, writer, False
+
+    def release(self, host, port, reader, writer):
+        idle = self._idle.setdefault((host, port), [])
+        if len(idle) < self.size and not writer.is_closing():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class FilterProxy:
+    def __init__(self, listen=LISTEN_ADDR, pool_size=POOL_SIZE):
+        """
+        :param listen: (host, port) to accept proxy clients on
+        :param pool_size: Idle keep-alive connections kept per upstream host
+        """
+        self.listen = listen
+        self.pool_size = pool_size
+        self.matcher = None
+        # UrlRuleEngine for path and keyword rules, e.g. set by BlockingService
+        self.url_rules = None
+        # Called as on_block(host, rule) for every blocked request, e.g. by BlockingService
+        self.on_block = None
+
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._pool = None
+        self._relays = set()
+
+        self.connections = 0
+        self.blocked = 0
+        self.bytes_relayed = 0
+
+    @property
+    def address(self):
+        if self._server is None:
+            return None
+        return self._server.sockets[0].getsockname()[:2]
+
+    def is_running(self):
+        return self._thread is not None
+
+    def start(self, matcher):
+        """
+        Starts serving on a background thread, or swaps the matcher if already running.
+        :raises OSError: if the listen socket cannot be opened
+        """
+        self.matcher = matcher
+        if self._thread:
+            return
+        ready = threading.Event()
+        errors = []
+        self._thread = threading.Thread(target=self._run, args=(ready, errors), name="filter-proxy", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            self._thread.join()
+            self._thread = None
+            raise errors[0]
+        logging.info(f"Filtering proxy listening on {self.address}")
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self.matcher = None
+        logging.info("Filtering proxy stopped.")
+
+    def _run(self, ready, errors):
+        loop = self._loop = asyncio.new_event_loop()
+        self._pool = UpstreamPool(self.pool_size)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle_client, *self.listen, limit=MAX_HEAD_SIZE))
+        except OSError as e:
+            errors.append(e)
+        ready.set()
+        if not errors:
+            loop.run_forever()
+            loop.run_until_complete(self._close())
+        loop.close()
+        self._server = None
+
+    async def _close(self):
+        self._server.close()
+        self._pool.close()
+        for relay in list(self._relays):
+            relay.transport.abort()
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _is_blocked(self, host, path=""):
+        matcher = self.matcher
+        if matcher is None or not host:
+            return False
+        LOOKUPS.inc("proxy")
+        rule = matcher.match(host)
+        if rule is None:
+            url_rules = self.url_rules
+            if not url_rules:
+                return False
+            rule = url_rules.match_url(host, path)
+            if rule is None:
+                return False
+        BLOCKS.inc(rule)
+        if self.on_block is not None:
+            self.on_block(host, rule)
+        self.blocked += 1
+        return True
+
+    async def _handle_client(self, reader, writer):
+        self.connections += 1
+        handed_over = False
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                (method, target, version), headers = parse_head(head)
+                if method == "CONNECT":
+                    handed_over = await self._handle_connect(target, reader, writer)
+                    return
+                keep_alive = await self._handle_http(method, target, version, headers, reader, writer)
+        except (ValueError, asyncio.LimitOverrunError):
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, OSError) as e:
+            logging.debug(f"Proxy connection ended: {e}")
+        finally:
+            if not handed_over:
+                writer.close()
+
+    async def _handle_connect(self, target, reader, writer):
+        """
+        Opens a tunnel after checking the CONNECT target and the ClientHello SNI.
+        :return: True if the client transport was handed over to a relay
+        """
+        host, port = split_host_port(target, 443)
+        if self._is_blocked(host):
+            writer.write(blocked_response(host))
+            return False
+        writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+
+        raw, hello = await read_client_hello(reader)
+        if hello is not None:
+            sni = parse_client_hello_sni(hello)
+            if sni != host and self._is_blocked(sni):
+                return False
+
+        client = writer.transport
+        loop = asyncio.get_running_loop()
+        upstream, _ = await asyncio.wait_for(
+            loop.create_connection(lambda: _Relay(self, client), host, port), CONNECT_TIMEOUT)
+        upstream.write(raw)
+
+        # Switch the client side from the stream reader to a relay. Anything the
+        # stream had already buffered is forwarded first, while reading is paused.
+        client.pause_reading()
+        client.set_protocol(_Relay(self, upstream, writer))
+        client.get_protocol().connection_made(client)
+        reader.feed_eof()
+        leftover = await reader.read()
+        if leftover:
+            upstream.write(leftover)
+        client.resume_reading()
+        return True
+
+    async def _handle_http(self, method, target, version, headers, reader, writer):
+        """
+        Forwards one plain HTTP request.
+        :return: True if the client connection can be kept alive
+        """
+        uri_host = None
+        if target.startswith("http://"):
+            authority, slash, path = target[7:].partition("/")
+            target = slash + path or "/"
+            uri_host, port = split_host_port(authority, 80)
+        host_header = get_header(headers, "host")
+        if host_header:
+            host, header_port = split_host_port(host_header, 80)
+            if uri_host is None:
+                port = header_port
+        elif uri_host:
+            host = uri_host
+        else:
+            raise ValueError("Request has no host")
+        if self._is_blocked(host, target) or (uri_host and uri_host != host and self._is_blocked(uri_host, target)):
+            writer.write(blocked_response(host))
+            return False
+        host = uri_host or host
+
+        connection = (get_header(headers, "connection") or get_header(headers, "proxy-connection") or "").lower()
+        client_keep_alive = version == "HTTP/1.1" and connection != "close"
+        request_head = build_head(f"{method} {target} HTTP/1.1", headers, "keep-alive")
+
+        up_reader, up_writer, reused = await self._pool.acquire(host, port)
+        try:
+            up_writer.write(request_head)
+            await self._copy_body(headers, reader, up_writer)
+            response_head = await up_reader.readuntil(b"\r\n\r\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            up_writer.close()
+            if not reused or get_header(headers, "content-length") or get_header(headers, "transfer-encoding"):
+                raise
+            # A pooled connection went stale; retry once on a fresh one
+            up_reader, up_writer, _ = await self._pool.acquire(host, port)
+            up_writer.write(request_head)
+            response_head = await up_reader.readuntil(b"\r\n\r\n")
+
+        (resp_version, status, *reason), resp_headers = parse_head(response_head)
+        status = int(status)
+        no_body = method == "HEAD" or status in (204, 304) or 100 <= status < 200
+        framed = no_body or get_header(resp_headers, "content-length") is not None or \
+            (get_header(resp_headers, "transfer-encoding") or "").lower() == "chunked"
+        upstream_keep_alive = framed and resp_version == "HTTP/1.1" and \
+            (get_header(resp_headers, "connection") or "").lower() != "close"
+        keep_alive = client_keep_alive and framed
+
+        status_line = f"HTTP/1.1 {status} {reason[0] if reason else ''}".rstrip()
+        writer.write(build_head(status_line, resp_headers, "keep-alive" if keep_alive else "close"))
+        if no_body:
+            pass
+        elif framed:
+            await self._copy_body(resp_headers, up_reader, writer)
+        else:
+            while True:
+                chunk = await up_reader.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        await writer.drain()
+
+        if upstream_keep_alive:
+            self._pool.release(host, port, up_reader, up_writer)
+        else:
+            up_writer.close()
+        return keep_alive
+
+    async def _copy_body(self, headers, reader, writer):
+        """Relays a message body framed by Content-Length or chunked encoding."""
+        if (get_header(headers, "transfer-encoding") or "").lower() == "chunked":
+            while True:
+                size_line = await reader.readuntil(b"\r\n")
+                writer.write(size_line)
+                size = int(size_line.split(b";", 1)[0], 16)
+                if size == 0:
+                    while True:
+                        trailer = await reader.readuntil(b"\r\n")
+                        writer.write(trailer)
+                        if trailer == b"\r\n":
+                            return
+                await self._copy_exactly(size + 2, reader, writer)
+        length = get_header(headers, "content-length")
+        if length:
+            await self._copy_exactly(int(length), reader, writer)
+
+    async def _copy_exactly(self, remaining, reader, writer):
+        while remaining:
+            chunk = await reader.read(min(remaining, STREAM_CHUNK_SIZE))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            writer.write(chunk)
+            remaining -= len(chunk)
+            await writer.drain()
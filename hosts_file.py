@@ -0,0 +1,287 @@
+"""
+Enforcement through the system hosts file.
+
+The blocked hosts are written, pointing at 0.0.0.0 and ::, between two marker
+lines; everything outside that managed section is left byte for byte as it
+was (but for a newline added to an unterminated last line). Hosts files have
+no wildcards, so a rule covers the name it names plus its "www." host
+(DnsSinkhole covers every subdomain).
+
+The backend remembers which hosts it wrote and, when the blocklist changes
+during a session, applies only the difference: the file is streamed through
+to a temp file that replaces it atomically, with removed hosts dropped and new
+ones inserted before the end marker. When the file is unchanged since the
+last write, it is copied in large blocks rather than line by line, with the few
+removed lines (if any) cut out of the blocks of the managed section. A change
+that adds and removes nothing doesn't touch the file, so the OS resolver isn't
+made to re-read it.
+
+Writing the real hosts file (/etc/hosts, or the Windows one) needs root or
+Administrator rights.
+"""
+import logging
+import os
+import shutil
+import threading
+import metrics
+from storage import atomic_writer
+
+if os.name == "nt":
+    HOSTS_FILE = os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "System32", "drivers", "etc", "hosts")
+else:
+    HOSTS_FILE = "/etc/hosts"
+
+BLOCK_ADDRESSES = ("0.0.0.0", "::")
+BEGIN_MARKER = b"# BEGIN Refocus blocklist (managed, do not edit)"
+END_MARKER = b"# END Refocus blocklist"
+NEWLINE = os.linesep.encode()
+COPY_CHUNK = 1024 * 1024
+# Up to this many removed hosts are cut out of whole blocks at once; more are filtered line by line
+BLOCK_REMOVE_HOSTS = 64
+
+WRITES = metrics.labeled_counter("refocus_hosts_file_writes_total", "Hosts file rewrites by kind", "kind")
+
+
+class _SectionMissing(Exception):
+    """The managed section was removed from the file by someone else."""
+
+
+def rule_hosts(rule):
+    """:return: The host names written for a rule (DomainMatcher syntax)"""
+    if rule.startswith("="):
+        return (rule[1:],)
+    if rule.startswith("*."):
+        return ("www." + rule[2:],)
+    return (rule, "www." + rule)
+
+
+class HostsFileBackend:
+    def __init__(self, path=HOSTS_FILE, addresses=BLOCK_ADDRESSES):
+        """
+        :param path: Hosts file to manage
+        :param addresses: Each blocked host gets one line per address
+        """
+        self.path = path
+        self.addresses = [address.encode() for address in addresses]
+        # Lookups don't pass through here, so there is nothing to report
+        self.on_block = None
+        self._running = False
+        self._lock = threading.Lock()
+        self._rules = set()
+        # host -> number of written rules that produce it
+        self._hosts = {}
+        # Offsets of the first line after the begin marker and of the end marker line,
+        # and the (inode, size, mtime) of the file as last written
+        self._section = None
+        self._written = None
+
+    def is_running(self):
+        return self._running
+
+    def start(self, matcher):
+        """
+        Writes the managed section for the matcher's rules, or applies the difference
+        from what was written if already running.
+        :raises OSError: if the hosts file can't be written
+        """
+        rules = set(matcher.rules())
+        with self._lock:
+            if self._running:
+                self._apply(rules - self._rules, self._rules - rules)
+                return
+            self._rules.clear()
+            self._hosts.clear()
+            self._track(rules, ())
+            self._write_full()
+            self._running = True
+        logging.info(f"Hosts file {self.path}: blocking {len(self._hosts)} hosts")
+
+    def apply_changes(self, matcher, added, removed):
+        """
+        Like start(matcher) while running, for callers that know which rules were
+        added and removed: costs the size of the change rather than of the blocklist.
+        """
+        if not self._running:
+            self.start(matcher)
+            return
+        with self._lock:
+            self._apply([rule for rule in added if rule not in self._rules],
+                        [rule for rule in removed if rule in self._rules])
+
+    def stop(self):
+        """Removes the managed section."""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._rules.clear()
+            self._hosts.clear()
+            try:
+                self._write_full()
+            except OSError as e:
+                logging.error(f"Could not restore hosts file {self.path}: {e}")
+        logging.info(f"Hosts file {self.path}: blocking lifted")
+
+    def hosts(self):
+        """:return: The host names currently written"""
+        return list(self._hosts)
+
+    def _track(self, added, removed):
+        """
+        Counts rules in and out of the written hosts.
+        :return: (hosts to add, hosts to remove) to bring the file up to date
+        """
+        hosts = self._hosts
+        touched = {}
+        for rule in removed:
+            self._rules.discard(rule)
+            for host in rule_hosts(rule):
+                touched.setdefault(host, host in hosts)
+                if hosts[host] > 1:
+                    hosts[host] -= 1
+                else:
+                    del hosts[host]
+        for rule in added:
+            self._rules.add(rule)
+            for host in rule_hosts(rule):
+                touched.setdefault(host, host in hosts)
+                hosts[host] = hosts.get(host, 0) + 1
+        return ([host for host, was_written in touched.items() if not was_written and host in hosts],
+                {host for host, was_written in touched.items() if was_written and host not in hosts})
+
+    def _apply(self, added, removed):
+        added_hosts, removed_hosts = self._track(added, removed)
+        if added_hosts or removed_hosts:
+            self._write_diff(added_hosts, removed_hosts)
+
+    def _lines(self, hosts):
+        return b"".join(address + b" " + host.encode() + NEWLINE for host in hosts for address in self.addresses)
+
+    def _signature(self):
+        st = os.stat(self.path)
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _mode(self):
+        try:
+            return os.stat(self.path).st_mode & 0o7777
+        except FileNotFoundError:
+            return 0o644
+
+    def _finish(self, section, kind):
+        self._section = section
+        self._written = self._signature()
+        WRITES.inc(kind)
+
+    def _write_full(self):
+        """Streams the file through without the managed section, then appends a fresh one for every host."""
+        section = None
+        with atomic_writer(self.path, mode=self._mode()) as out:
+            try:
+                with open(self.path, "rb") as source:
+                    inside = False
+                    last = b"\n"
+                    for line in source:
+                        marker = line.rstrip(b"\r\n")
+                        if marker == BEGIN_MARKER:
+                            inside = True
+                        elif inside:
+                            inside = marker != END_MARKER
+                        else:
+                            out.write(line)
+                            last = line
+            except FileNotFoundError:
+                last = b"\n"
+            if self._hosts:
+                if not last.endswith(b"\n"):
+                    out.write(NEWLINE)
+                out.write(BEGIN_MARKER + NEWLINE)
+                begin = out.tell()
+                out.write(self._lines(self._hosts))
+                section = begin, out.tell()
+                out.write(END_MARKER + NEWLINE)
+        self._finish(section, "full")
+
+    def _write_diff(self, added, removed):
+        """Rewrites the file with `removed` hosts dropped from the managed section and `added` appended to it."""
+        if self._section is None:
+            # No section to edit yet
+            self._write_full()
+            return
+        try:
+            unchanged = self._signature() == self._written
+        except FileNotFoundError:
+            self._write_full()
+            return
+        try:
+            with atomic_writer(self.path, mode=self._mode()) as out:
+                with open(self.path, "rb") as source:
+                    if unchanged and len(removed) <= BLOCK_REMOVE_HOSTS:
+                        section = self._copy_blocks(source, out, self._lines(added), removed)
+                    else:
+                        section = self._copy_lines(source, out, self._lines(added), removed)
+        except _SectionMissing:
+            self._write_full()
+            return
+        self._finish(section, "diff")
+
+    def _copy_blocks(self, source, out, new_lines, removed):
+        """Copies a file laid out as last written, in blocks. :return: The new section offsets"""
+        begin, end = self._section
+        _copy(source, out, begin)
+        if removed:
+            cut = [b"\n" + address + b" " + host.encode() + NEWLINE for host in removed for address in self.addresses]
+            remaining = end - begin
+            while remaining > 0:
+                block = source.read(min(COPY_CHUNK, remaining))
+                if not block:
+                    break
+                if len(block) < remaining and not block.endswith(b"\n"):
+                    block += source.readline()
+                remaining -= len(block)
+                # Every line of the section starts after a newline, so a match is a whole line
+                block = b"\n" + block
+                for line in cut:
+                    block = block.replace(line, b"\n")
+                out.write(block[1:])
+        else:
+            _copy(source, out, end - begin)
+        out.write(new_lines)
+        section = begin, out.tell()
+        shutil.copyfileobj(source, out, COPY_CHUNK)
+        return section
+
+    @staticmethod
+    def _copy_lines(source, out, new_lines, removed):
+        """Copies a file line by line, finding the section. :return: The new section offsets"""
+        removed = {host.encode() for host in removed}
+        inside = False
+        section = None
+        for line in source:
+            if inside:
+                if line.rstrip(b"\r\n") == END_MARKER:
+                    inside = False
+                    out.write(new_lines)
+                    section = begin, out.tell()
+                else:
+                    fields = line.split()
+                    if len(fields) > 1 and fields[1] in removed:
+                        continue
+            elif line.rstrip(b"\r\n") == BEGIN_MARKER:
+                inside = True
+                out.write(line)
+                begin = out.tell()
+                continue
+            out.write(line)
+        if section is None:
+            raise _SectionMissing()
+        return section
+
+
+def _copy(source, out, size):
+    """Copies size bytes from source to out in blocks."""
+    while size > 0:
+        block = source.read(min(COPY_CHUNK, size))
+        if not block:
+            break
+        out.write(block)
+        size -= len(block)
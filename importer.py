@@ -0,0 +1,166 @@
+"""
+Streaming import of public blocklists.
+
+Understands hosts files ("0.0.0.0 ads.example.com"), plain domain lists and
+adblock-style "||example.com^" rules, gzip-compressed or not, from a file or
+stdin. Lines flow through a generator pipeline (read, parse, normalize,
+dedupe) straight into DataManager.add_sites, so the whole import is one
+batch commit and only the set of distinct domains is held in memory.
+
+Usage: python importer.py [--db user_data.db] FILE [FILE ...]   (FILE may be -)
+"""
+import argparse
+import gzip
+import io
+import logging
+import re
+import sys
+import time
+from domain_matcher import normalize_host
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Loopback and placeholder names every hosts file maps; not blocklist entries
+HOSTS_BUILTINS = {
+    "localhost", "localhost.localdomain", "local", "broadcasthost", "0.0.0.0",
+    "ip6-localhost", "ip6-loopback", "ip6-localnet", "ip6-mcastprefix",
+    "ip6-allnodes", "ip6-allrouters", "ip6-allhosts",
+}
+
+DOMAIN_RE = re.compile(r"^(?=.{1,253}$)([a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?\.)+[a-z0-9-]{2,63}$")
+IP_RE = re.compile(r"^(\d{1,3}(\.\d{1,3}){3}|[0-9a-f:]*:[0-9a-f:.]*)$")
+
+
+class ImportStats:
+    def __init__(self):
+        self.lines = 0
+        self.unique = 0
+        self.added = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.elapsed = 0.0
+
+    @property
+    def lines_per_second(self):
+        return self.lines / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.lines} lines, {self.added} added, {self.duplicates} duplicates, "
+                f"{self.invalid} invalid in {self.elapsed:.2f}s ({self.lines_per_second:,.0f} lines/s)")
+
+
+def open_source(source):
+    """
+    Opens a blocklist for reading text lines. Gzip input is detected by its magic bytes.
+    :param source: A path, "-" for stdin, or a binary file object
+    """
+    if source == "-":
+        raw = sys.stdin.buffer
+    elif isinstance(source, str):
+        raw = open(source, "rb")
+    else:
+        raw = source
+    if not hasattr(raw, "peek"):
+        raw = io.BufferedReader(raw)
+    if raw.peek(2)[:2] == GZIP_MAGIC:
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+
+
+def parse_line(line):
+    """
+    Extracts the hostnames a blocklist line names, whatever its format.
+    :return: List of raw hostnames (empty for comments, blank lines and unsupported rules)
+    """
+    line = line.strip()
+    if not line or line[0] in "#![":
+        return []
+    if line.startswith("||"):
+        # Adblock: only whole-domain rules ("||example.com^" with optional $options)
+        rule = line[2:].split("$", 1)[0]
+        if rule.endswith("^"):
+            rule = rule[:-1]
+        if not rule or any(c in rule for c in "/^*|"):
+            return []
+        return [rule]
+    if line.startswith("@@") or line.startswith("|"):
+        return []
+    fields = line.split("#", 1)[0].split()
+    if not fields:
+        return []
+    if len(fields) > 1 and IP_RE.match(fields[0].lower()):
+        return fields[1:]
+    return fields[:1] if len(fields) == 1 else []
+
+
+def iter_domains(lines, stats):
+    """Yields each valid, normalized, not yet seen domain from blocklist lines."""
+    seen = set()
+    for line in lines:
+        stats.lines += 1
+        for host in parse_line(line):
+            domain = normalize_host(host)
+            if domain in HOSTS_BUILTINS or not DOMAIN_RE.match(domain):
+                stats.invalid += 1
+            elif domain in seen:
+                stats.duplicates += 1
+            else:
+                seen.add(domain)
+                stats.unique += 1
+                yield domain
+
+
+def import_sites(data_manager, sources):
+    """
+    Imports one or more blocklists in a single batch commit.
+    :param sources: Paths, "-" for stdin, or binary file objects
+    :return: ImportStats. Domains already in the blocklist count as duplicates.
+    """
+    stats = ImportStats()
+    start = time.perf_counter()
+
+    def lines():
+        for source in sources:
+            f = open_source(source)
+            try:
+                yield from f
+            finally:
+                # Close only what we opened; stdin and caller's files stay open
+                if isinstance(source, str) and source != "-":
+                    f.close()
+                else:
+                    f.detach()
+
+    domains = iter_domains(lines(), stats)
+    with data_manager.batch():
+        stats.added = data_manager.add_sites(domains)
+    # Domains the pipeline yielded that the blocklist already had
+    stats.duplicates += stats.unique - stats.added
+    stats.elapsed = time.perf_counter() - start
+    logging.info(f"Imported blocklist: {stats}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import hosts files and adblock lists into the blocklist.")
+    parser.add_argument("files", nargs="+", help="Blocklist files (plain or .gz); - reads stdin")
+    parser.add_argument("--db", help="Import into this SQLite database instead of the JSON data file")
+    args = parser.parse_args(argv)
+
+    from models import DATA_FILE, DataManager
+    if args.db:
+        from sqlite_backend import SqliteBackend
+        # A new database starts from the JSON data file, if there is one
+        data_manager = DataManager(backend=SqliteBackend(args.db, json_file=DATA_FILE))
+    else:
+        data_manager = DataManager(shared=True)
+    try:
+        stats = import_sites(data_manager, args.files)
+    finally:
+        data_manager.close()
+    print(stats)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,23 @@
+from startup_trace import trace
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 from kivy.uix.textinput import TextInput
-from kivy.uix.spinner import Spinner
-from kivy.uix.popup import Popup
 from kivy.core.window import Window
-from models import DataManager
-from blocking_service import BlockingService
 from datetime import datetime, timedelta
+import importlib
+import logging
+import math
+import threading
+import time
+
+# Storage, blocking backends and the account popup are imported where first
+# used, so their import cost lands after the first frame instead of before it.
+
+trace.mark("imports")
 
 # Set window size for testing (mobile-like)
 Window.size = (360, 640)
@@ -54,53 +62,32 @@ class TimeInput(TextInput):
             temp = value.replace(':', '')
             self.text = temp[:2] + ':' + temp[2:4]
 
-class AccountPopup(Popup):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.title = "Account Details"
-        self.size_hint = (0.8, 0.6)
-        
-        layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
-        
-        self.username_input = TextInput(hint_text="Username", multiline=False, size_hint_y=None, height=40, write_tab=False)
-        layout.add_widget(Label(text="Username", size_hint_y=None, height=30))
-        layout.add_widget(self.username_input)
-        
-        self.email_input = TextInput(hint_text="Email", multiline=False, size_hint_y=None, height=40, write_tab=False)
-        layout.add_widget(Label(text="Email", size_hint_y=None, height=30))
-        layout.add_widget(self.email_input)
+def format_remaining(seconds):
+    """
+    Formats a remaining time for the countdown: "3h 59m" above an hour, "59:59" below.
+    :return: (text, remaining seconds at which the text changes next)
+    """
+    step = 60 if seconds > 3600 else 1
+    units = max(math.ceil(seconds / step), 0)
+    if step == 60:
+        text = f"{units // 60}h {units % 60:02d}m left"
+    else:
+        text = f"{units // 60:02d}:{units % 60:02d} left"
+    return text, max(units - 1, 0) * step
 
-        self.phone_input = TextInput(hint_text="Phone Number", multiline=False, size_hint_y=None, height=40, write_tab=False)
-        layout.add_widget(Label(text="Phone Number", size_hint_y=None, height=30))
-        layout.add_widget(self.phone_input)
-        
-        btn_save = Button(text="Save", size_hint_y=None, height=40)
-        btn_save.bind(on_press=self.save_profile)
-        layout.add_widget(btn_save)
-        
-        self.content = layout
-        self.load_data()
-
-    def load_data(self):
-        app = App.get_running_app()
-        if app:
-            user = app.data_manager.get_user()
-            self.username_input.text = user.get("username", "")
-            self.email_input.text = user.get("email", "")
-            self.phone_input.text = user.get("phone", "")
-
-    def save_profile(self, instance):
-        app = App.get_running_app()
-        if app:
-            app.data_manager.update_user(
-                username=self.username_input.text.strip(), 
-                email=self.email_input.text.strip(),
-                phone=self.phone_input.text.strip()
-            )
-            self.dismiss()
+def __getattr__(name):
+    # Keeps `from main import AccountPopup` working without importing it up front
+    if name == "AccountPopup":
+        from account_popup import AccountPopup
+        return AccountPopup
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class MainLayout(BoxLayout):
-    def __init__(self, **kwargs):
+    def __init__(self, deferred=False, **kwargs):
+        """
+        :param deferred: Only build the header now and show a loading label;
+                         the caller finishes the screen with build_body()
+        """
         super().__init__(**kwargs)
         self.orientation = 'vertical'
         self.padding = 10
@@ -113,7 +100,25 @@ class MainLayout(BoxLayout):
         btn_account.bind(on_press=self.open_account)
         header.add_widget(btn_account)
         self.add_widget(header)
-        
+
+        # One trigger, re-armed for the moment the displayed remaining time next changes.
+        # Created here, as the app may be paused before a deferred body is built.
+        self._countdown_tick = Clock.create_trigger(self._update_countdown)
+        self._countdown_paused = False
+
+        self.loading_label = None
+        if deferred:
+            self.loading_label = Label(text="Loading...")
+            self.add_widget(self.loading_label)
+        else:
+            self.build_body()
+
+    def build_body(self):
+        """Builds everything below the header."""
+        if self.loading_label:
+            self.remove_widget(self.loading_label)
+            self.loading_label = None
+
         # --- Timer Controls ---
         self.add_widget(Label(text="Select Duration", size_hint_y=None, height=30))
         
@@ -155,9 +160,10 @@ class MainLayout(BoxLayout):
         # --- Site Management ---
         self.add_widget(Label(text="Blocked Sites", size_hint_y=None, height=30))
         
-        # Dropdown (Spinner)
-        self.site_spinner = Spinner(text='Select Site', values=(), size_hint_y=None, height=40)
-        self.add_widget(self.site_spinner)
+        # Searchable list; takes up the space left over by the fixed-height rows
+        from site_list import SiteList
+        self.site_list = SiteList()
+        self.add_widget(self.site_list)
         
         # Add/Delete Controls
         site_controls = BoxLayout(size_hint_y=None, height=40, spacing=5)
@@ -177,14 +183,14 @@ class MainLayout(BoxLayout):
         # --- Blocking Status ---
         self.status_label = Label(text="Status: Inactive", font_size=18, size_hint_y=None, height=40)
         self.add_widget(self.status_label)
+
+        self.countdown_label = Label(text="", size_hint_y=None, height=30)
+        self.add_widget(self.countdown_label)
         
         self.toggle_btn = Button(text="Start Blocking", size_hint_y=None, height=60)
         self.toggle_btn.bind(on_press=self.toggle_blocking)
         self.add_widget(self.toggle_btn)
         
-        # Spacer
-        self.add_widget(Label())
-        
         # --- Footer ---
         footer = Label(text="[ Advertisement Space ]", size_hint_y=None, height=40, color=(0.5, 0.5, 0.5, 1))
         self.add_widget(footer)
@@ -194,6 +200,7 @@ class MainLayout(BoxLayout):
         # Schedule update check? For now just check on startup
         
     def open_account(self, instance):
+        from account_popup import AccountPopup
         AccountPopup().open()
         
     def set_timer(self, minutes):
@@ -233,16 +240,24 @@ class MainLayout(BoxLayout):
             start_dt = parse_dt(s_text)
             end_dt = parse_dt(e_text)
             
-            # Handle crossing midnight or basic validation
-            if end_dt <= start_dt:
-                # Assuming next day if end < start? Or just error?
-                # For simplicity, assume same day and error if invalid
-                self.selected_label.text = "Error: End time must be after Start time"
+            if end_dt == start_dt:
+                self.selected_label.text = "Error: End time must differ from Start time"
                 return
+            # An end before the start is an overnight range ending the next day
+            if end_dt < start_dt:
+                end_dt += timedelta(days=1)
+            if end_dt <= now:
+                # Today's range is over: schedule tomorrow's
+                start_dt += timedelta(days=1)
+                end_dt += timedelta(days=1)
 
-            diff = end_dt - start_dt
-            minutes = int(diff.total_seconds() / 60)
-            self.set_timer(minutes)
+            app = App.get_running_app()
+            if app.schedule_engine is None:
+                self.selected_label.text = "Error: Time ranges can't be scheduled on the daemon"
+                return
+            # A one-off window: blocking starts at the chosen start time (now if already inside it)
+            app.schedule_engine.add_once(start_dt, end_dt)
+            self.selected_label.text = f"Scheduled {start_dt:%a %H:%M} to {end_dt:%a %H:%M}"
             
         except ValueError:
             self.selected_label.text = "Error: Use HH:MM format"
@@ -250,29 +265,31 @@ class MainLayout(BoxLayout):
     def refresh_sites(self):
         app = App.get_running_app()
         if app:
-            sites = app.data_manager.get_blocked_sites()
-            self.site_spinner.values = sites
-            if sites:
-                self.site_spinner.text = sites[0]
-            else:
-                self.site_spinner.text = "No sites"
+            self.site_list.set_sites(app.data_manager.get_blocked_sites())
 
     def add_site(self, instance):
         site = self.new_site_input.text.strip()
         if site:
+            from canonical import canonicalize_site
+            try:
+                # Store and show "youtube.com" for "https://www.YouTube.com/watch"
+                site = canonicalize_site(site)
+            except ValueError as e:
+                self.selected_label.text = f"Error: {e}"
+                return
             app = App.get_running_app()
             app.data_manager.add_site(site)
             self.new_site_input.text = ""
-            self.refresh_sites()
+            self.site_list.add_site(site)
             # Auto-select new site
-            self.site_spinner.text = site
+            self.site_list.select(site)
 
     def delete_site(self, instance):
-        site = self.site_spinner.text
-        if site and site != "No sites":
+        site = self.site_list.selected
+        if site:
             app = App.get_running_app()
             app.data_manager.remove_site(site)
-            self.refresh_sites()
+            self.site_list.remove_site(site)
 
     def toggle_blocking(self, instance):
         app = App.get_running_app()
@@ -309,23 +326,155 @@ class MainLayout(BoxLayout):
             self.toggle_btn.text = f"blocked until {until_str}"
             self.toggle_btn.background_color = (1, 0, 0, 1)
             # Disable inputs if strict?
+            self._update_countdown()
         else:
             self.status_label.text = "Status: Inactive"
             self.toggle_btn.text = "Start Blocking"
             self.toggle_btn.background_color = (1, 1, 1, 1)
+            self._countdown_tick.cancel()
+            self.countdown_label.text = ""
+
+    def _update_countdown(self, dt=None):
+        """Shows the remaining time and re-arms the tick for when the text will next change."""
+        self._countdown_tick.cancel()
+        if self._countdown_paused:
+            return
+        app = App.get_running_app()
+        deadline = app.blocking_service.get_deadline()
+        if deadline is None:
+            # Expired (or stopped elsewhere) since the last tick
+            self.update_ui_state(False)
+            return
+        remaining = deadline - time.monotonic()
+        text, next_change = format_remaining(remaining)
+        if self.countdown_label.text != text:
+            self.countdown_label.text = text
+        # At zero the tick lands on the deadline itself, where get_deadline() reports expiry
+        self._countdown_tick.timeout = max(remaining - next_change, 0)
+        self._countdown_tick()
+
+    def pause_countdown(self):
+        """Stops the tick entirely, e.g. while the app is in the background."""
+        self._countdown_paused = True
+        self._countdown_tick.cancel()
+
+    def resume_countdown(self):
+        self._countdown_paused = False
+        if self.loading_label is not None:
+            return  # The body isn't built yet; it shows the state once it is
+        app = App.get_running_app()
+        self.update_ui_state(app.blocking_service.is_active())
 
 class RefocusApp(App):
+    # Show the window first and load data and the rest of the screen on later frames
+    fast_start = True
+
+    data_manager = None
+    blocking_service = None
+    schedule_engine = None
+    subscriptions = None
+    attempt_log = None
+    compile_thread = None
+
     def build(self):
-        self.data_manager = DataManager()
-        self.blocking_service = BlockingService(self.data_manager)
-        
-        layout = MainLayout()
-        
+        if not self.fast_start:
+            self.load_services()
+            self.layout = MainLayout()
+            self._show_state(self.layout)
+            return self.layout
+
+        self.layout = MainLayout(deferred=True)
+        trace.mark("layout shell")
+        Clock.schedule_once(self._on_first_frame, 0)
+        return self.layout
+
+    def _on_first_frame(self, dt):
+        trace.mark("first frame")
+        Clock.schedule_once(self._load_data, 0)
+
+    def _load_data(self, dt):
+        self.load_services()
+        trace.mark("data load")
+        Clock.schedule_once(self._build_body, 0)
+
+    def _build_body(self, dt):
+        self.layout.build_body()
+        self._show_state(self.layout)
+        trace.mark("layout build")
+        trace.report()
+        # Warm up what the first taps need while the user is still reading the screen
+        Clock.schedule_once(lambda dt: importlib.import_module("account_popup"), 0.5)
+
+    def load_services(self):
+        from daemon_client import RemoteBlockingService, RemoteDataManager, connect
+        client = connect()
+        if client is not None:
+            # A headless daemon owns the data and enforcement; the UI only talks to it
+            self.data_manager = RemoteDataManager(client)
+            self.blocking_service = RemoteBlockingService(client)
+            return
+
+        from models import DataManager
+        from blocking_service import BlockingService
+        from dns_sinkhole import DnsSinkhole
+        from filter_proxy import FilterProxy
+        from scheduler import ScheduleEngine
+        from subscriptions import SubscriptionManager
+        from compiled_blocklist import COMPILED_FILE
+        from attempt_log import AttemptLog
+
+        self.data_manager = DataManager(shared=True, write_behind=True)
+        self.attempt_log = AttemptLog()
+        self.blocking_service = BlockingService(self.data_manager, backends=[DnsSinkhole(), FilterProxy()],
+                                                compiled_file=COMPILED_FILE, attempt_log=self.attempt_log)
+        self.schedule_engine = ScheduleEngine(self.blocking_service, self.data_manager)
+        self.schedule_engine.start()
+        self.subscriptions = SubscriptionManager(self.data_manager)
+        self.subscriptions.start()
+
+    def _show_state(self, layout):
         # Check initial state
         if self.blocking_service.is_active():
             layout.update_ui_state(True)
-        
-        return layout
+        # Sessions also start (scheduler) and expire on other threads
+        self.blocking_service.on_state_change(
+            lambda event, service: Clock.schedule_once(lambda dt: layout.update_ui_state(service.is_active())))
+
+    def on_pause(self):
+        if self.data_manager is None:
+            return True
+        self.layout.pause_countdown()
+        # Android may kill a paused app without calling on_stop
+        self.data_manager.flush()
+        if self.schedule_engine is None:
+            return True  # Running against the daemon, which keeps its own files
+        # Have the compiled blocklist ready for the next cold start, compiling off the UI thread
+        if self.compile_thread is None or not self.compile_thread.is_alive():
+            self.compile_thread = threading.Thread(target=self._compile_blocklist, name="compile-blocklist",
+                                                   daemon=True)
+            self.compile_thread.start()
+        return True
+
+    def _compile_blocklist(self):
+        from compiled_blocklist import COMPILED_FILE, ensure_compiled
+        try:
+            ensure_compiled(self.data_manager, COMPILED_FILE)
+        except OSError as e:
+            logging.error(f"Could not compile blocklist: {e}")
+
+    def on_resume(self):
+        if self.data_manager is not None:
+            self.layout.resume_countdown()
+
+    def on_stop(self):
+        if self.data_manager is None:
+            return
+        if self.schedule_engine is not None:
+            self.schedule_engine.stop()
+            self.subscriptions.stop()
+        if self.attempt_log is not None:
+            self.attempt_log.close()
+        self.data_manager.close()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,287 @@
+"""
+In-process metrics for the blocking engine.
+
+Instruments are created once at import time by the modules they measure:
+    LOOKUPS = metrics.counter("refocus_lookups_total", "Hosts checked against the blocklist")
+    LOOKUPS.inc()
+Recording is a plain attribute update under the GIL (no locks), a few hundred
+nanoseconds at most, so metrics stay on in production. Concurrent increments
+from several threads can very occasionally lose a count, which is fine for
+monitoring.
+
+Exports: REGISTRY.snapshot() (JSON-ready dict), REGISTRY.prometheus_text(),
+and MetricsServer, which serves both on localhost (/metrics, /metrics.json).
+
+Disabling: set REFOCUS_METRICS=0 in the environment before start-up, or call
+REGISTRY.disable() at runtime. Either replaces every instrument's recording
+method with a no-op, so instrumented code pays only for an empty call.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENV_FLAG = "REFOCUS_METRICS"
+METRICS_ADDR = ("127.0.0.1", 9464)
+
+# Upper bounds in seconds, from 1us to 10s
+LATENCY_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# Labeled counters stop adding labels past this and count the rest under OVERFLOW_LABEL
+MAX_LABELS = 1000
+OVERFLOW_LABEL = "_other"
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+_NULL_TIMER = nullcontext()
+
+
+def _null_timer():
+    return _NULL_TIMER
+
+
+class Counter:
+    kind = "counter"
+    recorders = ("inc",)
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def reset(self):
+        self.value = 0
+
+    def snapshot(self):
+        return self.value
+
+    def prometheus_lines(self):
+        yield f"{self.name} {self.value}"
+
+
+class LabeledCounter:
+    kind = "counter"
+    recorders = ("inc",)
+
+    def __init__(self, name, help, label, max_labels=MAX_LABELS):
+        """
+        :param label: Name of the label, e.g. "rule"
+        :param max_labels: Distinct label values kept before counting under OVERFLOW_LABEL
+        """
+        self.name = name
+        self.help = help
+        self.label = label
+        self.max_labels = max_labels
+        self.values = {}
+
+    def inc(self, value, amount=1):
+        values = self.values
+        if value in values:
+            values[value] += amount
+        elif len(values) < self.max_labels:
+            values[value] = amount
+        else:
+            values[OVERFLOW_LABEL] = values.get(OVERFLOW_LABEL, 0) + amount
+
+    def reset(self):
+        self.values = {}
+
+    def snapshot(self):
+        return dict(self.values)
+
+    def prometheus_lines(self):
+        for value, count in sorted(self.values.items()):
+            yield f'{self.name}{{{self.label}="{_escape(value)}"}} {count}'
+
+
+class Histogram:
+    kind = "histogram"
+    recorders = ("observe", "time")
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.reset()
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block. Meant for coarse operations like saves."""
+        return _Timer(self)
+
+    def reset(self):
+        # One slot per bucket plus the +Inf overflow
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def snapshot(self):
+        return {"buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+                "count": sum(self.counts), "sum": self.sum}
+
+    def prometheus_lines(self):
+        cumulative = 0
+        for bound, count in zip([*map(repr, self.buckets), "+Inf"], self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}} {cumulative}'
+        yield f"{self.name}_sum {self.sum}"
+        yield f"{self.name}_count {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._instruments = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            instrument = self._instruments.get(name)
+            if instrument is not None:
+                if type(instrument) is not cls:
+                    raise ValueError(f"Metric {name} is already registered as a {type(instrument).__name__}")
+                return instrument
+            instrument = self._instruments[name] = cls(name, *args, **kwargs)
+            if not self.enabled:
+                self._silence(instrument)
+            return instrument
+
+    def counter(self, name, help):
+        return self._register(Counter, name, help)
+
+    def labeled_counter(self, name, help, label, max_labels=MAX_LABELS):
+        return self._register(LabeledCounter, name, help, label, max_labels)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help, buckets)
+
+    def get(self, name):
+        return self._instruments[name]
+
+    @staticmethod
+    def _silence(instrument):
+        for method in instrument.recorders:
+            setattr(instrument, method, _null_timer if method == "time" else _noop)
+
+    def disable(self):
+        """Turns every recording method into a no-op."""
+        with self._lock:
+            self.enabled = False
+            for instrument in self._instruments.values():
+                self._silence(instrument)
+
+    def enable(self):
+        with self._lock:
+            self.enabled = True
+            for instrument in self._instruments.values():
+                for method in instrument.recorders:
+                    instrument.__dict__.pop(method, None)
+
+    def reset(self):
+        for instrument in list(self._instruments.values()):
+            instrument.reset()
+
+    def snapshot(self):
+        """:return: {metric name: value} ready for json.dumps"""
+        return {name: instrument.snapshot() for name, instrument in sorted(self._instruments.items())}
+
+    def prometheus_text(self):
+        """:return: Every metric in the Prometheus text exposition format"""
+        lines = []
+        for name, instrument in sorted(self._instruments.items()):
+            lines.append(f"# HELP {name} {instrument.help}")
+            lines.append(f"# TYPE {name} {instrument.kind}")
+            lines.extend(instrument.prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry(enabled=os.environ.get(ENV_FLAG, "1") != "0")
+
+counter = REGISTRY.counter
+labeled_counter = REGISTRY.labeled_counter
+histogram = REGISTRY.histogram
+
+
+class MetricsServer:
+    """Serves /metrics (Prometheus) and /metrics.json on localhost from a background thread."""
+
+    def __init__(self, registry=REGISTRY, listen=METRICS_ADDR):
+        self.registry = registry
+        self.listen = listen
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._httpd.server_address[:2] if self._httpd else None
+
+    def start(self):
+        """:raises OSError: if the port cannot be bound"""
+        if self._httpd:
+            return
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry.prometheus_text().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(registry.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(self.listen, Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        logging.info(f"Metrics served on http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def stop(self):
+        if not self._httpd:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        self._httpd = None
+        self._thread = None
@@ -1,8 +1,29 @@
+import copy
 import json
+import logging
 import os
+import threading
+import time
+import zlib
+import metrics
+from collections import deque
+from canonical import CANONICAL_VERSION, canonicalize_site, canonicalize_sites
+from contextlib import contextmanager
+from storage import FileWatcher, GenerationLock, Journal, JOURNAL_COMPACT_BYTES, POLL_INTERVAL, atomic_write
+from url_rules import parse_url_rule
 
 DATA_FILE = os.path.join("data", "user_data.json")
 
+# Window in which write-behind mode coalesces a burst of mutations into one write
+WRITE_DELAY = 0.5
+# Site edits remembered for site_changes_since; readers further behind re-read the blocklist
+SITE_CHANGE_LOG = 256
+# Default seconds between refreshes of a subscribed blocklist (see subscriptions.py)
+SUBSCRIPTION_INTERVAL = 24 * 3600
+
+SAVE_SECONDS = metrics.histogram("refocus_save_seconds", "Time spent in save_data, per backend call")
+WRITE_SECONDS = metrics.histogram("refocus_background_write_seconds", "Time to write the data file in write-behind mode")
+
 DEFAULT_DATA = {
     "user": {
         "username": "User",
@@ -11,76 +32,895 @@ DEFAULT_DATA = {
         "profile_pic": "default.png"
     },
     "blocked_sites": [],
+    "url_rules": [],  # URL and keyword rules, see url_rules.py
+    # Subscribed blocklists by name: source, interval, validators and their own "sites"
+    "subscriptions": {},
     "settings": {
         "blocking_active": False,
         "block_until": None,
-        "strict_mode": True  # Default to True as per requirements ("strict blocking")
+        "strict_mode": True,  # Default to True as per requirements ("strict blocking")
+        "site_format": CANONICAL_VERSION  # Sites are stored canonicalized (see canonical.py)
     }
 }
 
-class DataManager:
-    def __init__(self, data_file=DATA_FILE):
+def site_hash(url):
+    """64-bit hash of a site, XOR-ed into an order-independent fingerprint of the blocklist."""
+    data = url.encode()
+    return zlib.crc32(data) << 32 | zlib.adler32(data)
+
+def read_data_file(path):
+    """Reads a user data JSON file, upgrading older layouts. Falls back to the defaults if unreadable."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+            # Ensure structure is up to date (simple migration)
+            if "strict_mode" not in data.get("settings", {}):
+                if "settings" not in data:
+                    data["settings"] = DEFAULT_DATA["settings"].copy()
+                    # Files this old predate canonical sites
+                    del data["settings"]["site_format"]
+                else:
+                    data["settings"]["strict_mode"] = True
+            data.setdefault("subscriptions", {})
+            return data
+    except (json.JSONDecodeError, IOError):
+        return copy.deepcopy(DEFAULT_DATA)
+
+def _merged_subscription(entry, fields, added=(), removed=()):
+    """
+    :param entry: A stored subscription, or None for a new one
+    :return: A new entry with fields updated and sites added and removed. `entry`
+             is left as it was, so a copy of the data taken earlier stays consistent.
+    """
+    sites = entry["sites"] if entry else []
+    if removed:
+        removed = set(removed)
+        sites = [url for url in sites if url not in removed]
+    if added:
+        sites = sites + list(added)
+    return {**(entry or {}), **fields, "sites": sites}
+
+class JsonBackend:
+    """
+    Keeps all data in memory and persists it as a JSON file (optionally journaled,
+    write-behind, or shared between processes).
+
+    In shared mode every mutation is a read-modify-write under an exclusive
+    flock on data_file + ".lock", which also holds a generation number bumped by
+    each write. A mutation first reloads the file if another process has written
+    since, so concurrent writers never lose each other's updates. Between
+    mutations, a FileWatcher (inotify, or polling the generation) reloads the
+    data only when the generation has changed.
+
+    Shared and write-behind, a mutation only changes the data in memory and
+    queues its journal record; the writer thread takes the flock. If another
+    process wrote in the meantime, the writer (like any reload) reads its data
+    and replays the queued records on top before writing, so neither side's
+    updates are lost and the caller never waits for the lock or the disk.
+    """
+
+    def __init__(self, data_file=DATA_FILE, journaled=False, compact_threshold=JOURNAL_COMPACT_BYTES,
+                 write_behind=False, write_delay=WRITE_DELAY, shared=False, poll_interval=POLL_INTERVAL):
+        """
+        :param data_file: JSON file holding the user data
+        :param journaled: If True, mutations are appended to a journal next to
+                          data_file instead of rewriting the whole file each time
+        :param compact_threshold: Journal size in bytes that triggers a background compaction
+        :param write_behind: If True, save_data only marks the data dirty and a writer
+                             thread writes it out, coalescing bursts within write_delay seconds
+        :param shared: If True, other processes may use data_file at the same time
+        :param poll_interval: Seconds between checks for changes where inotify isn't available
+        """
+        if journaled and write_behind:
+            raise ValueError("journaled and write_behind modes are mutually exclusive")
+        if shared and journaled:
+            raise ValueError("shared mode can't be journaled")
         self.data_file = data_file
-        self.data = self.load_data()
+        self.journal = Journal(data_file, compact_threshold) if journaled else None
+        self.write_behind = write_behind
+        self.write_delay = write_delay
+        self._lock = threading.RLock()
+        self._writer = None
+        self._batch_depth = 0
+        self._batch_dirty = False
+        self._file_lock = GenerationLock(data_file + ".lock") if shared else None
+        self._generation = None
+        self._watcher = None
+        self._listeners = []
+        self.reloads = 0
+        # Shared and write-behind: records of the mutations not written yet, and whether
+        # the data was replaced wholesale since the last write (then it is written as is)
+        self._pending = []
+        self._pending_full = False
+        if write_behind:
+            self._start_writer()
+        if shared:
+            with self._lock, self._file_lock.exclusive():
+                self.data = self.load_data()
+                self._generation = self._file_lock.generation()
+        else:
+            self.data = self.load_data()
+        self._index_sites()
+        # Reloads caused by other processes' writes
+        self.reloads = 0
+        if shared:
+            self._watcher = FileWatcher(self._file_lock.path, self._on_file_change, poll_interval,
+                                        probe=self._file_lock.generation)
+            self._watcher.start()
+            # In case another process wrote before the watcher was in place
+            self._on_file_change()
 
     def load_data(self):
+        if self.journal:
+            return self._load_journaled()
+
         if not os.path.exists(self.data_file):
-            self.save_data(DEFAULT_DATA)
-            return DEFAULT_DATA.copy()
-        
-        try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-                # Ensure structure is up to date (simple migration)
-                if "strict_mode" not in data.get("settings", {}):
-                    if "settings" not in data:
-                        data["settings"] = DEFAULT_DATA["settings"].copy()
+            if self._file_lock:
+                # Written now, under the file lock __init__ holds, even if write-behind
+                atomic_write(self.data_file, json.dumps(DEFAULT_DATA, indent=4))
+                self._file_lock.bump()
+            else:
+                self.save_data(copy.deepcopy(DEFAULT_DATA))
+            return copy.deepcopy(DEFAULT_DATA)
+        return read_data_file(self.data_file)
+
+    def _load_journaled(self):
+        data, records = self.journal.load()
+        if data is None:
+            # First journaled run: migrate the plain JSON file (left in place as a backup)
+            if os.path.exists(self.data_file):
+                data = read_data_file(self.data_file)
+            else:
+                data = copy.deepcopy(DEFAULT_DATA)
+            self.journal.write_snapshot(data, self.journal.seq)
+        sites = set(data["blocked_sites"])
+        for record in records:
+            self._apply(data, sites, record)
+        return data
+
+    def _apply(self, data, sites, record):
+        op = record["op"]
+        if op == "add_site":
+            if record["url"] not in sites:
+                sites.add(record["url"])
+                data["blocked_sites"].append(record["url"])
+        elif op == "remove_site":
+            if record["url"] in sites:
+                sites.discard(record["url"])
+                data["blocked_sites"].remove(record["url"])
+        elif op == "add_url_rule":
+            if record["rule"] not in data.setdefault("url_rules", []):
+                data["url_rules"].append(record["rule"])
+        elif op == "remove_url_rule":
+            if record["rule"] in data.get("url_rules", []):
+                data["url_rules"].remove(record["rule"])
+        elif op == "update_user":
+            data["user"].update(record["user"])
+        elif op == "update_settings":
+            data["settings"].update(record["settings"])
+        elif op == "put_subscription":
+            subscriptions = data.setdefault("subscriptions", {})
+            name = record["name"]
+            subscriptions[name] = _merged_subscription(subscriptions.get(name), record["fields"],
+                                                       record.get("added", ()), record.get("removed", ()))
+        elif op == "remove_subscription":
+            data.setdefault("subscriptions", {}).pop(record["name"], None)
+        else:
+            raise ValueError(f"Unknown journal record: {op}")
+
+    def _commit(self, record):
+        """Persists a mutation that has already been applied to self.data."""
+        if self._batch_depth:
+            self._batch_dirty = True
+        if self.journal:
+            # Inside a batch, records are fsync'd and compacted once when the batch ends
+            if self.journal.append(record, sync=not self._batch_depth) and not self._batch_depth:
+                self.journal.compact(self._copy_data())
+            return
+        if self._file_lock and self.write_behind:
+            self._pending.append(record)
+        if not self._batch_depth:
+            self.save_data()
+
+    def _index_sites(self):
+        self._site_index = set(self.data.get("blocked_sites", []))
+        self._sites_hash = 0
+        for url in self._site_index:
+            self._sites_hash ^= site_hash(url)
+        # url -> number of subscriptions listing it, and the fingerprint of those urls
+        self._subscribed = {}
+        self._subscribed_hash = 0
+        for entry in self.data.get("subscriptions", {}).values():
+            self._count_subscribed(entry["sites"], 1)
+
+    def _count_subscribed(self, urls, delta):
+        counts = self._subscribed
+        for url in urls:
+            count = counts.get(url, 0) + delta
+            if count:
+                counts[url] = count
+            else:
+                del counts[url]
+            if count == (1 if delta > 0 else 0):
+                # First subscription to list it, or the last one gone
+                self._subscribed_hash ^= site_hash(url)
+
+    def _copy_data(self):
+        # One level deep is enough: the sections only hold scalars, and subscription
+        # entries are replaced rather than modified (see _merged_subscription)
+        return {key: value.copy() if isinstance(value, (dict, list)) else value
+                for key, value in self.data.items()}
+
+    @contextmanager
+    def batch(self):
+        """Defers whole-file saves until the outermost batch ends."""
+        with self._mutating():
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._batch_dirty:
+                    self._batch_dirty = False
+                    if self.journal:
+                        self.journal.sync()
+                        if self.journal.needs_compaction():
+                            self.journal.compact(self._copy_data())
                     else:
-                        data["settings"]["strict_mode"] = True
-                return data
-        except (json.JSONDecodeError, IOError):
-            return DEFAULT_DATA.copy()
+                        self.save_data()
 
     def save_data(self, data=None):
-        if data is not None:
-            self.data = data
-        
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
-        
-        with open(self.data_file, 'w') as f:
-            json.dump(self.data, f, indent=4)
+        with self._mutating(), SAVE_SECONDS.time():
+            if data is not None:
+                self.data = data
+                self._index_sites()
+                self._replaced()
+
+            if self._file_lock and not self.write_behind:
+                atomic_write(self.data_file, json.dumps(self.data, indent=4))
+                self._generation = self._file_lock.bump()
+                return
+
+            if self.journal:
+                # A full save is a snapshot; the log before it is no longer needed. Unlike the
+                # compactions after appends, it can't be skipped: no record holds this change.
+                self.journal.wait()
+                self.journal.compact(self._copy_data())
+                return
+
+            if self.write_behind:
+                self._dirty_gen += 1
+                self._changed.notify_all()
+                return
+
+            # Ensure directory exists
+            os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
+
+            with open(self.data_file, 'w') as f:
+                json.dump(self.data, f, indent=4)
+
+    def _replaced(self):
+        """Notes that self.data was replaced wholesale, for a shared write-behind writer."""
+        if self._file_lock and self.write_behind:
+            self._pending.clear()
+            self._pending_full = True
+
+    @contextmanager
+    def _mutating(self):
+        """
+        Holds the data lock and, in shared mode, the file lock with self.data brought up to date
+        (shared and write-behind, the writer thread takes care of the file).
+        """
+        if self._file_lock is None or self.write_behind:
+            with self._lock:
+                yield
+            return
+        with self._lock, self._file_lock.exclusive():
+            changed = self._reload_if_stale()
+            yield
+        if changed:
+            self._notify_change()
+
+    def _reload_if_stale(self):
+        """
+        Rereads the file if another process wrote it, replaying the mutations not
+        written yet on top. Call with both locks held.
+        """
+        generation = self._file_lock.generation()
+        if generation == self._generation or self._pending_full:
+            # Unchanged, or about to be overwritten with our data anyway
+            return False
+        self.data = read_data_file(self.data_file)
+        if self._pending:
+            sites = set(self.data["blocked_sites"])
+            for record in self._pending:
+                self._apply(self.data, sites, record)
+        self._index_sites()
+        self._generation = generation
+        self.reloads += 1
+        return True
+
+    def _on_file_change(self):
+        if self._file_lock.generation() == self._generation:
+            return  # Our own write
+        self.refresh()
+
+    def refresh(self):
+        """
+        Shared mode: picks up other processes' writes now rather than when the watcher notices.
+        :return: True if the data was reloaded
+        """
+        if self._file_lock is None:
+            return False
+        with self._lock, self._file_lock.shared():
+            changed = self._reload_if_stale()
+        if changed:
+            self._notify_change()
+        return changed
+
+    def add_change_listener(self, callback):
+        """
+        Registers callback(), called after data written by another process has been
+        loaded, possibly from the watcher thread.
+        :return: A function that unregisters the callback
+        """
+        self._listeners.append(callback)
+        return lambda: self._listeners.remove(callback)
+
+    def _notify_change(self):
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception:
+                logging.exception("Data change listener failed")
+
+    def _start_writer(self):
+        self._changed = threading.Condition(self._lock)
+        self._dirty_gen = 0
+        self._written_gen = 0
+        self._flush_requested = False
+        self._closing = False
+        self._writer = threading.Thread(target=self._write_loop, name="data-writer", daemon=True)
+        self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._dirty_gen != self._written_gen or self._closing)
+                if self._dirty_gen == self._written_gen:
+                    return
+                # Let a burst of mutations pile up before writing once
+                deadline = time.monotonic() + self.write_delay
+                while not (self._flush_requested or self._closing):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                self._flush_requested = False
+                gen = self._dirty_gen
+                changed = False
+                if self._file_lock:
+                    # Held past the data lock, until the file is written
+                    file_lock = self._file_lock.exclusive()
+                    file_lock.__enter__()
+                    changed = self._reload_if_stale()
+                    pending, self._pending = self._pending, []
+                    full, self._pending_full = self._pending_full, False
+                snapshot = self._copy_data()
+
+            try:
+                try:
+                    with WRITE_SECONDS.time():
+                        atomic_write(self.data_file, json.dumps(snapshot, indent=4))
+                    if self._file_lock:
+                        self._generation = self._file_lock.bump()
+                finally:
+                    if self._file_lock:
+                        file_lock.__exit__(None, None, None)
+            except OSError as e:
+                logging.error(f"Writing {self.data_file} failed, will retry: {e}")
+                if self._file_lock:
+                    with self._changed:
+                        if not self._pending_full:
+                            self._pending[:0] = pending
+                            self._pending_full = full
+                time.sleep(self.write_delay)
+                continue
+
+            with self._changed:
+                self._written_gen = gen
+                self._changed.notify_all()
+            if changed:
+                self._notify_change()
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every mutation made so far is on disk.
+        :return: False if the timeout expired first
+        """
+        if self.journal:
+            self.journal.wait()
+        if not self._writer:
+            return True
+        with self._changed:
+            target = self._dirty_gen
+            self._flush_requested = True
+            self._changed.notify_all()
+            return self._changed.wait_for(lambda: self._written_gen >= target, timeout)
+
+    def close(self):
+        """Flushes pending writes and stops background threads."""
+        if self._writer:
+            self.flush()
+            with self._changed:
+                self._closing = True
+                self._changed.notify_all()
+            self._writer.join()
+            self._writer = None
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+        if self._file_lock:
+            self._file_lock.close()
+            self._file_lock = None
+        if self.journal:
+            self.journal.close()
 
     def get_user(self):
         return self.data.get("user", DEFAULT_DATA["user"])
 
+    def update_user(self, changes):
+        with self._mutating():
+            self.data["user"].update(changes)
+            self._commit({"op": "update_user", "user": changes})
+
+    def get_blocked_sites(self, offset=0, limit=None, prefix=None):
+        sites = self.data.get("blocked_sites", [])
+        if prefix:
+            sites = [site for site in sites if site.startswith(prefix)]
+        if offset or limit is not None:
+            sites = sites[offset:None if limit is None else offset + limit]
+        return sites
+
+    def count_sites(self):
+        return len(self._site_index)
+
+    def sites_fingerprint(self):
+        return f"json:{len(self._site_index)}:{self._sites_hash:016x}"
+
+    def has_site(self, url):
+        return url in self._site_index
+
+    def add_site(self, url):
+        with self._mutating():
+            if url in self._site_index:
+                return False
+            self._site_index.add(url)
+            self._sites_hash ^= site_hash(url)
+            self.data["blocked_sites"].append(url)
+            self._commit({"op": "add_site", "url": url})
+            return True
+
+    def add_sites(self, urls):
+        """
+        Adds many sites with a single save.
+        :return: Number of sites that were new
+        """
+        with self.batch():
+            return sum(1 for url in urls if url and self.add_site(url))
+
+    def remove_site(self, url):
+        with self._mutating():
+            if url not in self._site_index:
+                return False
+            self._site_index.discard(url)
+            self._sites_hash ^= site_hash(url)
+            self.data["blocked_sites"].remove(url)
+            self._commit({"op": "remove_site", "url": url})
+            return True
+
+    def replace_sites(self, urls):
+        """Replaces the whole blocklist with one full save."""
+        with self._mutating():
+            self.data["blocked_sites"] = list(urls)
+            self._index_sites()
+            self._replaced()
+            self.save_data()
+
+    def get_url_rules(self):
+        return self.data.get("url_rules", [])
+
+    def add_url_rule(self, rule):
+        with self._mutating():
+            rules = self.data.setdefault("url_rules", [])
+            if rule in rules:
+                return False
+            rules.append(rule)
+            self._commit({"op": "add_url_rule", "rule": rule})
+            return True
+
+    def remove_url_rule(self, rule):
+        with self._mutating():
+            rules = self.data.get("url_rules", [])
+            if rule not in rules:
+                return False
+            rules.remove(rule)
+            self._commit({"op": "remove_url_rule", "rule": rule})
+            return True
+
+    def get_settings(self):
+        return self.data.get("settings", DEFAULT_DATA["settings"])
+
+    def update_settings(self, changes):
+        with self._mutating():
+            self.data["settings"].update(changes)
+            self._commit({"op": "update_settings", "settings": changes})
+
+    def get_subscriptions(self):
+        """:return: One dict per subscription with its name, fields and site count, but not the sites"""
+        return [{**{key: value for key, value in entry.items() if key != "sites"},
+                 "name": name, "count": len(entry["sites"])}
+                for name, entry in self.data.get("subscriptions", {}).items()]
+
+    def get_subscription_sites(self, name):
+        entry = self.data.get("subscriptions", {}).get(name)
+        return list(entry["sites"]) if entry else []
+
+    def get_subscribed_sites(self):
+        return list(self._subscribed)
+
+    def is_subscribed(self, url):
+        return url in self._subscribed
+
+    def subscriptions_fingerprint(self):
+        return f"{len(self._subscribed)}:{self._subscribed_hash:016x}" if self._subscribed else ""
+
+    def put_subscription(self, name, fields):
+        """
+        Creates a subscription or updates its fields.
+        :return: True if it was created
+        """
+        with self._mutating():
+            subscriptions = self.data.setdefault("subscriptions", {})
+            created = name not in subscriptions
+            subscriptions[name] = _merged_subscription(subscriptions.get(name), fields)
+            self._commit({"op": "put_subscription", "name": name, "fields": fields})
+            return created
+
+    def update_subscription(self, name, fields, added=(), removed=()):
+        """
+        Updates an existing subscription's fields and adds and removes some of its sites.
+        :return: False if there is no such subscription
+        """
+        with self._mutating():
+            subscriptions = self.data.get("subscriptions", {})
+            if name not in subscriptions:
+                return False
+            subscriptions[name] = _merged_subscription(subscriptions[name], fields, added, removed)
+            self._count_subscribed(removed, -1)
+            self._count_subscribed(added, 1)
+            self._commit({"op": "put_subscription", "name": name, "fields": fields,
+                          "added": list(added), "removed": list(removed)})
+            return True
+
+    def remove_subscription(self, name):
+        """:return: The sites the subscription listed, or None if there was none by that name"""
+        with self._mutating():
+            entry = self.data.get("subscriptions", {}).pop(name, None)
+            if entry is None:
+                return None
+            self._count_subscribed(entry["sites"], -1)
+            self._commit({"op": "remove_subscription", "name": name})
+            return entry["sites"]
+
+
+class DataManager:
+    def __init__(self, data_file=DATA_FILE, journaled=False, compact_threshold=JOURNAL_COMPACT_BYTES,
+                 write_behind=False, write_delay=WRITE_DELAY, backend=None, shared=False,
+                 poll_interval=POLL_INTERVAL):
+        """
+        :param data_file: JSON file holding the user data
+        :param journaled: See JsonBackend
+        :param write_behind: See JsonBackend
+        :param backend: Storage backend to use instead of the JSON file, e.g. SqliteBackend.
+                        The other arguments only configure the default JsonBackend.
+        :param shared: See JsonBackend. Use it when another process (the app, the
+                       importer, a worker) may open the same file.
+        """
+        self.data_file = data_file
+        if backend is None:
+            backend = JsonBackend(data_file, journaled=journaled, compact_threshold=compact_threshold,
+                                  write_behind=write_behind, write_delay=write_delay, shared=shared,
+                                  poll_interval=poll_interval)
+        self.backend = backend
+        # Bumped on every blocking state change so readers can cache what they derive from it
+        self.state_generation = 0
+        # Likewise for the blocked sites and the URL rules
+        self.sites_generation = 0
+        self.url_rules_generation = 0
+        # (sites_generation, added, removed) for the latest edits
+        self._site_changes = deque(maxlen=SITE_CHANGE_LOG)
+        if hasattr(backend, "add_change_listener"):
+            # Another process may have changed the blocking state too
+            backend.add_change_listener(self._on_external_change)
+        if self.backend.get_settings().get("site_format") != CANONICAL_VERSION:
+            self.migrate_sites()
+
+    def _on_external_change(self):
+        self.state_generation += 1
+        self.sites_generation += 1
+        self.url_rules_generation += 1
+
+    @property
+    def data(self):
+        return self.backend.data
+
+    def load_data(self):
+        return self.backend.load_data()
+
+    def save_data(self, data=None):
+        self.backend.save_data(data)
+        if data is not None:
+            self.state_generation += 1
+            self.sites_generation += 1
+            self.url_rules_generation += 1
+
+    def batch(self):
+        """
+        Groups many mutations into one write or transaction:
+            with data_manager.batch():
+                for url in urls:
+                    data_manager.add_site(url)
+        """
+        return self.backend.batch()
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every mutation made so far is on disk.
+        :return: False if the timeout expired first
+        """
+        return self.backend.flush(timeout)
+
+    def close(self):
+        """Flushes pending writes and releases the backend."""
+        self.backend.close()
+
+    def get_user(self):
+        return self.backend.get_user()
+
     def update_user(self, username=None, email=None, phone=None):
+        changes = {}
         if username:
-            self.data["user"]["username"] = username
+            changes["username"] = username
         if email:
-            self.data["user"]["email"] = email
+            changes["email"] = email
         if phone is not None:
-            self.data["user"]["phone"] = phone
-        self.save_data()
+            changes["phone"] = phone
+        self.backend.update_user(changes)
+
+    def get_blocked_sites(self, offset=0, limit=None, prefix=None):
+        """
+        :param offset: Number of sites to skip
+        :param limit: Maximum number of sites to return (None for all)
+        :param prefix: Only return sites starting with this prefix
+        """
+        return self.backend.get_blocked_sites(offset, limit, prefix)
+
+    def count_sites(self):
+        return self.backend.count_sites()
 
-    def get_blocked_sites(self):
-        return self.data.get("blocked_sites", [])
+    def sites_fingerprint(self):
+        """:return: An opaque string that changes whenever the set of blocked sites, manual or subscribed, does"""
+        fingerprint = self.backend.sites_fingerprint()
+        subscribed = self.backend.subscriptions_fingerprint()
+        return f"{fingerprint}+{subscribed}" if subscribed else fingerprint
+
+    def get_all_sites(self):
+        """:return: The manual sites followed by the subscribed ones that aren't also manual"""
+        sites = self.backend.get_blocked_sites()
+        subscribed = self.backend.get_subscribed_sites()
+        if not subscribed:
+            return sites
+        manual = set(sites)
+        return sites + [url for url in subscribed if url not in manual]
+
+    def _is_listed(self, url):
+        """:return: True if url is blocked manually or by any subscription"""
+        return self.backend.has_site(url) or self.backend.is_subscribed(url)
+
+    def has_site(self, url):
+        try:
+            return self.backend.has_site(canonicalize_site(url))
+        except ValueError:
+            return False
 
     def add_site(self, url):
-        if url and url not in self.data["blocked_sites"]:
-            self.data["blocked_sites"].append(url)
-            self.save_data()
+        """
+        Adds a site in its canonical form (see canonical.py), e.g. "youtube.com"
+        for "https://www.YouTube.com/watch".
+        :raises ValueError: if url has no usable host name or is only a public suffix
+        """
+        if url:
+            url = canonicalize_site(url)
+            if self.backend.add_site(url):
+                self._sites_changed((url,), ())
+
+    def add_sites(self, urls):
+        """
+        Adds many sites in one write or transaction, canonicalized. Invalid entries are skipped.
+        :return: Number of sites that were new
+        """
+        rules, _ = canonicalize_sites(urls)
+        new = None
+        with self.backend.batch():
+            if len(rules) <= SITE_CHANGE_LOG:
+                # Only the sites that weren't stored yet are logged as added
+                new = [url for url in dict.fromkeys(rules) if not self.backend.has_site(url)]
+            added = self.backend.add_sites(rules)
+        if added:
+            if new is not None:
+                self._sites_changed(new, ())
+            else:
+                # Not logged: a reader this far behind is better off re-reading the blocklist
+                self._sites_changed()
+        return added
 
     def remove_site(self, url):
-        if url in self.data["blocked_sites"]:
-            self.data["blocked_sites"].remove(url)
-            self.save_data()
+        try:
+            url = canonicalize_site(url)
+        except ValueError:
+            pass  # Can't be stored in this form; nothing to do unless it predates canonicalization
+        if self.backend.remove_site(url):
+            # A subscription may still list it
+            self._sites_changed((), () if self.backend.is_subscribed(url) else (url,))
+
+    def _sites_changed(self, added=None, removed=None):
+        """Bumps sites_generation, logging the edit for site_changes_since unless it is None."""
+        self.sites_generation += 1
+        if added is not None:
+            self._site_changes.append((self.sites_generation, tuple(added), tuple(removed)))
+
+    def site_changes_since(self, generation):
+        """
+        :param generation: A sites_generation seen earlier
+        :return: One (added sites, removed sites) pair per edit since then, oldest first, or
+                 None if that isn't known (too long ago, a bulk replace or another process)
+        """
+        changes = [change for change in self._site_changes if change[0] > generation]
+        if len(changes) != self.sites_generation - generation:
+            return None
+        return [(added, removed) for _, added, removed in changes]
+
+    def migrate_sites(self):
+        """
+        Rewrites every stored site in canonical form in one save, dropping invalid
+        entries and the duplicates canonicalization reveals. Runs automatically
+        when a blocklist predates the current CANONICAL_VERSION.
+        :return: Number of entries rewritten or dropped
+        """
+        sites = self.backend.get_blocked_sites()
+        rules, _ = canonicalize_sites(sites)
+        kept = set(rules)
+        changed = sum(1 for site in sites if site not in kept)
+        if changed or len(rules) != len(sites):
+            self.backend.replace_sites(rules)
+            self.sites_generation += 1
+            logging.info(f"Canonicalized blocklist: {changed} of {len(sites)} entries rewritten or dropped")
+        self.backend.update_settings({"site_format": CANONICAL_VERSION})
+        return changed
+
+    def get_url_rules(self):
+        """:return: URL and keyword rules (see url_rules.py), in stored form"""
+        return self.backend.get_url_rules()
+
+    def add_url_rule(self, rule):
+        """
+        Adds a URL or keyword rule, e.g. "/shorts/" or "re:/reels?(/|$)".
+        :raises ValueError: if the rule is empty or an invalid regex
+        :return: True if the rule was new
+        """
+        added = self.backend.add_url_rule(parse_url_rule(rule))
+        if added:
+            self.url_rules_generation += 1
+        return added
+
+    def remove_url_rule(self, rule):
+        try:
+            rule = parse_url_rule(rule)
+        except ValueError:
+            return False
+        removed = self.backend.remove_url_rule(rule)
+        if removed:
+            self.url_rules_generation += 1
+        return removed
 
     def update_blocking_state(self, active, until=None, strict=True):
-        self.data["settings"]["blocking_active"] = active
-        self.data["settings"]["block_until"] = until
-        self.data["settings"]["strict_mode"] = strict
-        self.save_data()
+        self.backend.update_settings({"blocking_active": active, "block_until": until, "strict_mode": strict})
+        self.state_generation += 1
 
     def get_blocking_state(self):
-        return self.data.get("settings", DEFAULT_DATA["settings"])
+        return self.backend.get_settings()
+
+    def get_schedules(self):
+        """:return: Blocking schedules in the format described in scheduler.py"""
+        return self.backend.get_settings().get("schedules", [])
+
+    def save_schedules(self, schedules):
+        self.backend.update_settings({"schedules": list(schedules)})
+
+    def get_subscriptions(self):
+        """
+        :return: One dict per subscribed blocklist: "name", "source", "interval",
+                 "count" (of sites) and, once refreshed, "etag", "last_modified",
+                 "hash", "checked" (a timestamp) and "error" (None if the last check worked)
+        """
+        return self.backend.get_subscriptions()
+
+    def add_subscription(self, name, source, interval=SUBSCRIPTION_INTERVAL):
+        """
+        Subscribes to a blocklist, or changes the source and interval of a subscription.
+        Its sites are fetched by SubscriptionManager.refresh (see subscriptions.py).
+        :param source: An http(s) URL or a local path, in any format importer.py reads
+        :param interval: Seconds between refreshes
+        :raises ValueError: if name or source is empty, or interval isn't positive
+        :return: True if the subscription is new
+        """
+        if not name or not source:
+            raise ValueError("A subscription needs a name and a source")
+        if interval <= 0:
+            raise ValueError(f"Invalid refresh interval: {interval}")
+        # Forget the validators so that the next refresh fetches the (possibly new) source in full
+        return self.backend.put_subscription(name, {"source": source, "interval": interval, "etag": None,
+                                                    "last_modified": None, "hash": None, "checked": None,
+                                                    "error": None})
+
+    def remove_subscription(self, name):
+        """
+        Unsubscribes, unblocking the sites only this subscription listed.
+        :return: False if there was no such subscription
+        """
+        sites = self.backend.remove_subscription(name)
+        if sites is None:
+            return False
+        removed = [url for url in sites if not self._is_listed(url)]
+        if removed:
+            self._sites_changed((), removed)
+        return True
+
+    def get_subscribed_sites(self):
+        """:return: Every site some subscription lists, each once"""
+        return self.backend.get_subscribed_sites()
+
+    def get_subscription_sites(self, name):
+        return self.backend.get_subscription_sites(name)
+
+    def update_subscription(self, name, **fields):
+        """Records a subscription's validators and check time, leaving its sites as they are."""
+        self.backend.update_subscription(name, fields)
+
+    def merge_subscription(self, name, sites, **fields):
+        """
+        Replaces a subscription's sites with a freshly fetched list, storing and
+        reporting only the difference: the running session and its enforcement
+        backends apply the sites added and removed, not the whole list.
+        :param sites: The list's entries; canonicalized here, invalid ones skipped
+        :param fields: Validators and check time, as for update_subscription
+        :return: (sites added, sites removed) to the subscription, or None if it is gone
+        """
+        current = set(self.backend.get_subscription_sites(name))
+        sites = list(sites)
+        # Stored sites are canonical already: only entries new to the list need canonicalizing
+        fresh = {url for url in sites if url in current}
+        rules, _ = canonicalize_sites(url for url in sites if url not in current)
+        added = [url for url in rules if url not in current and url not in fresh]
+        fresh.update(rules)
+        removed = [url for url in current if url not in fresh]
+        # Of those, the ones that change what is blocked
+        blocking = [url for url in added if not self._is_listed(url)]
+        if not self.backend.update_subscription(name, fields, added, removed):
+            return None
+        unblocking = [url for url in removed if not self._is_listed(url)]
+        if blocking or unblocking:
+            # Logged whatever the size: re-reading the blocklist would cost more than the delta
+            self._sites_changed(blocking, unblocking)
+        return len(added), len(removed)
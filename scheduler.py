@@ -0,0 +1,266 @@
+"""
+Recurring and one-off blocking schedules.
+
+Schedules are plain dicts so they can be persisted with the settings:
+    {"type": "weekly", "days": [0, 1, 2, 3, 4], "start": "09:00", "end": "17:30"}
+    {"type": "weekly", "days": [4], "start": "22:00", "end": "07:00"}   # overnight
+    {"type": "once", "start": "2030-01-01T09:00:00", "end": "2030-01-01T12:00:00"}
+Days are datetime.weekday() numbers (Monday is 0). A weekly window whose end
+is not after its start runs into the next day.
+
+All windows are compiled into two IntervalSets of merged, sorted, disjoint
+intervals: one over seconds-of-the-week for recurring windows and one over
+absolute timestamps for one-off sessions. "Is blocking required at t" and
+"when is the next transition" are then a couple of binary searches, no matter
+how many schedules exist. ScheduleEngine arms a single timer for the next
+transition and starts BlockingService sessions that end exactly at the
+boundary, so nothing polls.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+DAY = 24 * 3600
+WEEK = 7 * DAY
+
+WEEKDAYS = [0, 1, 2, 3, 4]
+WEEKEND = [5, 6]
+EVERY_DAY = [0, 1, 2, 3, 4, 5, 6]
+
+TYPE_WEEKLY = "weekly"
+TYPE_ONCE = "once"
+
+
+def parse_time_of_day(value):
+    """Parses "HH:MM" (00:00 to 24:00) into seconds after midnight."""
+    hours, _, minutes = value.partition(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes <= 59) or (hours == 24 and minutes):
+        raise ValueError(f"Invalid time of day: {value}")
+    return hours * 3600 + minutes * 60
+
+
+def week_offset(timestamp):
+    """:return: Seconds since local Monday 00:00 of the week containing timestamp"""
+    dt = datetime.fromtimestamp(timestamp)
+    return dt.weekday() * DAY + dt.hour * 3600 + dt.minute * 60 + dt.second + dt.microsecond / 1e6
+
+
+class IntervalSet:
+    """Half-open [start, end) intervals, merged into sorted disjoint runs."""
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            if end <= start:
+                continue
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def covering_end(self, t):
+        """:return: End of the run containing t, or None"""
+        i = bisect_right(self.starts, t) - 1
+        if i >= 0 and t < self.ends[i]:
+            return self.ends[i]
+        return None
+
+    def next_start(self, t):
+        """:return: First run start after t, or None"""
+        i = bisect_right(self.starts, t)
+        return self.starts[i] if i < len(self.starts) else None
+
+
+def compile_schedules(schedules):
+    """
+    :return: (weekly IntervalSet over seconds-of-week, one-off IntervalSet over timestamps)
+    :raises ValueError: on a malformed schedule
+    """
+    weekly = []
+    once = []
+    for schedule in schedules:
+        kind = schedule.get("type")
+        if kind == TYPE_WEEKLY:
+            start = parse_time_of_day(schedule["start"])
+            end = parse_time_of_day(schedule["end"])
+            if end <= start:
+                end += DAY
+            for day in schedule["days"]:
+                if not 0 <= day <= 6:
+                    raise ValueError(f"Invalid weekday: {day}")
+                s, e = day * DAY + start, day * DAY + end
+                if e > WEEK:
+                    # Sunday overnight windows wrap into Monday
+                    weekly.append((s, WEEK))
+                    weekly.append((0, e - WEEK))
+                else:
+                    weekly.append((s, e))
+        elif kind == TYPE_ONCE:
+            once.append((datetime.fromisoformat(schedule["start"]).timestamp(),
+                         datetime.fromisoformat(schedule["end"]).timestamp()))
+        else:
+            raise ValueError(f"Unknown schedule type: {kind}")
+    return IntervalSet(weekly), IntervalSet(once)
+
+
+class Schedule:
+    """Answers time queries over a compiled set of schedules."""
+
+    def __init__(self, schedules=()):
+        self.schedules = list(schedules)
+        self._weekly, self._once = compile_schedules(self.schedules)
+
+    def _covering_end(self, t):
+        ends = []
+        offset = week_offset(t)
+        end = self._weekly.covering_end(offset)
+        if end is not None:
+            ends.append(t - offset + end)
+        end = self._once.covering_end(t)
+        if end is not None:
+            ends.append(end)
+        return max(ends) if ends else None
+
+    def is_required(self, at=None):
+        """:return: True if blocking is required at timestamp `at` (default now)"""
+        return self._covering_end(time.time() if at is None else at) is not None
+
+    def run_end(self, at):
+        """
+        :return: Timestamp at which the blocking run covering `at` ends, following
+                 back-to-back and overlapping windows (capped at two weeks)
+        """
+        end = at
+        while end < at + 2 * WEEK:
+            next_end = self._covering_end(end)
+            if next_end is None:
+                break
+            end = next_end
+        return end
+
+    def next_start(self, at):
+        """:return: Timestamp of the next run start after `at`, or None"""
+        candidates = []
+        if len(self._weekly):
+            offset = week_offset(at)
+            start = self._weekly.next_start(offset)
+            if start is None:
+                start = WEEK + self._weekly.starts[0]
+            candidates.append(at - offset + start)
+        start = self._once.next_start(at)
+        if start is not None:
+            candidates.append(start)
+        return min(candidates) if candidates else None
+
+    def next_transition(self, at=None):
+        """
+        :return: (timestamp, required_after) of the next change in whether
+                 blocking is required, or None if there are no more changes
+        """
+        at = time.time() if at is None else at
+        if self.is_required(at):
+            return self.run_end(at), False
+        start = self.next_start(at)
+        return (start, True) if start is not None else None
+
+
+class ScheduleEngine:
+    def __init__(self, blocking_service, data_manager=None, schedules=None, strict=True):
+        """
+        :param blocking_service: Service scheduled sessions are started on
+        :param data_manager: Source of the blocklist, and where schedules are persisted
+        :param schedules: Initial schedules; loaded from data_manager if None
+        :param strict: Whether scheduled sessions are strict
+        """
+        self.blocking_service = blocking_service
+        self.data_manager = data_manager
+        self.strict = strict
+        if schedules is None:
+            schedules = data_manager.get_schedules() if data_manager else []
+        self.schedule = Schedule(schedules)
+        self._timer = None
+        self._running = False
+        self._lock = threading.RLock()
+
+    def set_schedules(self, schedules):
+        """Replaces all schedules, persists them and re-arms the timer."""
+        schedule = Schedule(schedules)
+        with self._lock:
+            self.schedule = schedule
+            if self.data_manager:
+                self.data_manager.save_schedules(schedule.schedules)
+            if self._running:
+                self._apply()
+
+    def add_schedule(self, schedule):
+        self.set_schedules(self.schedule.schedules + [schedule])
+
+    def add_once(self, start, end):
+        """
+        Adds a one-off window, dropping the one-off windows that have already ended.
+        :param start: datetime the window opens
+        :param end: datetime it closes
+        """
+        now = datetime.now()
+        kept = [schedule for schedule in self.schedule.schedules
+                if schedule.get("type") != TYPE_ONCE or datetime.fromisoformat(schedule["end"]) > now]
+        self.set_schedules(kept + [{"type": TYPE_ONCE, "start": start.isoformat(), "end": end.isoformat()}])
+
+    def start(self):
+        """Starts a session now if one is due and arms the timer for the next transition."""
+        with self._lock:
+            self._running = True
+            self._apply()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+    def _apply(self):
+        now = time.time()
+        if self.schedule.is_required(now):
+            self._start_session(now)
+        self._arm(now)
+
+    def _arm(self, now):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        transition = self.schedule.next_transition(now)
+        if transition is None:
+            return
+        self._timer = threading.Timer(max(0, transition[0] - now), self._on_transition)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_transition(self):
+        with self._lock:
+            if not self._running:
+                return
+            now = time.time()
+            # Stop transitions need no action: the session was started to expire right there
+            if self.schedule.is_required(now):
+                self._start_session(now)
+            # If the timer fired a hair early this re-arms for the same boundary
+            self._arm(now)
+
+    def _start_session(self, now):
+        end = self.schedule.run_end(now)
+        service = self.blocking_service
+        deadline = service.get_deadline()
+        if deadline is not None and deadline >= time.monotonic() + (end - now):
+            return  # An active session already covers this run
+        sites = self.data_manager.get_blocked_sites() if self.data_manager else []
+        logging.info(f"Scheduled blocking until {datetime.fromtimestamp(end):%Y-%m-%d %H:%M}")
+        service.start_blocking((end - now) / 60, sites, strict=self.strict)
@@ -0,0 +1,103 @@
+"""
+Search index over the blocked sites for the site list.
+
+Sites are kept sorted by their lower-cased form, so a prefix query is a
+bisect to the start of a contiguous range. Substring queries scan one joined
+string of every key with str.find, which runs in C and needs a single string
+instead of per-site n-gram sets; the offsets of the keys in that string map a
+hit back to its row. Adds and removes are single list insertions, and the
+joined string is rebuilt lazily on the next substring query.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+SEPARATOR = "\n"
+
+
+class SiteIndex:
+    def __init__(self, sites=()):
+        pairs = sorted({site.lower(): site for site in sites}.items())
+        self._keys = [key for key, _ in pairs]
+        self._sites = [site for _, site in pairs]
+        self._blob = None
+        self._offsets = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, site):
+        key = site.lower()
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def __iter__(self):
+        return iter(self._sites)
+
+    def add(self, site):
+        """:return: Position the site was inserted at, or -1 if it was already present"""
+        key = site.lower()
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return -1
+        self._keys.insert(i, key)
+        self._sites.insert(i, site)
+        self._blob = None
+        return i
+
+    def remove(self, site):
+        """:return: Position the site was removed from, or -1 if it wasn't present"""
+        key = site.lower()
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return -1
+        del self._keys[i]
+        del self._sites[i]
+        self._blob = None
+        return i
+
+    def prefix_range(self, prefix):
+        """:return: (start, end) positions of the sites starting with prefix"""
+        prefix = prefix.lower()
+        return bisect_left(self._keys, prefix), bisect_right(self._keys, prefix + "\U0010ffff")
+
+    def search(self, query, limit=None):
+        """
+        Finds the sites containing query, case-insensitively. Sites starting with
+        it come first; each group is in alphabetical order.
+        :param limit: Maximum number of sites to return (None for all)
+        """
+        query = query.strip().lower()
+        if not query:
+            return self._sites[:limit]
+        start, end = self.prefix_range(query)
+        results = self._sites[start:end if limit is None else min(end, start + limit)]
+        if limit is not None and len(results) >= limit:
+            return results
+        # The prefix matches are a contiguous run of rows, so only scan around them
+        for first, last in ((0, start), (end, len(self._keys))):
+            for i in self._substring_rows(query, first, last):
+                results.append(self._sites[i])
+                if limit is not None and len(results) >= limit:
+                    return results
+        return results
+
+    def _substring_rows(self, query, first, last):
+        """Yields, in order, the rows in [first, last) whose key contains query."""
+        if SEPARATOR in query or first >= last:
+            return
+        if self._blob is None:
+            self._blob = SEPARATOR.join(self._keys)
+            self._offsets = array("l", [0])
+            position = 0
+            for key in self._keys:
+                position += len(key) + 1
+                self._offsets.append(position)
+        blob, offsets = self._blob, self._offsets
+        find = blob.find
+        stop = offsets[last]
+        pos = find(query, offsets[first], stop)
+        while pos >= 0:
+            row = bisect_right(offsets, pos) - 1
+            yield row
+            # Continue after this row so each row is reported once
+            pos = find(query, offsets[row + 1], stop)
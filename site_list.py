@@ -0,0 +1,94 @@
+"""
+Searchable blocked-site list. The RecycleView only creates widgets for the
+rows on screen, however many sites there are.
+"""
+from kivy.properties import StringProperty
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.textinput import TextInput
+from kivy.uix.togglebutton import ToggleButton
+from site_index import SiteIndex
+
+ROW_HEIGHT = 36
+
+
+class SiteRow(RecycleDataViewBehavior, ToggleButton):
+    site_list = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.site_list = rv.site_list
+        self.state = "down" if data["text"] == self.site_list.selected else "normal"
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_release(self):
+        self.site_list.select(self.text)
+
+
+class SiteList(BoxLayout):
+    # The site the user last tapped, or "" if none
+    selected = StringProperty("")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.orientation = "vertical"
+        self.spacing = 5
+        self.index = SiteIndex()
+
+        self.search_input = TextInput(hint_text="Search sites", multiline=False, write_tab=False,
+                                      size_hint_y=None, height=36)
+        self.search_input.bind(text=lambda instance, value: self.apply_filter())
+        self.add_widget(self.search_input)
+
+        self.view = RecycleView(viewclass=SiteRow)
+        self.view.site_list = self
+        rows = RecycleBoxLayout(orientation="vertical", default_size=(None, ROW_HEIGHT),
+                                default_size_hint=(1, None), size_hint_y=None)
+        rows.bind(minimum_height=rows.setter("height"))
+        self.view.add_widget(rows)
+        self.add_widget(self.view)
+
+    @property
+    def query(self):
+        return self.search_input.text.strip()
+
+    @property
+    def visible_sites(self):
+        return [row["text"] for row in self.view.data]
+
+    def set_sites(self, sites):
+        """Replaces every site in the list."""
+        self.index = SiteIndex(sites)
+        if self.selected not in self.index:
+            self.selected = ""
+        self.apply_filter()
+
+    def apply_filter(self):
+        self.view.data = [{"text": site} for site in self.index.search(self.query)]
+
+    def add_site(self, site):
+        """Adds one site, updating only its row when no search is active."""
+        position = self.index.add(site)
+        if position < 0:
+            return
+        if self.query:
+            self.apply_filter()
+        else:
+            self.view.data.insert(position, {"text": site})
+
+    def remove_site(self, site):
+        position = self.index.remove(site)
+        if position < 0:
+            return
+        if site == self.selected:
+            self.selected = ""
+        if self.query:
+            self.apply_filter()
+        else:
+            del self.view.data[position]
+
+    def select(self, site):
+        self.selected = site
+        # Restyles the rows on screen; nothing is rebuilt
+        self.view.refresh_from_data()
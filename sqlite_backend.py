@@ -0,0 +1,341 @@
+"""
+SQLite storage backend for DataManager.
+
+Blocked sites live in a table with a unique index on the normalized domain,
+so membership checks, adds and removes are index lookups instead of list
+scans and whole-file rewrites. URL rules have a table of their own. User
+and settings sections are key/value rows, cached in memory because they are
+tiny and read on every state check. Subscribed blocklists keep their fields as
+a JSON row and their sites in a table indexed both ways, so a refresh
+inserts and deletes only the entries that changed.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from domain_matcher import normalize_host
+from models import DEFAULT_DATA, SAVE_SECONDS, read_data_file
+
+DB_FILE = os.path.join("data", "user_data.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocked_sites (
+    id INTEGER PRIMARY KEY,
+    domain TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS url_rules (
+    id INTEGER PRIMARY KEY,
+    rule TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS kv (
+    section TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (section, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    name TEXT PRIMARY KEY,
+    fields TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS subscription_sites (
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (name, url)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subscription_sites_url ON subscription_sites (url);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('sites_version', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('subscriptions_version', 0);
+CREATE TRIGGER IF NOT EXISTS blocked_sites_insert AFTER INSERT ON blocked_sites BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'sites_version';
+END;
+CREATE TRIGGER IF NOT EXISTS blocked_sites_delete AFTER DELETE ON blocked_sites BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'sites_version';
+END;
+CREATE TRIGGER IF NOT EXISTS subscription_sites_insert AFTER INSERT ON subscription_sites BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'subscriptions_version';
+END;
+CREATE TRIGGER IF NOT EXISTS subscription_sites_delete AFTER DELETE ON subscription_sites BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'subscriptions_version';
+END;
+"""
+
+SECTIONS = ("user", "settings")
+
+
+class SqliteBackend:
+    def __init__(self, db_file=DB_FILE, json_file=None):
+        """
+        :param db_file: SQLite database path
+        :param json_file: Existing JSON data file to import when the database is first created
+        """
+        self.db_file = db_file
+        self.json_file = json_file
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._sections = {}
+        self.load_data()
+
+    @property
+    def data(self):
+        """The whole data set as a dict in the JSON layout. Materializes every site."""
+        return {
+            "user": dict(self._sections["user"]),
+            "blocked_sites": self.get_blocked_sites(),
+            "url_rules": self.get_url_rules(),
+            "settings": dict(self._sections["settings"]),
+            "subscriptions": self._subscriptions_data(),
+        }
+
+    def _subscriptions_data(self):
+        subscriptions = {}
+        for subscription in self.get_subscriptions():
+            name = subscription.pop("name")
+            del subscription["count"]
+            subscriptions[name] = dict(subscription, sites=self.get_subscription_sites(name))
+        return subscriptions
+
+    def load_data(self):
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM kv LIMIT 1").fetchone() is None:
+                # Fresh database: import the JSON file if there is one
+                if self.json_file and os.path.exists(self.json_file):
+                    self.save_data(read_data_file(self.json_file))
+                else:
+                    self.save_data(copy.deepcopy(DEFAULT_DATA))
+            self._cache_sections()
+            return self._sections
+
+    def _cache_sections(self):
+        self._sections = {section: {} for section in SECTIONS}
+        for section, key, value in self._conn.execute("SELECT section, key, value FROM kv"):
+            self._sections.setdefault(section, {})[key] = json.loads(value)
+
+    def save_data(self, data=None):
+        """Replaces the whole database with `data` in one transaction. Without data, a no-op."""
+        if data is None:
+            return
+        with SAVE_SECONDS.time(), self.batch():
+            self._conn.execute("DELETE FROM blocked_sites")
+            self._conn.execute("DELETE FROM url_rules")
+            self._conn.execute("DELETE FROM kv")
+            self._conn.execute("DELETE FROM subscriptions")
+            self._conn.execute("DELETE FROM subscription_sites")
+            for section in SECTIONS:
+                self._write_section(section, data.get(section, DEFAULT_DATA[section]))
+            self.add_sites(data.get("blocked_sites", []))
+            self._conn.executemany("INSERT OR IGNORE INTO url_rules (rule) VALUES (?)",
+                                   ((rule,) for rule in data.get("url_rules", [])))
+            for name, entry in data.get("subscriptions", {}).items():
+                fields = {key: value for key, value in entry.items() if key != "sites"}
+                self.put_subscription(name, fields)
+                self.update_subscription(name, {}, entry.get("sites", ()))
+
+    @contextmanager
+    def batch(self):
+        """
+        Runs the enclosed mutations as a single transaction, rolled back if they raise.
+        A nested batch is part of the outermost one and fails or succeeds with it.
+        """
+        with self._lock:
+            if not self._batch_depth:
+                self._conn.execute("BEGIN")
+            self._batch_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self._conn.execute("ROLLBACK")
+                    # Drop section values the failed transaction cached
+                    self._cache_sections()
+                raise
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._conn.execute("COMMIT")
+
+    def flush(self, timeout=None):
+        # Commits are already durable in the WAL; fold it into the main database file
+        with self._lock:
+            if not self._batch_depth:
+                self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write_section(self, section, values):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO kv (section, key, value) VALUES (?, ?, ?)",
+            [(section, key, json.dumps(value)) for key, value in values.items()])
+        self._sections.setdefault(section, {}).update(values)
+
+    def get_user(self):
+        return self._sections["user"]
+
+    def update_user(self, changes):
+        with self._lock:
+            self._write_section("user", changes)
+
+    def get_settings(self):
+        return self._sections["settings"]
+
+    def update_settings(self, changes):
+        with self._lock:
+            self._write_section("settings", changes)
+
+    def get_blocked_sites(self, offset=0, limit=None, prefix=None):
+        """
+        Pages through the blocked sites. Without a prefix they come in insertion
+        order; with one, in domain order straight off the unique index.
+        """
+        limit = -1 if limit is None else limit
+        with self._lock:
+            if prefix:
+                prefix = normalize_host(prefix)
+                rows = self._conn.execute(
+                    "SELECT url FROM blocked_sites WHERE domain >= ? AND domain < ? "
+                    "ORDER BY domain LIMIT ? OFFSET ?", (prefix, prefix + "\U0010ffff", limit, offset))
+            else:
+                rows = self._conn.execute(
+                    "SELECT url FROM blocked_sites ORDER BY id LIMIT ? OFFSET ?", (limit, offset))
+            return [url for url, in rows]
+
+    def count_sites(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM blocked_sites").fetchone()[0]
+
+    def sites_fingerprint(self):
+        # The version is bumped by triggers on every insert and delete
+        with self._lock:
+            version, = self._conn.execute("SELECT value FROM meta WHERE key = 'sites_version'").fetchone()
+            max_id, = self._conn.execute("SELECT IFNULL(MAX(id), 0) FROM blocked_sites").fetchone()
+        return f"sqlite:{version}:{max_id}"
+
+    def has_site(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM blocked_sites WHERE domain = ?", (normalize_host(url),))
+            return row.fetchone() is not None
+
+    def add_site(self, url):
+        with self._lock:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO blocked_sites (domain, url) VALUES (?, ?)",
+                                        (normalize_host(url), url))
+            return cursor.rowcount > 0
+
+    def add_sites(self, urls):
+        """
+        Adds many sites in one transaction.
+        :return: Number of sites that were new
+        """
+        with self.batch():
+            cursor = self._conn.executemany("INSERT OR IGNORE INTO blocked_sites (domain, url) VALUES (?, ?)",
+                                            ((normalize_host(url), url) for url in urls if url))
+            return max(cursor.rowcount, 0)
+
+    def remove_site(self, url):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM blocked_sites WHERE domain = ?", (normalize_host(url),))
+            return cursor.rowcount > 0
+
+    def replace_sites(self, urls):
+        """Replaces the whole blocklist in one transaction."""
+        with self.batch():
+            self._conn.execute("DELETE FROM blocked_sites")
+            self.add_sites(urls)
+
+    def get_url_rules(self):
+        with self._lock:
+            return [rule for rule, in self._conn.execute("SELECT rule FROM url_rules ORDER BY id")]
+
+    def add_url_rule(self, rule):
+        with self._lock:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO url_rules (rule) VALUES (?)", (rule,))
+            return cursor.rowcount > 0
+
+    def remove_url_rule(self, rule):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM url_rules WHERE rule = ?", (rule,))
+            return cursor.rowcount > 0
+
+    def get_subscriptions(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, fields, (SELECT COUNT(*) FROM subscription_sites AS s WHERE s.name = subscriptions.name) "
+                "FROM subscriptions ORDER BY name").fetchall()
+        return [{**json.loads(fields), "name": name, "count": count} for name, fields, count in rows]
+
+    def get_subscription_sites(self, name):
+        with self._lock:
+            return [url for url, in self._conn.execute("SELECT url FROM subscription_sites WHERE name = ?", (name,))]
+
+    def get_subscribed_sites(self):
+        with self._lock:
+            return [url for url, in self._conn.execute("SELECT DISTINCT url FROM subscription_sites")]
+
+    def is_subscribed(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM subscription_sites WHERE url = ? LIMIT 1", (url,))
+            return row.fetchone() is not None
+
+    def subscriptions_fingerprint(self):
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM subscription_sites LIMIT 1").fetchone() is None:
+                return ""
+            version, = self._conn.execute("SELECT value FROM meta WHERE key = 'subscriptions_version'").fetchone()
+        return str(version)
+
+    def _subscription_fields(self, name):
+        row = self._conn.execute("SELECT fields FROM subscriptions WHERE name = ?", (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_subscription(self, name, fields):
+        """
+        Creates a subscription or updates its fields.
+        :return: True if it was created
+        """
+        with self.batch():
+            current = self._subscription_fields(name)
+            self._conn.execute("INSERT OR REPLACE INTO subscriptions (name, fields) VALUES (?, ?)",
+                               (name, json.dumps({**(current or {}), **fields})))
+            return current is None
+
+    def update_subscription(self, name, fields, added=(), removed=()):
+        """
+        Updates an existing subscription's fields and adds and removes some of its sites, in one transaction.
+        :return: False if there is no such subscription
+        """
+        with self.batch():
+            current = self._subscription_fields(name)
+            if current is None:
+                return False
+            if fields:
+                self._conn.execute("UPDATE subscriptions SET fields = ? WHERE name = ?",
+                                   (json.dumps({**current, **fields}), name))
+            self._conn.executemany("DELETE FROM subscription_sites WHERE name = ? AND url = ?",
+                                   ((name, url) for url in removed))
+            self._conn.executemany("INSERT OR IGNORE INTO subscription_sites (name, url) VALUES (?, ?)",
+                                   ((name, url) for url in added))
+            return True
+
+    def remove_subscription(self, name):
+        """:return: The sites the subscription listed, or None if there was none by that name"""
+        with self.batch():
+            if self._subscription_fields(name) is None:
+                return None
+            sites = self.get_subscription_sites(name)
+            self._conn.execute("DELETE FROM subscription_sites WHERE name = ?", (name,))
+            self._conn.execute("DELETE FROM subscriptions WHERE name = ?", (name,))
+            return sites
@@ -0,0 +1,42 @@
+"""
+Per-phase timing of app start-up.
+
+Set REFOCUS_STARTUP_TRACE=1 to have the app print where the time to
+interactive went (imports, data load, layout build, first frame).
+"""
+import os
+import time
+
+ENV_FLAG = "REFOCUS_STARTUP_TRACE"
+
+
+class StartupTrace:
+    def __init__(self, enabled=None):
+        """:param enabled: Print the report; defaults to whether ENV_FLAG is set"""
+        self.enabled = bool(os.environ.get(ENV_FLAG)) if enabled is None else enabled
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.phases = []
+
+    def mark(self, phase):
+        """Records the time since the previous mark as `phase`."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def total(self):
+        return self._last - self.start
+
+    def report(self):
+        """Prints the breakdown if enabled. :return: The report text"""
+        lines = ["Startup trace:"]
+        lines += [f"  {phase:<14}{seconds * 1000:8.1f} ms" for phase, seconds in self.phases]
+        lines.append(f"  {'total':<14}{self.total() * 1000:8.1f} ms")
+        text = "\n".join(lines)
+        if self.enabled:
+            print(text)
+        return text
+
+
+# Started as early as main.py can import it, so the import phase is covered
+trace = StartupTrace()
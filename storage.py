@@ -0,0 +1,380 @@
+"""
+Durable storage helpers for DataManager.
+
+Journal keeps the data as a snapshot file plus an append-only log of small
+mutation records. Each record carries a sequence number and the snapshot
+records the last sequence it contains, so replay after a crash at any point
+(mid-append, mid-compaction) applies every mutation exactly once.
+
+Compaction rotates the log aside (to .journal.<last seq>), writes a fresh
+snapshot on a background thread with an atomic rename, and only then deletes
+the rotated logs the snapshot covers.
+
+For files shared between processes, GenerationLock is an advisory (flock)
+lock whose file also holds a generation counter bumped by every write, and
+FileWatcher reports changes to it through inotify, or by polling where
+inotify isn't available.
+"""
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows
+    fcntl = None
+
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+POLL_INTERVAL = 0.5
+
+_GENERATION = struct.Struct("<Q")
+
+# From <sys/inotify.h>
+_IN_MODIFY = 0x002
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+
+def fsync_dir(directory):
+    """Makes a rename in `directory` durable. A no-op where directories can't be opened."""
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_writer(path, binary=True, mode=None):
+    """
+    Yields a file whose contents replace path atomically once the block exits
+    without an exception. Nothing at path changes if it raises.
+    :param mode: Permission bits for the new file (mkstemp's 0600 by default)
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if binary else "w") as f:
+            yield f
+            f.flush()
+            if mode is not None:
+                os.chmod(f.fileno() if os.chmod in os.supports_fd else tmp_path, mode)
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    fsync_dir(directory)
+
+
+def atomic_write(path, text):
+    """Writes text (str or bytes) to path via a fsync'd temp file and an atomic rename."""
+    with atomic_writer(path, binary=isinstance(text, bytes)) as f:
+        f.write(text)
+
+
+class Journal:
+    def __init__(self, base_path, compact_threshold=JOURNAL_COMPACT_BYTES):
+        """
+        :param base_path: Path the snapshot (.snapshot) and log (.journal) files are derived from
+        :param compact_threshold: Log size in bytes that triggers a background compaction
+        """
+        self.snapshot_file = base_path + ".snapshot"
+        self.log_file = base_path + ".journal"
+        self.compact_threshold = compact_threshold
+        self.seq = 0
+        self._log = None
+        self._log_size = 0
+        self._compaction = None
+
+    def load(self):
+        """
+        Reads the snapshot and the records logged after it.
+        :return: (data, records) where data is None if there is no snapshot yet
+        """
+        data = None
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r") as f:
+                snapshot = json.load(f)
+            data = snapshot["data"]
+            snapshot_seq = snapshot["seq"]
+        self.seq = snapshot_seq
+
+        records = []
+        for path in self._rotated_logs() + [self.log_file]:
+            for record in self._read_log(path):
+                if record["seq"] > self.seq:
+                    records.append(record)
+                    self.seq = record["seq"]
+        return data, records
+
+    def _rotated_logs(self):
+        """:return: Paths of rotated logs, oldest first"""
+        directory = os.path.dirname(self.log_file) or "."
+        prefix = os.path.basename(self.log_file) + "."
+        if not os.path.isdir(directory):
+            return []
+        suffixes = sorted(int(name[len(prefix):]) for name in os.listdir(directory)
+                          if name.startswith(prefix) and name[len(prefix):].isdigit())
+        return [f"{self.log_file}.{suffix}" for suffix in suffixes]
+
+    def _read_log(self, path):
+        if not os.path.exists(path):
+            return
+        good_size = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final append from a crash; everything before it is intact
+                    logging.warning(f"Discarding corrupt journal tail in {path}")
+                    break
+                good_size += len(line)
+                yield record
+        if good_size != os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(good_size)
+
+    def write_snapshot(self, data, seq):
+        atomic_write(self.snapshot_file, json.dumps({"seq": seq, "data": data}, separators=(",", ":")))
+
+    def append(self, record, sync=True):
+        """
+        Appends a mutation record.
+        :param sync: If False, the record is not fsync'd until the next sync()
+        :return: True once the log has grown past the compaction threshold
+        """
+        if self._log is None:
+            os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+            self._log = open(self.log_file, "ab")
+            self._log_size = self._log.tell()
+        self.seq += 1
+        record["seq"] = self.seq
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        self._log.write(line)
+        if sync:
+            self.sync()
+        self._log_size += len(line)
+        return self.needs_compaction()
+
+    def needs_compaction(self):
+        return self._log_size >= self.compact_threshold
+
+    def sync(self):
+        """Makes every appended record durable."""
+        if self._log is not None:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def compact(self, data):
+        """
+        Starts a background compaction into a new snapshot.
+        :param data: A copy of the current state, which the caller must not mutate afterwards
+        :return: False if a previous compaction is still running
+        """
+        if self._compaction is not None and self._compaction.is_alive():
+            return False
+        if self._log is not None:
+            self.sync()
+            self._log.close()
+            self._log = None
+        if os.path.exists(self.log_file):
+            os.replace(self.log_file, f"{self.log_file}.{self.seq}")
+        self._log_size = 0
+        self._compaction = threading.Thread(target=self._compact, args=(data, self.seq),
+                                            name="journal-compaction", daemon=True)
+        self._compaction.start()
+        return True
+
+    def _compact(self, data, seq):
+        try:
+            self.write_snapshot(data, seq)
+            for path in self._rotated_logs():
+                if int(path.rsplit(".", 1)[1]) <= seq:
+                    os.remove(path)
+            fsync_dir(os.path.dirname(self.log_file))
+        except OSError as e:
+            logging.error(f"Journal compaction failed: {e}")
+
+    def wait(self):
+        """Blocks until a running compaction has finished."""
+        if self._compaction is not None:
+            self._compaction.join()
+
+    def close(self):
+        self.wait()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+class GenerationLock:
+    """
+    Advisory lock shared by every process using the same path, on a small file
+    holding a generation counter. Re-entrant within a process; threads of one
+    process must still serialize among themselves.
+    """
+
+    def __init__(self, path):
+        """:raises OSError: where flock isn't available"""
+        if fcntl is None:
+            raise OSError("File locking is not supported on this platform")
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._guard = threading.RLock()
+        self._depth = 0
+        self._mode = None
+
+    def close(self):
+        os.close(self._fd)
+
+    def generation(self):
+        """:return: The current generation; reading it needs no lock"""
+        raw = os.pread(self._fd, _GENERATION.size, 0)
+        return _GENERATION.unpack(raw)[0] if len(raw) == _GENERATION.size else 0
+
+    def bump(self):
+        """Stamps a new generation. Only call while holding exclusive(). :return: The new generation"""
+        generation = self.generation() + 1
+        os.pwrite(self._fd, _GENERATION.pack(generation), 0)
+        return generation
+
+    @contextmanager
+    def _hold(self, mode):
+        with self._guard:
+            if self._depth == 0:
+                fcntl.flock(self._fd, mode)
+                self._mode = mode
+            elif mode == fcntl.LOCK_EX and self._mode != fcntl.LOCK_EX:
+                raise RuntimeError("Cannot upgrade a shared lock to exclusive")
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                    self._mode = None
+
+    def exclusive(self):
+        return self._hold(fcntl.LOCK_EX)
+
+    def shared(self):
+        return self._hold(fcntl.LOCK_SH)
+
+
+class FileWatcher:
+    """Calls callback() from a background thread after a file is modified."""
+
+    def __init__(self, path, callback, poll_interval=POLL_INTERVAL, use_inotify=True, probe=None):
+        """
+        :param poll_interval: Seconds between checks when polling
+        :param use_inotify: If False, always poll
+        :param probe: Function whose result changes with the file, compared when polling.
+                      Defaults to the file's inode, size and mtime.
+        """
+        self.path = path
+        self.callback = callback
+        self.probe = probe or self._stat
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.mode = None
+        self._thread = None
+        self._stop_r = self._stop_w = None
+        self._inotify_fd = None
+
+    def start(self):
+        self._stop_r, self._stop_w = os.pipe()
+        self.mode = "poll"
+        if self.use_inotify:
+            try:
+                self._inotify_fd = self._open_inotify()
+                self.mode = "inotify"
+            except (OSError, AttributeError) as e:
+                logging.info(f"inotify unavailable, polling {self.path}: {e}")
+        if self.mode == "inotify":
+            target, args = self._inotify_loop, ()
+        else:
+            # Taken now so a change made right after start() isn't missed
+            target, args = self._poll_loop, (self.probe(),)
+        self._thread = threading.Thread(target=target, args=args, name="file-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        os.write(self._stop_w, b"x")
+        self._thread.join()
+        self._thread = None
+        for fd in (self._stop_r, self._stop_w, self._inotify_fd):
+            if fd is not None:
+                os.close(fd)
+        self._stop_r = self._stop_w = self._inotify_fd = None
+
+    def _open_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, os.fsencode(self.path), _IN_MODIFY | _IN_CLOSE_WRITE | _IN_ATTRIB) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"inotify_add_watch failed for {self.path}")
+        return fd
+
+    def _notify(self):
+        try:
+            self.callback()
+        except Exception:
+            logging.exception(f"Change callback for {self.path} failed")
+
+    def _inotify_loop(self):
+        while True:
+            readable, _, _ = select.select([self._inotify_fd, self._stop_r], [], [])
+            if self._stop_r in readable:
+                return
+            # Drain every queued event so a burst of writes costs one callback
+            try:
+                while os.read(self._inotify_fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+            self._notify()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _poll_loop(self, last):
+        while True:
+            readable, _, _ = select.select([self._stop_r], [], [], self.poll_interval)
+            if readable:
+                return
+            current = self.probe()
+            if current != last:
+                last = current
+                self._notify()
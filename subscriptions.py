@@ -0,0 +1,201 @@
+"""
+Subscribed blocklists: named sources (an http(s) URL or a local path, in any
+format importer.py reads) that are refreshed periodically and kept apart from
+the user's own blocked sites.
+
+A refresh costs little when nothing changed. Requests are conditional
+(If-None-Match / If-Modified-Since with the validators the server sent last
+time; a local file is compared by size and mtime), so an unchanged list is a
+304 with no body. A body that comes back anyway is hashed, and one with the
+same SHA-256 as last time isn't parsed. A list that did change is merged as a
+difference (DataManager.merge_subscription): storage, the running session's
+matcher and the enforcement backends only see the entries added and removed.
+
+Due subscriptions are fetched concurrently by a bounded pool of worker
+threads, which also caps the number of open connections; parsing happens on
+the workers too, while merges are applied one at a time by the caller.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import metrics
+from importer import ImportStats, iter_domains, open_source
+
+FETCH_WORKERS = 4
+FETCH_TIMEOUT = 30
+# Larger bodies are refused rather than parsed
+MAX_BYTES = 64 * 1024 * 1024
+# Seconds before a failed fetch is tried again
+RETRY_INTERVAL = 15 * 60
+# Longest wait between checks, so subscriptions added meanwhile are fetched soon
+CHECK_INTERVAL = 5 * 60
+USER_AGENT = "Refocus blocklist subscriber"
+
+UPDATED = "updated"
+NOT_MODIFIED = "not modified"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+FETCHES = metrics.labeled_counter("refocus_subscription_fetches_total", "Subscription refreshes by outcome",
+                                  "outcome")
+
+
+def is_url(source):
+    return source.startswith(("http://", "https://"))
+
+
+def fetch(source, etag=None, last_modified=None, timeout=FETCH_TIMEOUT):
+    """
+    Fetches a blocklist unless it is unchanged since the validators were received.
+    :param source: An http(s) URL or a local path
+    :param etag: ETag from the last fetch (for a local file, its size and mtime)
+    :param last_modified: Last-Modified from the last fetch
+    :raises OSError: if the source can't be read (urllib's errors are OSErrors), or is too large
+    :return: (body, or None if not modified; etag; last_modified)
+    """
+    if not is_url(source):
+        st = os.stat(source)
+        validator = f"{st.st_size}-{st.st_mtime_ns}"
+        if validator == etag:
+            return None, etag, last_modified
+        with open(source, "rb") as f:
+            return _read(f, source), validator, None
+    request = urllib.request.Request(source, headers={"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"})
+    if etag:
+        request.add_header("If-None-Match", etag)
+    if last_modified:
+        request.add_header("If-Modified-Since", last_modified)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            # A gzip body is recognized by open_source whether or not it was asked for
+            return _read(response, source), response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+        return None, e.headers.get("ETag", etag), e.headers.get("Last-Modified", last_modified)
+
+
+def _read(f, source):
+    body = f.read(MAX_BYTES + 1)
+    if len(body) > MAX_BYTES:
+        raise OSError(f"{source} is larger than {MAX_BYTES} bytes")
+    return body
+
+
+def parse(body):
+    """:return: (the domains a blocklist names, ImportStats)"""
+    stats = ImportStats()
+    domains = list(iter_domains(open_source(io.BytesIO(body)), stats))
+    return domains, stats
+
+
+class SubscriptionManager:
+    def __init__(self, data_manager, workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT):
+        """
+        :param data_manager: Where subscriptions and their sites are stored
+        :param workers: Most fetches (and connections) at a time
+        :param timeout: Seconds before a fetch is given up
+        """
+        self.data_manager = data_manager
+        self.workers = workers
+        self.timeout = timeout
+        self._refresh_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def next_check(subscription):
+        """:return: When a subscription is due to be refreshed, as a timestamp"""
+        checked = subscription.get("checked")
+        if checked is None:
+            return 0
+        return checked + (RETRY_INTERVAL if subscription.get("error") else subscription["interval"])
+
+    def refresh(self, names=None, force=False):
+        """
+        Fetches subscriptions concurrently and merges the ones that changed.
+        :param names: Subscriptions to refresh whether due or not; None for all that are due
+        :param force: Ignore the validators and content hash, refetching and merging everything
+        :return: {name: UPDATED, NOT_MODIFIED, UNCHANGED or FAILED}
+        """
+        subscriptions = self.data_manager.get_subscriptions()
+        if names is not None:
+            due = [subscription for subscription in subscriptions if subscription["name"] in names]
+        else:
+            now = time.time()
+            due = [subscription for subscription in subscriptions if force or self.next_check(subscription) <= now]
+        outcomes = {}
+        if not due:
+            return outcomes
+        with self._refresh_lock, ThreadPoolExecutor(min(self.workers, len(due)),
+                                                    thread_name_prefix="subscription") as pool:
+            futures = {pool.submit(self._fetch, subscription, force): subscription["name"] for subscription in due}
+            for future in as_completed(futures):
+                name = futures[future]
+                outcomes[name] = self._merge(name, future)
+                FETCHES.inc(outcomes[name])
+        return outcomes
+
+    def _fetch(self, subscription, force):
+        """Runs on a worker. :return: (outcome, domains or None, fields to store)"""
+        etag, last_modified = (None, None) if force else (subscription.get("etag"), subscription.get("last_modified"))
+        body, etag, last_modified = fetch(subscription["source"], etag, last_modified, self.timeout)
+        fields = {"etag": etag, "last_modified": last_modified, "checked": time.time(), "error": None}
+        if body is None:
+            return NOT_MODIFIED, None, fields
+        fields["hash"] = hashlib.sha256(body).hexdigest()
+        if fields["hash"] == subscription.get("hash") and not force:
+            return UNCHANGED, None, fields
+        domains, _ = parse(body)
+        return UPDATED, domains, fields
+
+    def _merge(self, name, future):
+        try:
+            outcome, domains, fields = future.result()
+        except Exception as e:
+            # OSError, ValueError for a malformed URL, but also http.client.IncompleteRead or EOFError
+            # from a truncated gzip body: any of them would otherwise be retried every second by _run
+            logging.warning(f"Could not refresh subscription {name}: {e!r}")
+            self.data_manager.update_subscription(name, checked=time.time(), error=str(e))
+            return FAILED
+        if domains is None:
+            self.data_manager.update_subscription(name, **fields)
+            return outcome
+        changes = self.data_manager.merge_subscription(name, domains, **fields)
+        if changes is not None:
+            logging.info(f"Subscription {name}: {len(domains)} sites, {changes[0]} added, {changes[1]} removed")
+        return outcome
+
+    def start(self):
+        """Refreshes subscriptions as they fall due, on a background thread."""
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="subscriptions", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background refreshes, waiting for one in progress to finish."""
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logging.exception("Refreshing subscriptions failed")
+            subscriptions = self.data_manager.get_subscriptions()
+            wait = CHECK_INTERVAL
+            if subscriptions:
+                wait = min(wait, min(map(self.next_check, subscriptions)) - time.time())
+            self._stopping.wait(max(wait, 1))
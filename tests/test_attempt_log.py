@@ -0,0 +1,157 @@
+import os
+import shutil
+import unittest
+from attempt_log import DAY, HOUR, SEGMENT_SUFFIX, ROLLUP_SUFFIX, AttemptLog, read_segment
+from blocking_service import BlockingService
+from models import DataManager
+
+TEST_DATA_DIR = "tests/data"
+TEST_LOG_DIR = os.path.join(TEST_DATA_DIR, "attempts")
+
+# A Monday, 00:00 UTC
+MONDAY = 1900540800
+
+
+class TestAttemptLog(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.log = AttemptLog(TEST_LOG_DIR, flush_interval=0.05)
+
+    def tearDown(self):
+        self.log.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(TEST_LOG_DIR) if name.endswith(SEGMENT_SUFFIX))
+
+    def reopen(self, **kwargs):
+        self.log.close()
+        self.log = AttemptLog(TEST_LOG_DIR, flush_interval=0.05, **kwargs)
+
+    def test_record_and_read_back(self):
+        self.log.record("m.example.com", "example.com", session=7, ts=MONDAY + 10)
+        self.log.record("ads.test.org", "*.test.org", session=7, ts=MONDAY + 20)
+        self.assertTrue(self.log.flush(timeout=5))
+        self.assertEqual(list(self.log.iter_events()),
+                         [(MONDAY + 10, 7, "m.example.com", "example.com"),
+                          (MONDAY + 20, 7, "ads.test.org", "*.test.org")])
+        self.assertEqual(list(self.log.iter_events(since=MONDAY + 15)),
+                         [(MONDAY + 20, 7, "ads.test.org", "*.test.org")])
+
+    def test_rollups(self):
+        now = MONDAY + 3 * DAY
+        for i in range(30):
+            self.log.record("a.com", "a.com", ts=now - HOUR * (i % 3))
+        for i in range(20):
+            self.log.record("b.com", "b.com", ts=now - DAY)
+        self.log.record("old.com", "old.com", ts=now - 8 * DAY)
+        self.log.record("c.com", "c.com", ts=now)
+
+        self.assertEqual(self.log.top_hosts_this_week(2, now=now), [("a.com", 30), ("b.com", 20)])
+        self.assertEqual(self.log.top_hosts(10), [("a.com", 30), ("b.com", 20), ("c.com", 1), ("old.com", 1)])
+        self.assertEqual(self.log.top_hosts(10, since=now - HOUR, until=now), [("a.com", 10)])
+        hourly = dict(self.log.hourly_counts(since=now - 2 * HOUR))
+        self.assertEqual(hourly, {now - 2 * HOUR: 10, now - HOUR: 10, now: 11})
+
+    def test_rollups_survive_restart(self):
+        for i in range(100):
+            self.log.record(f"host{i % 5}.com", "rule", ts=MONDAY + i)
+        self.reopen(retention_days=100000)
+        # Loaded from the sealed segment's rollup, not the raw events
+        self.assertEqual(len(self.segments()), 1)
+        self.assertTrue(os.path.exists(os.path.join(TEST_LOG_DIR, self.segments()[0][:-4] + ROLLUP_SUFFIX)))
+        self.assertEqual(self.log.top_hosts(2), [("host0.com", 20), ("host1.com", 20)])
+        self.assertEqual(len(list(self.log.iter_events())), 100)
+
+    def test_recovers_unsealed_segment(self):
+        for i in range(10):
+            self.log.record("example.com", "example.com", ts=MONDAY + i)
+        self.log.flush()
+        path = os.path.join(TEST_LOG_DIR, self.segments()[0])
+        # Simulate a crash: no rollup, and the last record cut short
+        self.log._file.close()
+        self.log._file = None
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 3)
+        self.reopen(retention_days=100000)
+        self.assertEqual(self.log.top_hosts(1), [("example.com", 9)])
+
+    def test_rotation(self):
+        self.reopen(retention_days=100000, segment_bytes=1024)
+        for i in range(200):
+            self.log.record(f"host{i}.com", "rule", ts=MONDAY + i)
+        self.log.record("tuesday.com", "rule", ts=MONDAY + DAY)
+        self.log.close()
+        self.assertGreater(len(self.segments()), 5)
+        self.assertTrue(all(os.path.getsize(os.path.join(TEST_LOG_DIR, name)) < 1024 + 64
+                            for name in self.segments()))
+        # Each segment is readable on its own
+        total = sum(len(list(read_segment(os.path.join(TEST_LOG_DIR, name)))) for name in self.segments())
+        self.assertEqual(total, 201)
+        self.log = AttemptLog(TEST_LOG_DIR, retention_days=100000)
+
+    def test_retention_drops_whole_segments(self):
+        self.reopen(retention_days=2)
+        self.log.record("old.com", "rule", ts=MONDAY)
+        self.log.record("new.com", "rule", ts=MONDAY + DAY)
+        self.log.flush()
+        self.assertEqual(len(self.segments()), 2)
+        # Writing on Wednesday starts a new segment and expires Monday's
+        self.log.record("wed.com", "rule", ts=MONDAY + 2 * DAY)
+        self.log.flush()
+        self.assertEqual(len(self.segments()), 2)
+        self.assertEqual(self.log.top_hosts(10), [("new.com", 1), ("wed.com", 1)])
+        self.assertNotIn("old.com", [event[2] for event in self.log.iter_events()])
+
+    def test_retention_with_out_of_order_timestamps(self):
+        self.reopen(retention_days=2)
+        self.log.record("new.com", "rule", ts=MONDAY + DAY)
+        self.log.record("old.com", "rule", ts=MONDAY)
+        self.log.flush()
+        self.assertEqual(len(self.segments()), 2)
+        # Tuesday's hour and segment came first, yet only Monday's expire
+        self.log.expire(MONDAY + 2 * DAY)
+        self.assertEqual(self.log.top_hosts(10), [("new.com", 1)])
+        self.log.record("wed.com", "rule", ts=MONDAY + 2 * DAY)
+        self.log.flush()
+        self.assertEqual([event[2] for event in self.log.iter_events()], ["new.com", "wed.com"])
+        self.assertEqual(len(self.segments()), 2)
+
+    def test_burst(self):
+        for i in range(20000):
+            self.log.record(f"host{i % 50}.com", "rule", ts=MONDAY + i / 1000)
+        self.assertTrue(self.log.flush(timeout=10))
+        self.assertEqual(sum(count for _, count in self.log.hourly_counts()), 20000)
+        self.assertEqual(len(self.segments()), 1)
+
+
+class TestServiceAttempts(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.dm = DataManager(os.path.join(TEST_DATA_DIR, "test_user_data.json"))
+        self.log = AttemptLog(TEST_LOG_DIR)
+        self.service = BlockingService(self.dm, attempt_log=self.log)
+
+    def tearDown(self):
+        self.service.stop_blocking(force=True)
+        self.log.close()
+        self.dm.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_blocks_are_recorded(self):
+        self.assertFalse(self.service.is_blocked("example.com"))
+        self.service.start_blocking(1, ["example.com"], strict=False)
+        self.assertTrue(self.service.is_blocked("m.example.com"))
+        self.assertFalse(self.service.is_blocked("example.org"))
+        self.service.check_hosts(["example.com", "example.net"])
+        events = list(self.log.iter_events())
+        self.assertEqual([(host, rule) for _, _, host, rule in events],
+                         [("m.example.com", "example.com"), ("example.com", "example.com")])
+        session = int(self.service.get_block_until().timestamp())
+        self.assertEqual({event[1] for event in events}, {session})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import suite
+
+
+def document(**values):
+    return {"results": [suite.result(name, value, "s", suite.HIGHER if name.endswith("rate") else suite.LOWER)
+                        for name, value in values.items()]}
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_compare_flags_regressions(self):
+        baseline = document(load=1.0, save=1.0, rate=1000.0, gone=1.0)
+        current = document(load=1.1, save=1.5, rate=500.0, new=1.0)
+        rows = {name: (change, regressed) for name, _, _, change, regressed in
+                suite.compare(current, baseline, threshold=0.2)}
+        # Measurements missing from either run are skipped
+        self.assertEqual(set(rows), {"load", "save", "rate"})
+        self.assertAlmostEqual(rows["load"][0], 0.1)
+        self.assertFalse(rows["load"][1])
+        self.assertTrue(rows["save"][1])
+        # Half the throughput is twice as slow
+        self.assertAlmostEqual(rows["rate"][0], 1.0)
+        self.assertTrue(rows["rate"][1])
+
+    def test_run_produces_json(self):
+        lines = []
+        results = suite.run(["state"], quick=True, log=lines.append)
+        decoded = json.loads(json.dumps(results))
+        self.assertEqual(decoded["version"], suite.FORMAT_VERSION)
+        self.assertEqual([m["name"] for m in decoded["results"]], ["state.is_active", "state.get_remaining_time"])
+        self.assertTrue(all(m["value"] > 0 and m["better"] == suite.HIGHER for m in decoded["results"]))
+        self.assertEqual(len(lines), 2)
+        # A run compared with itself has no regressions
+        self.assertFalse(any(row[4] for row in suite.compare(results, results)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import shutil
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from blocking_service import BlockingService
+from blocklist_snapshot import LayeredMatcher, apply_changes
+from compiled_blocklist import CompiledMatcher, compile_blocklist, ensure_compiled
+from models import SITE_CHANGE_LOG, DataManager
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+
+class TestBlocklistSnapshots(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        # Cleanups run last first: services registered by the tests stop before these
+        self.addCleanup(shutil.rmtree, TEST_DATA_DIR, ignore_errors=True)
+        self.dm = DataManager(TEST_DATA_FILE)
+        self.addCleanup(self.dm.close)
+        self.dm.add_sites(["facebook.com", "youtube.com"])
+
+    def start(self, strict, **kwargs):
+        service = BlockingService(self.dm, **kwargs)
+        service.start_blocking(30, self.dm.get_blocked_sites(), strict=strict)
+        self.addCleanup(service.stop_blocking, force=True)
+        return service
+
+    def test_site_changes_since(self):
+        generation = self.dm.sites_generation
+        self.dm.add_site("reddit.com")
+        self.dm.remove_site("youtube.com")
+        self.dm.remove_site("missing.com")
+        self.assertEqual(self.dm.site_changes_since(generation), [(("reddit.com",), ()), ((), ("youtube.com",))])
+        self.assertEqual(self.dm.site_changes_since(self.dm.sites_generation), [])
+        # Only what was new is logged as added
+        latest = self.dm.sites_generation
+        self.dm.add_sites(["https://www.reddit.com/r/all", "vimeo.com", "Vimeo.com", "facebook.com"])
+        self.assertEqual(self.dm.site_changes_since(latest), [(("vimeo.com",), ())])
+        self.dm.add_sites([f"site{i}.com" for i in range(SITE_CHANGE_LOG + 1)])
+        self.assertIsNone(self.dm.site_changes_since(generation))
+
+    def test_edits_publish_new_snapshots(self):
+        service = self.start(strict=False)
+        before = service.snapshot()
+        self.dm.add_site("reddit.com")
+        self.dm.remove_site("youtube.com")
+        self.assertTrue(service.is_blocked("www.reddit.com"))
+        self.assertFalse(service.is_blocked("youtube.com"))
+        after = service.snapshot()
+        self.assertGreater(after.version, before.version)
+        # A reader holding the old version keeps a consistent answer
+        self.assertTrue(before.is_blocked("youtube.com"))
+        self.assertFalse(before.is_blocked("reddit.com"))
+        with self.assertRaises(AttributeError):
+            after.matcher = None
+        # Changes to the list the session was started from don't leak in
+        self.dm.get_blocked_sites().append("leak.com")
+        self.assertFalse(service.is_blocked("leak.com"))
+
+    def test_strict_session_keeps_removed_sites(self):
+        service = self.start(strict=True)
+        self.dm.remove_site("youtube.com")
+        self.dm.add_site("reddit.com")
+        self.assertTrue(service.is_blocked("youtube.com"))
+        self.assertTrue(service.is_blocked("reddit.com"))
+
+    def test_compiled_blocklist(self):
+        until = datetime.now() + timedelta(minutes=30)
+        self.dm.update_blocking_state(active=True, until=until.isoformat(), strict=False)
+        service = BlockingService(self.dm, compiled_file=os.path.join(TEST_DATA_DIR, "blocklist.bin"))
+        self.addCleanup(service.stop_blocking, force=True)
+        self.dm.add_site("reddit.com")
+        self.assertTrue(service.is_blocked("reddit.com"))
+        self.assertIsInstance(service.snapshot().matcher, LayeredMatcher)
+        # Dropping a rule masks it, without a rebuild on this thread
+        compiled = service.snapshot().matcher.base
+        with patch("blocking_service.load_matcher") as load:
+            self.dm.remove_site("facebook.com")
+            self.assertFalse(service.is_blocked("facebook.com"))
+            self.assertTrue(service.is_blocked("reddit.com"))
+            self.assertTrue(service.is_blocked("youtube.com"))
+        load.assert_not_called()
+        self.assertIs(service.snapshot().matcher.base, compiled)
+        self.assertEqual(len(service.snapshot()), 2)
+        # The file is brought up to date in the background for the next session
+        service._compile_thread.join()
+        self.assertFalse(ensure_compiled(self.dm, os.path.join(TEST_DATA_DIR, "blocklist.bin")))
+        self.dm.add_site("facebook.com")
+        self.assertTrue(service.is_blocked("m.facebook.com"))
+        self.assertEqual(service.snapshot().matcher.removed, frozenset())
+
+    def test_masked_rule_falls_through(self):
+        compiled_file = os.path.join(TEST_DATA_DIR, "masked.bin")
+        compile_blocklist(["example.com", "m.example.com", "=exact.example.com"], compiled_file)
+        base = CompiledMatcher(compiled_file)
+        self.addCleanup(base.close)
+        # The shortest suffix matches first; once it is masked, the longer one still applies
+        matcher = apply_changes(base, ["other.com"], ["example.com", "missing.com"])
+        self.assertEqual(matcher.match("a.m.example.com"), "m.example.com")
+        self.assertIsNone(matcher.match("example.com"))
+        self.assertEqual(matcher.match("exact.example.com"), "=exact.example.com")
+        self.assertEqual(base.match("a.m.example.com"), "example.com")
+        matcher = apply_changes(matcher, (), ["m.example.com"])
+        self.assertIsNone(matcher.match("a.m.example.com"))
+        self.assertEqual(sorted(matcher.rules()), ["=exact.example.com", "other.com"])
+        self.assertEqual(len(matcher), 2)
+        self.assertIs(apply_changes(matcher, (), ["example.com"]), matcher)
+
+    def test_readers_during_edits(self):
+        service = self.start(strict=False)
+        errors = []
+
+        def reader():
+            for _ in range(2000):
+                snapshot = service.snapshot()
+                if not snapshot.is_blocked("facebook.com") or len(snapshot) < 2:
+                    errors.append(snapshot.version)
+                time.sleep(0)
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(100):
+            self.dm.add_site(f"site{i}.com")
+            if i % 2:
+                self.dm.remove_site(f"site{i - 1}.com")
+            service.is_active()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(service.snapshot()), 52)
+
+if __name__ == '__main__':
+    unittest.main()
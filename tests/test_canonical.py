@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import unittest
+from canonical import (BUILTIN_SUFFIXES, CANONICAL_VERSION, PublicSuffixIndex, canonical_host, canonicalize_site,
+                       canonicalize_sites)
+from domain_matcher import DomainMatcher
+from models import DEFAULT_DATA, DataManager
+from sqlite_backend import SqliteBackend
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+
+class TestCanonicalizeSite(unittest.TestCase):
+    def test_urls_and_hosts(self):
+        cases = {
+            "https://www.YouTube.com/watch?v=1": "youtube.com",
+            "youtube.com.": "youtube.com",
+            "  Example.ORG  ": "example.org",
+            "http://user:pw@m.example.com:8080/path#top": "m.example.com",
+            "example.com:443": "example.com",
+            "Bücher.de": "xn--bcher-kva.de",
+            "www.example.co.uk": "example.co.uk",
+            # Stripping "www." would leave a public suffix
+            "www.co.uk": "www.co.uk",
+            "=WWW.Example.com": "=www.example.com",
+            "*.Example.com/": "*.example.com",
+        }
+        for entry, expected in cases.items():
+            self.assertEqual(canonicalize_site(entry), expected, entry)
+
+    def test_rejects(self):
+        for entry in ["", "   ", "https://", "co.uk", "com", "*.co.uk", "=org", "a..com", "exa mple.com", "*"]:
+            with self.assertRaises(ValueError, msg=entry):
+                canonicalize_site(entry)
+
+    def test_canonicalize_sites(self):
+        rules, dropped = canonicalize_sites(["a.com", "https://A.com/x", "co.uk", "b.com", "www.b.com"])
+        self.assertEqual((rules, dropped), (["a.com", "b.com"], 3))
+
+    def test_canonical_host(self):
+        self.assertEqual(canonical_host("WWW.Example.COM."), "www.example.com")
+        self.assertEqual(canonical_host("bücher.de"), "xn--bcher-kva.de")
+        # Memoized
+        before = canonical_host.cache_info().hits
+        canonical_host("WWW.Example.COM.")
+        self.assertEqual(canonical_host.cache_info().hits, before + 1)
+
+    def test_matching_is_canonical(self):
+        matcher = DomainMatcher([canonicalize_site("https://Bücher.de/shop")])
+        self.assertTrue(matcher.is_blocked("www.BÜCHER.de."))
+        self.assertTrue(matcher.is_blocked("xn--bcher-kva.de"))
+        self.assertFalse(matcher.is_blocked("buecher.de"))
+
+
+class TestPublicSuffixIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = PublicSuffixIndex(BUILTIN_SUFFIXES.splitlines())
+
+    def test_public_suffix(self):
+        self.assertEqual(self.index.public_suffix("www.example.co.uk"), "co.uk")
+        self.assertEqual(self.index.public_suffix("example.com"), "com")
+        # Unlisted TLDs are suffixes by default
+        self.assertEqual(self.index.public_suffix("a.b.unknowntld"), "unknowntld")
+        # Wildcard and exception rules
+        self.assertEqual(self.index.public_suffix("a.b.ck"), "b.ck")
+        self.assertEqual(self.index.public_suffix("www.ck"), "ck")
+        self.assertEqual(self.index.public_suffix("me.github.io"), "github.io")
+
+    def test_registrable_domain(self):
+        self.assertEqual(self.index.registrable_domain("a.b.example.co.uk"), "example.co.uk")
+        self.assertEqual(self.index.registrable_domain("example.com"), "example.com")
+        self.assertEqual(self.index.registrable_domain("x.a.b.ck"), "a.b.ck")
+        self.assertIsNone(self.index.registrable_domain("co.uk"))
+
+    def test_psl_syntax(self):
+        index = PublicSuffixIndex(["// comment", "", "com", "*.kawasaki.jp", "!city.kawasaki.jp", "公司.cn"])
+        self.assertEqual(index.public_suffix("a.b.kawasaki.jp"), "b.kawasaki.jp")
+        self.assertEqual(index.public_suffix("www.city.kawasaki.jp"), "kawasaki.jp")
+        self.assertTrue(index.is_public_suffix(canonical_host("公司.cn")))
+
+
+class TestMigration(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def write_legacy_file(self, sites):
+        data = json.loads(json.dumps(DEFAULT_DATA))
+        del data["settings"]["site_format"]
+        data["blocked_sites"] = sites
+        with open(TEST_DATA_FILE, "w") as f:
+            json.dump(data, f)
+
+    def test_json_migration(self):
+        self.write_legacy_file(["https://www.YouTube.com/watch", "youtube.com", "Reddit.com.", "co.uk", "kept.org"])
+        dm = DataManager(TEST_DATA_FILE)
+        self.assertEqual(dm.get_blocked_sites(), ["youtube.com", "reddit.com", "kept.org"])
+        self.assertEqual(dm.backend.get_settings()["site_format"], CANONICAL_VERSION)
+        dm.close()
+        # Persisted, and not redone on the next start
+        dm = DataManager(TEST_DATA_FILE)
+        self.assertEqual(dm.migrate_sites(), 0)
+        self.assertEqual(dm.get_blocked_sites(), ["youtube.com", "reddit.com", "kept.org"])
+        dm.close()
+
+    def test_sqlite_migration(self):
+        self.write_legacy_file(["WWW.A.com", "b.com/path"])
+        dm = DataManager(backend=SqliteBackend(os.path.join(TEST_DATA_DIR, "sites.db"), json_file=TEST_DATA_FILE))
+        try:
+            self.assertEqual(dm.get_blocked_sites(), ["a.com", "b.com"])
+        finally:
+            dm.close()
+
+    def test_inputs_are_canonicalized(self):
+        dm = DataManager(TEST_DATA_FILE)
+        try:
+            dm.add_site("https://www.Example.com/")
+            self.assertEqual(dm.get_blocked_sites(), ["example.com"])
+            self.assertTrue(dm.has_site("EXAMPLE.com."))
+            self.assertFalse(dm.has_site("co.uk"))
+            with self.assertRaises(ValueError):
+                dm.add_site("co.uk")
+            self.assertEqual(dm.add_sites(["a.com", "http://A.com", "com", "b.com"]), 2)
+            dm.remove_site("http://www.example.com/path")
+            self.assertEqual(dm.get_blocked_sites(), ["a.com", "b.com"])
+        finally:
+            dm.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import random
+import shutil
+import threading
+import unittest
+from unittest.mock import patch
+from compiled_blocklist import (CompiledBlocklistError, CompiledMatcher, HEADER_SIZE, compile_blocklist,
+                                ensure_compiled, load_matcher)
+from domain_matcher import DomainMatcher
+from models import DataManager
+
+TEST_DATA_DIR = "tests/data"
+TEST_COMPILED_FILE = os.path.join(TEST_DATA_DIR, "blocklist.bin")
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+RULES = ["facebook.com", "*.youtube.com", "=instagram.com", "Reddit.COM."]
+
+
+class TestCompiledMatcher(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        compile_blocklist(RULES, TEST_COMPILED_FILE, "test")
+        self.matcher = CompiledMatcher(TEST_COMPILED_FILE, verify=True)
+
+    def tearDown(self):
+        self.matcher.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_modes(self):
+        self.assertEqual(len(self.matcher), 4)
+        self.assertEqual(self.matcher.fingerprint, "test")
+        self.assertEqual(self.matcher.match("m.facebook.com"), "facebook.com")
+        self.assertTrue(self.matcher.is_blocked("FACEBOOK.com."))
+        self.assertFalse(self.matcher.is_blocked("notfacebook.com"))
+        self.assertEqual(self.matcher.match("www.youtube.com"), "*.youtube.com")
+        self.assertFalse(self.matcher.is_blocked("youtube.com"))
+        self.assertEqual(self.matcher.match("instagram.com"), "=instagram.com")
+        self.assertFalse(self.matcher.is_blocked("www.instagram.com"))
+        self.assertIn("old.reddit.com", self.matcher)
+        self.assertFalse(self.matcher.is_blocked(""))
+
+    def test_agrees_with_domain_matcher(self):
+        rng = random.Random(10)
+        rules = [f"{rng.choice(['', '*.', '='])}s{i}.example{i % 50}.com" for i in range(5000)]
+        compile_blocklist(rules, TEST_COMPILED_FILE)
+        compiled = CompiledMatcher(TEST_COMPILED_FILE)
+        reference = DomainMatcher(rules)
+        for i in range(6000):
+            for host in (f"s{i}.example{i % 50}.com", f"a.s{i}.example{i % 50}.com", f"example{i % 50}.com"):
+                self.assertEqual(compiled.is_blocked(host), reference.is_blocked(host), host)
+        compiled.close()
+
+    def test_parallel_compile_writes_same_file(self):
+        rng = random.Random(11)
+        rules = [f"{rng.choice(['', '*.', '='])}s{rng.randrange(3000)}.example.com" for i in range(5000)] + ["", "="]
+        self.assertEqual(compile_blocklist(rules, TEST_COMPILED_FILE, workers=1), len(set(rules)) - 2)
+        with open(TEST_COMPILED_FILE, "rb") as f:
+            single = f.read()
+        parallel = os.path.join(TEST_DATA_DIR, "parallel.bin")
+        with patch("compiled_blocklist.PARALLEL_MIN_RULES", 100):
+            compile_blocklist(iter(rules), parallel, workers=3)
+        with open(parallel, "rb") as f:
+            self.assertEqual(f.read(), single)
+
+        # With another thread running, workers aren't forked from this process
+        busy = threading.Event()
+        thread = threading.Thread(target=busy.wait)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(busy.set)
+        with patch("compiled_blocklist.PARALLEL_MIN_RULES", 100), self.assertNoLogs(level="WARNING"):
+            compile_blocklist(rules, parallel, workers=2)
+        with open(parallel, "rb") as f:
+            self.assertEqual(f.read(), single)
+
+        # Nor does a pool that can't start stop the compile
+        with patch("compiled_blocklist.PARALLEL_MIN_RULES", 100), \
+                patch("compiled_blocklist.ProcessPoolExecutor", side_effect=ImportError("no sem_open")), \
+                self.assertLogs(level="WARNING"):
+            compile_blocklist(rules, parallel, workers=2)
+        with open(parallel, "rb") as f:
+            self.assertEqual(f.read(), single)
+
+    def test_rejects_damaged_files(self):
+        with open(TEST_COMPILED_FILE, "r+b") as f:
+            f.seek(HEADER_SIZE + 2)
+            f.write(b"\xff")
+        with self.assertRaises(CompiledBlocklistError):
+            CompiledMatcher(TEST_COMPILED_FILE, verify=True)
+        with open(TEST_COMPILED_FILE, "r+b") as f:
+            f.truncate(HEADER_SIZE + 8)
+        with self.assertRaises(CompiledBlocklistError):
+            CompiledMatcher(TEST_COMPILED_FILE)
+        with open(TEST_COMPILED_FILE, "wb") as f:
+            f.write(b"not a blocklist" * 10)
+        with self.assertRaises(CompiledBlocklistError):
+            CompiledMatcher(TEST_COMPILED_FILE)
+
+
+class TestRebuildOnChange(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.dm = DataManager(TEST_DATA_FILE)
+        self.dm.add_sites(["a.com", "b.com"])
+
+    def tearDown(self):
+        self.dm.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_rebuilds_when_sites_change(self):
+        self.assertTrue(ensure_compiled(self.dm, TEST_COMPILED_FILE))
+        self.assertFalse(ensure_compiled(self.dm, TEST_COMPILED_FILE))
+        self.dm.add_site("c.com")
+        matcher = load_matcher(self.dm, TEST_COMPILED_FILE)
+        self.assertTrue(matcher.is_blocked("www.c.com"))
+        matcher.close()
+        # The fingerprint depends on the set of sites, not on how it was reached
+        self.dm.remove_site("a.com")
+        self.dm.add_site("a.com")
+        self.assertFalse(ensure_compiled(self.dm, TEST_COMPILED_FILE))
+
+    def test_damaged_file_is_rebuilt(self):
+        load_matcher(self.dm, TEST_COMPILED_FILE).close()
+        # Same fingerprint, damaged body: only the checksum tells
+        with open(TEST_COMPILED_FILE, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"x")
+        with self.assertLogs(level="INFO"):
+            matcher = load_matcher(self.dm, TEST_COMPILED_FILE)
+        self.addCleanup(matcher.close)
+        self.assertTrue(matcher.is_blocked("b.com"))
+        matcher.verify()
+
+    def test_fingerprint_survives_reload(self):
+        fingerprint = self.dm.sites_fingerprint()
+        self.dm.close()
+        self.dm = DataManager(TEST_DATA_FILE)
+        self.assertEqual(self.dm.sites_fingerprint(), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
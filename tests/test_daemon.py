@@ -0,0 +1,157 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import unittest
+from blocking_service import BlockingService
+from daemon import BlockingDaemon
+from daemon_client import DaemonClient, DaemonError, RemoteBlockingService, RemoteDataManager
+from models import DataManager
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+TEST_SOCKET = os.path.join(TEST_DATA_DIR, "refocus.sock")
+
+
+class TestBlockingDaemon(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.dm = DataManager(TEST_DATA_FILE)
+        self.service = BlockingService(self.dm)
+        self.daemon = BlockingDaemon(self.service, self.dm, TEST_SOCKET)
+        self.daemon.start()
+        self.client = DaemonClient(TEST_SOCKET)
+
+    def tearDown(self):
+        self.client.close()
+        self.daemon.stop()
+        self.service.stop_blocking(force=True)
+        self.dm.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_check(self):
+        hosts = ["www.example.com", "example.org", "example.com"]
+        self.assertEqual(self.client.check(hosts), [False, False, False])
+        self.service.start_blocking(1, ["example.com"], strict=False)
+        self.assertEqual(self.client.check(hosts), [True, False, True])
+        self.assertEqual(self.client.check([]), [])
+        self.assertEqual(self.client.check_many([hosts, hosts[:1]]), [[True, False, True], [True]])
+        self.assertEqual(self.daemon.lookups, 10)
+
+    def test_thin_client(self):
+        data = RemoteDataManager(self.client)
+        service = RemoteBlockingService(self.client)
+        data.add_site("example.com")
+        self.assertEqual(self.dm.get_blocked_sites(), ["example.com"])
+        data.update_user(username="Remote")
+        self.assertEqual(data.get_user()["username"], "Remote")
+
+        self.assertFalse(service.is_active())
+        self.assertIsNone(service.get_deadline())
+        service.start_blocking(30, data.get_blocked_sites(), strict=True)
+        self.assertTrue(self.service.is_active())
+        self.assertTrue(service.is_blocked("m.example.com"))
+        self.assertAlmostEqual(service.get_remaining_time().total_seconds(), 1800, delta=5)
+        self.assertIsNotNone(service.get_block_until())
+        # Strict sessions can't be stopped from a client either
+        self.assertFalse(service.stop_blocking())
+        self.assertTrue(self.service.is_active())
+        # Nor by asking for a forced stop on the raw protocol
+        self.assertFalse(self.client.call("stop_blocking", True))
+        self.assertTrue(self.service.is_active())
+
+    def test_errors(self):
+        with self.assertRaises(DaemonError):
+            self.client.call("_end_session", "stop")
+        # The connection is still usable afterwards
+        self.assertEqual(self.client.call("count_sites"), 0)
+
+    def test_metrics(self):
+        self.service.start_blocking(1, ["example.com"], strict=False)
+        before = self.client.call("metrics")["refocus_blocks_total"].get("example.com", 0)
+        self.client.check(["example.com", "example.org"])
+        snapshot = self.client.call("metrics")
+        self.assertEqual(snapshot["refocus_blocks_total"]["example.com"], before + 1)
+        self.assertIn("refocus_check_seconds", snapshot)
+        self.client.check(["example.com"])
+        self.assertGreaterEqual(self.client.call("decision_cache")["hits"], 1)
+
+    def test_concurrent_clients(self):
+        self.service.start_blocking(1, ["blocked.com"], strict=False)
+        results = []
+
+        def worker():
+            client = DaemonClient(TEST_SOCKET)
+            for _ in range(50):
+                results.append(client.check(["a.blocked.com", "free.com"]))
+            client.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [[True, False]] * 200)
+
+    def test_slow_call_does_not_block_checks(self):
+        release = threading.Event()
+        self.dm.count_sites = lambda: release.wait(5) and 0
+        caller = DaemonClient(TEST_SOCKET)
+        self.addCleanup(caller.close)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(caller.call("count_sites")))
+        thread.start()
+        # Answered while the call is still running
+        self.assertEqual(self.client.check(["example.com"]), [False])
+        release.set()
+        thread.join()
+        self.assertEqual(result, [0])
+
+    def test_check_waiting_on_lock_does_not_block_calls(self):
+        self.service.start_blocking(1, ["example.com"], strict=False)
+        checker = DaemonClient(TEST_SOCKET)
+        self.addCleanup(checker.close)
+        result = []
+        with self.service._lock:
+            # An edit makes the next check take the lock to pick it up
+            self.dm.add_site("example.org")
+            thread = threading.Thread(target=lambda: result.append(checker.check(["example.org"])))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            # Answered while the check is still waiting
+            self.assertEqual(self.client.call("count_sites"), 1)
+        thread.join()
+        self.assertEqual(result, [[True]])
+
+    def test_socket_is_owner_only(self):
+        self.assertEqual(os.stat(TEST_SOCKET).st_mode & 0o077, 0)
+
+    def test_refuses_second_daemon(self):
+        other = BlockingDaemon(self.service, self.dm, TEST_SOCKET)
+        with self.assertRaises(OSError):
+            other.start()
+        self.assertEqual(self.client.call("count_sites"), 0)
+
+    def test_replaces_stale_socket(self):
+        self.client.close()
+        self.daemon.stop()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(TEST_SOCKET)
+        stale.close()
+        self.daemon.start()
+        self.client = DaemonClient(TEST_SOCKET)
+        self.assertEqual(self.client.call("count_sites"), 0)
+
+    def test_does_not_import_kivy(self):
+        code = "import sys, daemon; print('kivy' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(out.stdout.strip(), "False")
+
+
+if __name__ == '__main__':
+    unittest.main()
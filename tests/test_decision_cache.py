@@ -0,0 +1,126 @@
+import os
+import shutil
+import threading
+import unittest
+from blocking_service import BlockingService
+from decision_cache import DecisionCache
+from domain_matcher import DomainMatcher
+from models import DataManager
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+
+class CountingMatcher(DomainMatcher):
+    def __init__(self, rules=()):
+        super().__init__(rules)
+        self.calls = 0
+
+    def match(self, host):
+        self.calls += 1
+        return super().match(host)
+
+
+class TestDecisionCache(unittest.TestCase):
+    def test_hits_and_invalidation(self):
+        cache = DecisionCache(16)
+        matcher = CountingMatcher(["blocked.com"])
+        view = cache.view(matcher)
+        for _ in range(10):
+            self.assertEqual(view.match("www.blocked.com"), "blocked.com")
+            self.assertIsNone(view.match("free.org"))
+        self.assertEqual(matcher.calls, 2)
+        self.assertEqual(cache.stats()["hit_rate"], 18 / 20)
+
+        cache.invalidate()
+        view.match("www.blocked.com")
+        self.assertEqual(matcher.calls, 3)
+        # A new view (new matcher) retires the old view's verdicts and stores
+        view.match("free.org")
+        replacement = cache.view(DomainMatcher(["free.org"]))
+        self.assertEqual(replacement.match("free.org"), "free.org")
+        view.match("other.org")
+        self.assertNotIn("other.org", cache._entries)
+
+    def test_result_from_before_invalidation_not_stored(self):
+        cache = DecisionCache(16)
+        view = cache.view(DomainMatcher(["blocked.com"]))
+        generation = cache.generation
+        cache.invalidate()
+        cache.put(view, "blocked.com", "blocked.com", generation)
+        self.assertEqual(len(cache), 0)
+
+    def test_one_off_hosts_do_not_flush_hot_set(self):
+        cache = DecisionCache(100)
+        matcher = CountingMatcher(["blocked.com"])
+        view = cache.view(matcher)
+        hot = [f"cdn{i}.example.com" for i in range(100)]
+        for _ in range(5):
+            for host in hot:
+                view.match(host)
+        for i in range(900):
+            view.match(f"random{i}.example.net")
+        calls = matcher.calls
+        for host in hot:
+            view.match(host)
+        self.assertLessEqual(matcher.calls - calls, 10)
+        self.assertEqual(len(cache), 100)
+        self.assertGreater(cache.stats()["rejected"], 800)
+
+    def test_concurrent_readers(self):
+        cache = DecisionCache(64)
+        view = cache.view(DomainMatcher(["blocked.com"]))
+        errors = []
+
+        def reader():
+            for i in range(20000):
+                host = f"h{i % 200}.blocked.com" if i % 2 else f"h{i % 200}.free.org"
+                if (view.match(host) is None) != host.endswith("free.org"):
+                    errors.append(host)
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for _ in range(200):
+            cache.invalidate()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache), 64)
+
+
+class TestServiceCache(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.dm = DataManager(TEST_DATA_FILE)
+        self.service = BlockingService(self.dm)
+
+    def tearDown(self):
+        self.service.stop_blocking(force=True)
+        self.dm.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_generation_follows_sites_and_sessions(self):
+        self.service.start_blocking(30, ["blocked.com"], strict=False)
+        self.assertTrue(self.service.is_blocked("blocked.com"))
+        self.assertTrue(self.service.is_blocked("blocked.com"))
+        stats = self.service.decision_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+        generation = stats["generation"]
+        self.dm.add_site("example.com")
+        self.service.is_blocked("blocked.com")
+        self.assertEqual(self.service.decision_cache_stats()["generation"], generation + 1)
+        self.dm.add_site("example.com")  # Already there: nothing to invalidate
+        self.service.is_blocked("blocked.com")
+        self.assertEqual(self.service.decision_cache_stats()["generation"], generation + 1)
+
+        self.service.stop_blocking()
+        self.service.start_blocking(30, ["other.com"], strict=False)
+        self.assertFalse(self.service.is_blocked("blocked.com"))
+        self.assertEqual(self.service.check_hosts(["a.other.com", "blocked.com"]), [1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
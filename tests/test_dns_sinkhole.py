@@ -0,0 +1,128 @@
+import socket
+import struct
+import threading
+import time
+import unittest
+from domain_matcher import DomainMatcher
+from dns_sinkhole import (DnsSinkhole, BLOCK_ZERO, QTYPE_A, QTYPE_SOA, RCODE_NXDOMAIN,
+                          build_response, parse_query)
+
+
+def make_query(name, qid=1, qtype=QTYPE_A):
+    question = b"".join(bytes([len(l)]) + l.encode() for l in name.split("."))
+    return struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0) + question + b"\x00" + struct.pack("!HH", qtype, 1)
+
+
+class StubUpstream:
+    """Answers A 10.0.0.1 (TTL 300) for everything except names starting with 'missing'."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.count = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.count += 1
+            time.sleep(self.delay)
+            _, _, qname, _, _, end = parse_query(data)
+            if qname.startswith("missing"):
+                soa = b"\x00" * 20 + struct.pack("!I", 30)
+                authority = b"\xc0\x0c" + struct.pack("!HHIH", QTYPE_SOA, 1, 120, len(soa)) + soa
+                response = bytearray(build_response(data, end, RCODE_NXDOMAIN) + authority)
+                struct.pack_into("!H", response, 8, 1)
+            else:
+                response = build_response(data, end, answer=(QTYPE_A, bytes([10, 0, 0, 1])), ttl=300)
+            self.sock.sendto(bytes(response), addr)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestDnsSinkhole(unittest.TestCase):
+    def setUp(self):
+        self.upstream = StubUpstream()
+        self.sinkhole = DnsSinkhole(listen=("127.0.0.1", 0), upstream=self.upstream.address)
+        self.sinkhole.start(DomainMatcher(["blocked.com"]))
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(2)
+
+    def tearDown(self):
+        self.client.close()
+        self.sinkhole.stop()
+        self.upstream.close()
+
+    def ask(self, name, qid=1, qtype=QTYPE_A):
+        self.client.sendto(make_query(name, qid, qtype), self.sinkhole.address)
+        data, _ = self.client.recvfrom(512)
+        qid_back, flags, _, ancount = struct.unpack_from("!HHHH", data)
+        self.assertEqual(qid_back, qid)
+        return flags & 0x000F, ancount, data
+
+    def test_blocked_name_gets_nxdomain(self):
+        rcode, ancount, _ = self.ask("www.blocked.com")
+        self.assertEqual(rcode, RCODE_NXDOMAIN)
+        self.assertEqual(self.upstream.count, 0)
+
+    def test_zero_mode(self):
+        self.sinkhole.block_mode = BLOCK_ZERO
+        rcode, ancount, data = self.ask("blocked.com")
+        self.assertEqual((rcode, ancount), (0, 1))
+        self.assertEqual(data[-4:], bytes(4))
+
+    def test_forward_and_cache(self):
+        rcode, ancount, data = self.ask("allowed.com", qid=7)
+        self.assertEqual((rcode, ancount), (0, 1))
+        self.assertEqual(data[-4:], bytes([10, 0, 0, 1]))
+        rcode, ancount, cached = self.ask("ALLOWED.com", qid=8)
+        self.assertEqual(cached[-4:], bytes([10, 0, 0, 1]))
+        self.assertEqual(self.upstream.count, 1)
+        self.assertEqual(self.sinkhole.cache_hits, 1)
+        ttl = struct.unpack_from("!I", cached, len(cached) - 10)[0]
+        self.assertTrue(0 < ttl <= 300)
+
+    def test_cached_answer_echoes_question_case(self):
+        self.ask("allowed.com", qid=7)
+        query = make_query("aLLoWeD.CoM", qid=8)
+        _, _, cached = self.ask("aLLoWeD.CoM", qid=8)
+        self.assertEqual(self.sinkhole.cache_hits, 1)
+        self.assertEqual(cached[12:len(query)], query[12:])
+        self.assertEqual(cached[-4:], bytes([10, 0, 0, 1]))
+
+    def test_negative_cache(self):
+        self.assertEqual(self.ask("missing.com")[0], RCODE_NXDOMAIN)
+        self.assertEqual(self.ask("missing.com", qid=2)[0], RCODE_NXDOMAIN)
+        self.assertEqual(self.upstream.count, 1)
+        expires = self.sinkhole._cache[("missing.com", QTYPE_A, 1)][0]
+        self.assertLessEqual(expires - time.monotonic(), 30)
+
+    def test_inflight_dedup(self):
+        self.upstream.delay = 0.2
+        for qid in range(1, 6):
+            self.client.sendto(make_query("slow.com", qid), self.sinkhole.address)
+        answered = {struct.unpack_from("!H", self.client.recvfrom(512)[0])[0] for _ in range(5)}
+        self.assertEqual(answered, {1, 2, 3, 4, 5})
+        self.assertEqual(self.upstream.count, 1)
+
+    def test_inflight_waiters_get_their_own_question(self):
+        self.upstream.delay = 0.2
+        names = {1: "slow.com", 2: "SLOW.com", 3: "sLoW.cOm"}
+        for qid, name in names.items():
+            self.client.sendto(make_query(name, qid), self.sinkhole.address)
+        for _ in names:
+            data = self.client.recvfrom(512)[0]
+            query = make_query(names[struct.unpack_from("!H", data)[0]])
+            self.assertEqual(data[12:len(query)], query[12:])
+        self.assertEqual(self.upstream.count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import random
+import unittest
+from domain_matcher import DomainMatcher
+
+class TestDomainMatcher(unittest.TestCase):
+    def setUp(self):
+        self.matcher = DomainMatcher(["facebook.com", "*.youtube.com", "=instagram.com"])
+
+    def test_subdomain_rule(self):
+        self.assertEqual(self.matcher.match("facebook.com"), "facebook.com")
+        self.assertEqual(self.matcher.match("m.facebook.com"), "facebook.com")
+        self.assertTrue(self.matcher.is_blocked("a.b.FACEBOOK.com."))
+        self.assertFalse(self.matcher.is_blocked("notfacebook.com"))
+        self.assertFalse(self.matcher.is_blocked("com"))
+
+    def test_wildcard_rule(self):
+        self.assertTrue(self.matcher.is_blocked("www.youtube.com"))
+        self.assertFalse(self.matcher.is_blocked("youtube.com"))
+
+    def test_exact_rule(self):
+        self.assertTrue(self.matcher.is_blocked("instagram.com"))
+        self.assertFalse(self.matcher.is_blocked("www.instagram.com"))
+
+    def test_add_remove(self):
+        self.assertFalse(self.matcher.add("facebook.com"))
+        self.assertEqual(len(self.matcher), 3)
+        self.assertTrue(self.matcher.remove("facebook.com"))
+        self.assertFalse(self.matcher.is_blocked("m.facebook.com"))
+        self.assertFalse(self.matcher.remove("facebook.com"))
+        self.assertEqual(len(self.matcher), 2)
+        self.assertNotIn("com", self.matcher._root["com"])
+        self.assertNotIn("facebook", self.matcher._root["com"])
+
+    def test_malformed_rules_are_ignored(self):
+        for rule in ("foo..com", ".com", "*..com", "=a..b.com", "a.*.com", "a.=.com"):
+            self.assertFalse(self.matcher.add(rule), rule)
+        self.assertEqual(len(self.matcher), 3)
+        self.assertFalse(self.matcher.is_blocked("x.com"))
+        self.assertFalse(self.matcher.is_blocked("foo.com"))
+        self.assertFalse(self.matcher.remove("foo..com"))
+
+    def test_overlapping_rules(self):
+        self.matcher.add("a.facebook.com")
+        self.matcher.remove("facebook.com")
+        self.assertTrue(self.matcher.is_blocked("x.a.facebook.com"))
+        self.assertFalse(self.matcher.is_blocked("b.facebook.com"))
+
+    def test_with_changes_leaves_original(self):
+        edited = self.matcher.with_changes(added=["reddit.com"], removed=["facebook.com"])
+        self.assertTrue(edited.is_blocked("www.reddit.com"))
+        self.assertFalse(edited.is_blocked("facebook.com"))
+        self.assertTrue(self.matcher.is_blocked("facebook.com"))
+        self.assertFalse(self.matcher.is_blocked("reddit.com"))
+        # Untouched subtrees are shared, not copied
+        self.assertIs(edited._root["com"]["youtube"], self.matcher._root["com"]["youtube"])
+        self.assertIs(self.matcher.with_changes(added=["facebook.com"]), self.matcher)
+        # Later in-place edits on either side stay on that side
+        self.matcher.remove("*.youtube.com")
+        self.assertTrue(edited.is_blocked("www.youtube.com"))
+        edited.add("=instagram.net")
+        self.assertFalse(self.matcher.is_blocked("instagram.net"))
+
+    def test_with_changes_matches_rebuild(self):
+        rng = random.Random(22)
+        names = [f"{label}.example{i}.com" for i in range(5) for label in ("a", "b", "*.a", "=b")]
+        versions = [(DomainMatcher(), set())]
+        for _ in range(300):
+            matcher, live = rng.choice(versions)
+            added = set(rng.sample(names, 2))
+            removed = set(rng.sample(names, 2)) - added
+            versions.append((matcher.with_changes(added, removed), (live - removed) | added))
+        for matcher, live in versions:
+            self.assertEqual(sorted(matcher.rules()), sorted(live))
+            self.assertEqual(len(matcher), len(live))
+            fresh = DomainMatcher(live)
+            for host in ("a.example1.com", "x.a.example2.com", "b.example3.com", "y.b.example3.com"):
+                self.assertEqual(matcher.match(host), fresh.match(host))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import socket
+import socketserver
+import ssl
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from domain_matcher import DomainMatcher
+from filter_proxy import FilterProxy, parse_client_hello_sni, split_host_port
+from url_rules import UrlRuleEngine
+
+
+def client_hello(server_name):
+    """Returns the raw TLS records of a real ClientHello for server_name."""
+    context = ssl.create_default_context()
+    incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+    tls = context.wrap_bio(incoming, outgoing, server_hostname=server_name)
+    try:
+        tls.do_handshake()
+    except ssl.SSLWantReadError:
+        pass
+    return outgoing.read()
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        OriginHandler.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        body = f"hello {self.path}".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            while True:
+                data = self.request.recv(65536)
+                if not data:
+                    return
+                self.request.sendall(data)
+        except ConnectionResetError:
+            pass
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def recv_until(sock, marker):
+    data = b""
+    while marker not in data:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class TestHelpers(unittest.TestCase):
+    def test_parse_sni(self):
+        hello = client_hello("www.example.com")
+        self.assertEqual(parse_client_hello_sni(hello[5:]), "www.example.com")
+        self.assertIsNone(parse_client_hello_sni(b"\x01\x00"))
+
+    def test_split_host_port(self):
+        self.assertEqual(split_host_port("example.com", 80), ("example.com", 80))
+        self.assertEqual(split_host_port("example.com:8080", 80), ("example.com", 8080))
+        self.assertEqual(split_host_port("[::1]:443", 80), ("::1", 443))
+
+
+class TestFilterProxy(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.origin = serve(ThreadingHTTPServer(("127.0.0.1", 0), OriginHandler))
+        cls.echo = serve(socketserver.ThreadingTCPServer(("127.0.0.1", 0), EchoHandler))
+        cls.echo.daemon_threads = True
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.origin, cls.echo):
+            server.shutdown()
+            server.server_close()
+
+    def setUp(self):
+        self.proxy = FilterProxy(listen=("127.0.0.1", 0))
+        self.proxy.start(DomainMatcher(["blocked.com"]))
+        self.client = socket.create_connection(self.proxy.address, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.proxy.stop()
+
+    def test_blocked_http(self):
+        self.client.sendall(b"GET http://www.blocked.com/ HTTP/1.1\r\nHost: www.blocked.com\r\n\r\n")
+        self.assertTrue(recv_until(self.client, b"\n\n").startswith(b"HTTP/1.1 403"))
+
+    def test_blocked_path(self):
+        self.proxy.url_rules = UrlRuleEngine(["/shorts/"])
+        port = self.origin.server_address[1]
+        self.client.sendall(f"GET /%73horts/abc HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode())
+        self.assertTrue(recv_until(self.client, b"\n\n").startswith(b"HTTP/1.1 403"))
+        self.assertEqual(self.proxy.blocked, 1)
+
+    def test_http_forwarded_with_upstream_keep_alive(self):
+        port = self.origin.server_address[1]
+        before = OriginHandler.connections
+        for path in ("/a", "/b"):
+            self.client.sendall(f"GET http://127.0.0.1:{port}{path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode())
+            response = recv_until(self.client, f"hello {path}".encode())
+            self.assertTrue(response.startswith(b"HTTP/1.1 200"))
+        self.assertEqual(OriginHandler.connections - before, 1)
+        self.assertEqual(self.proxy._pool.reused, 1)
+
+    def test_blocked_connect(self):
+        self.client.sendall(b"CONNECT blocked.com:443 HTTP/1.1\r\nHost: blocked.com:443\r\n\r\n")
+        self.assertTrue(recv_until(self.client, b"\n\n").startswith(b"HTTP/1.1 403"))
+
+    def test_blocked_sni(self):
+        port = self.echo.server_address[1]
+        self.client.sendall(f"CONNECT 127.0.0.1:{port} HTTP/1.1\r\n\r\n".encode())
+        self.assertTrue(recv_until(self.client, b"\r\n\r\n").startswith(b"HTTP/1.1 200"))
+        self.client.sendall(client_hello("m.blocked.com"))
+        self.assertEqual(self.client.recv(100), b"")
+
+    def test_connect_tunnel(self):
+        port = self.echo.server_address[1]
+        self.client.sendall(f"CONNECT 127.0.0.1:{port} HTTP/1.1\r\n\r\n".encode())
+        recv_until(self.client, b"\r\n\r\n")
+        hello = client_hello("allowed.org")
+        self.client.sendall(hello)
+        self.assertEqual(recv_until(self.client, hello[-16:]), hello)
+        payload = b"x" * 200000
+        self.client.sendall(payload)
+        received = 0
+        while received < len(payload):
+            received += len(self.client.recv(65536))
+        self.assertEqual(received, len(payload))
+
+
+if __name__ == '__main__':
+    unittest.main()
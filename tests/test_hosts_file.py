@@ -0,0 +1,99 @@
+import os
+import shutil
+import unittest
+from blocking_service import BlockingService
+from domain_matcher import DomainMatcher
+from hosts_file import BEGIN_MARKER, END_MARKER, WRITES, HostsFileBackend
+from models import DataManager
+
+TEST_DATA_DIR = "tests/data"
+TEST_HOSTS_FILE = os.path.join(TEST_DATA_DIR, "hosts")
+ORIGINAL = b"127.0.0.1 localhost\n::1 localhost\n# custom\n10.0.0.2 nas.lan\n"
+
+
+class TestHostsFileBackend(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.addCleanup(shutil.rmtree, TEST_DATA_DIR, ignore_errors=True)
+        with open(TEST_HOSTS_FILE, "wb") as f:
+            f.write(ORIGINAL)
+        os.chmod(TEST_HOSTS_FILE, 0o644)
+        self.backend = HostsFileBackend(TEST_HOSTS_FILE, addresses=["0.0.0.0"])
+        self.addCleanup(self.backend.stop)
+
+    def read(self):
+        with open(TEST_HOSTS_FILE, "rb") as f:
+            return f.read()
+
+    def section(self):
+        lines = self.read().splitlines()
+        start, end = lines.index(BEGIN_MARKER), lines.index(END_MARKER)
+        return {line.split()[1].decode() for line in lines[start + 1:end]}
+
+    def test_start_and_stop(self):
+        self.backend.start(DomainMatcher(["facebook.com", "=instagram.com", "*.youtube.com"]))
+        self.assertTrue(self.backend.is_running())
+        self.assertTrue(self.read().startswith(ORIGINAL + BEGIN_MARKER))
+        self.assertEqual(self.section(), {"facebook.com", "www.facebook.com", "instagram.com", "www.youtube.com"})
+        self.assertEqual(os.stat(TEST_HOSTS_FILE).st_mode & 0o777, 0o644)
+        self.backend.stop()
+        self.assertEqual(self.read(), ORIGINAL)
+
+    def test_diff_matches_full_rewrite(self):
+        self.backend.start(DomainMatcher(["facebook.com", "reddit.com"]))
+        writes = WRITES.values.get("diff", 0)
+        self.backend.apply_changes(None, ["youtube.com"], [])
+        self.backend.apply_changes(None, ["=reddit.com"], ["reddit.com", "missing.com"])
+        self.assertEqual(WRITES.values["diff"], writes + 2)
+        expected = {"facebook.com", "www.facebook.com", "youtube.com", "www.youtube.com", "reddit.com"}
+        self.assertEqual(self.section(), expected)
+
+        # Nothing to change: the file isn't touched
+        before = os.stat(TEST_HOSTS_FILE)
+        self.backend.apply_changes(None, ["facebook.com"], ["other.com"])
+        self.backend.start(DomainMatcher(self.backend._rules))
+        self.assertEqual(os.stat(TEST_HOSTS_FILE).st_ino, before.st_ino)
+
+        fresh = HostsFileBackend(os.path.join(TEST_DATA_DIR, "fresh"), addresses=["0.0.0.0"])
+        fresh.start(DomainMatcher(["facebook.com", "youtube.com", "=reddit.com"]))
+        self.assertEqual(set(fresh.hosts()), expected)
+        fresh.stop()
+
+    def test_outside_edits_are_kept(self):
+        self.backend.start(DomainMatcher(["facebook.com"]))
+        with open(TEST_HOSTS_FILE, "ab") as f:
+            f.write(b"10.0.0.3 printer.lan\n")
+        self.backend.apply_changes(None, ["reddit.com"], [])
+        self.assertIn(b"10.0.0.3 printer.lan\n", self.read())
+        self.assertIn("www.reddit.com", self.section())
+
+        # The managed section was removed by hand: it is written again in full
+        with open(TEST_HOSTS_FILE, "wb") as f:
+            f.write(ORIGINAL)
+        self.backend.apply_changes(None, ["youtube.com"], [])
+        self.assertEqual(self.section(), {"facebook.com", "www.facebook.com", "reddit.com", "www.reddit.com",
+                                          "youtube.com", "www.youtube.com"})
+
+    def test_stale_section_replaced(self):
+        with open(TEST_HOSTS_FILE, "ab") as f:
+            f.write(b"\n" + BEGIN_MARKER + b"\n0.0.0.0 old.com\n" + END_MARKER + b"\n")
+        self.backend.start(DomainMatcher(["=new.com"]))
+        self.assertEqual(self.section(), {"new.com"})
+        self.backend.stop()
+        self.assertEqual(self.read(), ORIGINAL + b"\n")
+
+    def test_follows_session(self):
+        dm = DataManager(os.path.join(TEST_DATA_DIR, "test_user_data.json"))
+        self.addCleanup(dm.close)
+        service = BlockingService(dm, backends=[self.backend])
+        service.start_blocking(30, ["facebook.com"], strict=False)
+        self.addCleanup(service.stop_blocking, force=True)
+        dm.add_site("reddit.com")
+        service.is_active()
+        self.assertIn("reddit.com", self.section())
+        service.stop_blocking()
+        self.assertEqual(self.read(), ORIGINAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
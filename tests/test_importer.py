@@ -0,0 +1,92 @@
+import gzip
+import io
+import os
+import shutil
+import unittest
+from unittest.mock import patch
+from importer import import_sites, main, parse_line
+from models import DataManager
+from sqlite_backend import SqliteBackend
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+HOSTS = b"""# Title: test hosts
+127.0.0.1 localhost
+::1 localhost ip6-localhost
+0.0.0.0 ads.example.com
+0.0.0.0 Tracker.Example.net.  # trailing comment
+0.0.0.0 a.test b.test
+"""
+
+ADBLOCK = b"""[Adblock Plus 2.0]
+! comment
+||ads.example.com^
+||cdn.example.org^$third-party
+||example.org/path^
+@@||allowed.example.com^
+"""
+
+
+class TestParseLine(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(parse_line("0.0.0.0 a.com b.com"), ["a.com", "b.com"])
+        self.assertEqual(parse_line("example.com"), ["example.com"])
+        self.assertEqual(parse_line("||example.com^$important"), ["example.com"])
+        self.assertEqual(parse_line("||example.com/ads/*"), [])
+        self.assertEqual(parse_line("@@||example.com^"), [])
+        self.assertEqual(parse_line("# comment"), [])
+        self.assertEqual(parse_line("   "), [])
+
+
+class TestImporter(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.dm = DataManager(TEST_DATA_FILE)
+
+    def tearDown(self):
+        self.dm.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_import_mixed_sources(self):
+        self.dm.add_site("a.test")
+        stats = import_sites(self.dm, [io.BytesIO(HOSTS), io.BytesIO(ADBLOCK)])
+        self.assertEqual(self.dm.get_blocked_sites(),
+                         ["a.test", "ads.example.com", "tracker.example.net", "b.test", "cdn.example.org"])
+        self.assertEqual(stats.added, 4)
+        # ads.example.com twice, a.test already present
+        self.assertEqual(stats.duplicates, 2)
+        self.assertEqual(stats.invalid, 3)
+        self.assertEqual(stats.lines, 12)
+
+    def test_gzip_file(self):
+        path = os.path.join(TEST_DATA_DIR, "hosts.gz")
+        with gzip.open(path, "wb") as f:
+            f.write(HOSTS)
+        stats = import_sites(self.dm, [path])
+        self.assertEqual(stats.added, 4)
+
+    def test_single_save(self):
+        with patch.object(self.dm.backend, "save_data", wraps=self.dm.backend.save_data) as save:
+            import_sites(self.dm, [io.BytesIO(b"\n".join(b"site%d.com" % i for i in range(1000)))])
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(self.dm.count_sites(), 1000)
+
+    def test_cli_stdin(self):
+        # self.dm's JSON file holds a site, which a new database starts from
+        self.dm.add_site("existing.com")
+        db = os.path.join(TEST_DATA_DIR, "test.db")
+        stdin = io.TextIOWrapper(io.BytesIO(ADBLOCK))
+        with patch("sys.stdin", stdin), patch("builtins.print") as printed, \
+                patch("models.DATA_FILE", self.dm.data_file):
+            self.assertEqual(main(["--db", db, "-"]), 0)
+        self.assertIn("2 added", str(printed.call_args[0][0]))
+        dm = DataManager(backend=SqliteBackend(db))
+        self.addCleanup(dm.close)
+        self.assertEqual(dm.count_sites(), 3)
+        self.assertTrue(dm.has_site("existing.com"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+import urllib.error
+import urllib.request
+import metrics
+from blocking_service import BlockingService
+from metrics import MetricsServer, OVERFLOW_LABEL, Registry
+from models import DataManager
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        lookups = self.registry.counter("lookups_total", "Lookups")
+        lookups.inc()
+        lookups.inc(4)
+        self.assertEqual(self.registry.snapshot(), {"lookups_total": 5})
+        # Registering the same name again returns the existing instrument
+        self.assertIs(self.registry.counter("lookups_total", "Lookups"), lookups)
+        with self.assertRaises(ValueError):
+            self.registry.histogram("lookups_total", "Lookups")
+
+    def test_labeled_counter_caps_labels(self):
+        blocks = self.registry.labeled_counter("blocks_total", "Blocks", "rule", max_labels=2)
+        for rule in ["a.com", "b.com", "a.com", "c.com", "d.com"]:
+            blocks.inc(rule)
+        self.assertEqual(blocks.snapshot(), {"a.com": 2, "b.com": 1, OVERFLOW_LABEL: 2})
+
+    def test_histogram_buckets(self):
+        latency = self.registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            latency.observe(value)
+        with latency.time():
+            pass
+        snapshot = latency.snapshot()
+        # Bucket bounds are inclusive, as in Prometheus
+        self.assertEqual(snapshot["buckets"], {"0.1": 3, "1.0": 1, "+Inf": 1})
+        self.assertEqual(snapshot["count"], 5)
+        self.assertAlmostEqual(snapshot["sum"], 2.65, places=3)
+
+    def test_prometheus_text(self):
+        self.registry.labeled_counter("blocks_total", "Blocks", "rule").inc('we"ird.com')
+        latency = self.registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+        latency.observe(0.5)
+        latency.observe(5)
+        lines = self.registry.prometheus_text().splitlines()
+        self.assertIn("# TYPE blocks_total counter", lines)
+        self.assertIn('blocks_total{rule="we\\"ird.com"} 1', lines)
+        self.assertIn("# TYPE latency_seconds histogram", lines)
+        # Histogram buckets are cumulative
+        self.assertIn('latency_seconds_bucket{le="0.1"} 0', lines)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn("latency_seconds_count 2", lines)
+
+    def test_disable(self):
+        lookups = self.registry.counter("lookups_total", "Lookups")
+        latency = self.registry.histogram("latency_seconds", "Latency")
+        self.registry.disable()
+        lookups.inc()
+        latency.observe(1)
+        with latency.time():
+            pass
+        # Instruments created while disabled are silent too
+        late = self.registry.counter("late_total", "Late")
+        late.inc()
+        self.assertEqual(lookups.value, 0)
+        self.assertEqual(latency.snapshot()["count"], 0)
+        self.assertEqual(late.value, 0)
+
+        self.registry.enable()
+        lookups.inc()
+        late.inc()
+        self.assertEqual((lookups.value, late.value), (1, 1))
+
+    def test_disabled_by_environment(self):
+        env = dict(os.environ, REFOCUS_METRICS="0")
+        code = ("import metrics; c = metrics.counter('x_total', 'X'); c.inc(); "
+                "print(metrics.REGISTRY.enabled, c.value)")
+        result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), ["False", "0"])
+
+
+class TestMetricsServer(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.counter("lookups_total", "Lookups").inc(3)
+        self.server = MetricsServer(self.registry, listen=("127.0.0.1", 0))
+        self.server.start()
+        host, port = self.server.address
+        self.url = f"http://{host}:{port}"
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_endpoints(self):
+        with urllib.request.urlopen(self.url + "/metrics") as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            self.assertIn("lookups_total 3", response.read().decode().splitlines())
+        with urllib.request.urlopen(self.url + "/metrics.json") as response:
+            self.assertEqual(json.load(response), {"lookups_total": 3})
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(self.url + "/other")
+        self.assertEqual(cm.exception.code, 404)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        metrics.REGISTRY.reset()
+        self.dm = DataManager(TEST_DATA_FILE)
+        self.service = BlockingService(self.dm)
+
+    def tearDown(self):
+        self.service.stop_blocking(force=True)
+        self.dm.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_service_metrics(self):
+        self.service.start_blocking(1, ["example.com", "*.test.org"], strict=False)
+        self.assertTrue(self.service.is_blocked("m.example.com"))
+        self.assertFalse(self.service.is_blocked("example.net"))
+        self.assertEqual(self.service.check_hosts(["a.test.org", "test.org", "example.com"]), [1, 0, 1])
+        self.service.stop_blocking()
+
+        snapshot = metrics.REGISTRY.snapshot()
+        self.assertEqual(snapshot["refocus_lookups_total"], {"service": 5})
+        self.assertEqual(snapshot["refocus_blocks_total"], {"example.com": 2, "*.test.org": 1})
+        self.assertEqual(snapshot["refocus_check_seconds"]["count"], 1)
+        self.assertEqual(snapshot["refocus_session_transitions_total"], {"start": 1, "stop": 1})
+        # Starting and stopping a session saves its state
+        self.assertGreaterEqual(snapshot["refocus_save_seconds"]["count"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
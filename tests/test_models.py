@@ -2,7 +2,10 @@ import unittest
 import os
 import json
 import shutil
+import threading
+from unittest.mock import patch
 from models import DataManager, DEFAULT_DATA
+from storage import Journal, atomic_write
 
 TEST_DATA_DIR = "tests/data"
 TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
@@ -49,5 +52,112 @@ class TestDataManager(unittest.TestCase):
         self.assertEqual(user["email"], "new@example.com")
         self.assertEqual(user["phone"], "123456789")
 
+class TestWriteBehindDataManager(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_burst_is_coalesced(self):
+        dm = DataManager(data_file=TEST_DATA_FILE, write_behind=True, write_delay=0.2)
+        self.assertTrue(dm.flush(timeout=5))
+        with patch("models.atomic_write", wraps=atomic_write) as write:
+            for i in range(50):
+                dm.add_site(f"site{i}.com")
+            self.assertTrue(dm.flush(timeout=5))
+        self.assertEqual(write.call_count, 1)
+        with open(TEST_DATA_FILE, 'r') as f:
+            self.assertEqual(len(json.load(f)["blocked_sites"]), 50)
+        dm.close()
+
+    def test_close_flushes(self):
+        dm = DataManager(data_file=TEST_DATA_FILE, write_behind=True, write_delay=60)
+        dm.update_user(username="Later")
+        dm.close()
+        with open(TEST_DATA_FILE, 'r') as f:
+            self.assertEqual(json.load(f)["user"]["username"], "Later")
+
+class TestJournaledDataManager(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_replay(self):
+        dm = DataManager(data_file=TEST_DATA_FILE, journaled=True)
+        for i in range(5):
+            dm.add_site(f"site{i}.com")
+        dm.remove_site("site2.com")
+        dm.update_user(username="Journaled")
+        dm.update_blocking_state(True, until="2030-01-01T00:00:00")
+        dm.close()
+
+        reloaded = DataManager(data_file=TEST_DATA_FILE, journaled=True)
+        self.assertEqual(reloaded.get_blocked_sites(), ["site0.com", "site1.com", "site3.com", "site4.com"])
+        self.assertEqual(reloaded.get_user()["username"], "Journaled")
+        self.assertTrue(reloaded.get_blocking_state()["blocking_active"])
+        reloaded.close()
+
+    def test_migrates_json_file(self):
+        DataManager(data_file=TEST_DATA_FILE).add_site("legacy.com")
+        dm = DataManager(data_file=TEST_DATA_FILE, journaled=True)
+        self.assertEqual(dm.get_blocked_sites(), ["legacy.com"])
+        self.assertTrue(os.path.exists(dm.backend.journal.snapshot_file))
+        dm.close()
+
+    def test_compaction(self):
+        dm = DataManager(data_file=TEST_DATA_FILE, journaled=True, compact_threshold=500)
+        for i in range(100):
+            dm.add_site(f"site{i}.com")
+        dm.close()
+        self.assertEqual(dm.backend.journal._rotated_logs(), [])
+        if os.path.exists(dm.backend.journal.log_file):
+            self.assertLess(os.path.getsize(dm.backend.journal.log_file), 500)
+
+        reloaded = DataManager(data_file=TEST_DATA_FILE, journaled=True)
+        self.assertEqual(len(reloaded.get_blocked_sites()), 100)
+        reloaded.close()
+
+    def test_full_save_during_compaction(self):
+        dm = DataManager(data_file=TEST_DATA_FILE, journaled=True)
+        dm.add_site("old.com")
+        release = threading.Event()
+        compact = Journal._compact
+
+        def slow_compact(journal, data, seq):
+            release.wait(5)
+            compact(journal, data, seq)
+
+        with patch.object(Journal, "_compact", slow_compact):
+            self.assertTrue(dm.backend.journal.compact(dm.backend._copy_data()))
+            data = json.loads(json.dumps(dm.backend.data))
+            data["blocked_sites"] = ["new.com"]
+            threading.Timer(0.1, release.set).start()
+            # Written once the running compaction is done, not dropped
+            dm.save_data(data)
+        dm.close()
+
+        reloaded = DataManager(data_file=TEST_DATA_FILE, journaled=True)
+        self.assertEqual(reloaded.get_blocked_sites(), ["new.com"])
+        reloaded.close()
+
+    def test_torn_append(self):
+        dm = DataManager(data_file=TEST_DATA_FILE, journaled=True)
+        dm.add_site("kept.com")
+        dm.close()
+        with open(dm.backend.journal.log_file, "ab") as f:
+            f.write(b'{"op":"add_site","url":"tor')
+
+        reloaded = DataManager(data_file=TEST_DATA_FILE, journaled=True)
+        self.assertEqual(reloaded.get_blocked_sites(), ["kept.com"])
+        reloaded.add_site("next.com")
+        reloaded.close()
+        self.assertEqual(DataManager(data_file=TEST_DATA_FILE, journaled=True).get_blocked_sites(),
+                         ["kept.com", "next.com"])
+
 if __name__ == '__main__':
     unittest.main()
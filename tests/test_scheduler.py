@@ -0,0 +1,175 @@
+import random
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+from blocking_service import BlockingService
+from scheduler import DAY, IntervalSet, Schedule, ScheduleEngine, week_offset
+
+# A Monday, so weekday offsets are easy to read
+MONDAY = datetime(2030, 1, 7)
+
+
+def at(days, hours=0, minutes=0):
+    return (MONDAY + timedelta(days=days, hours=hours, minutes=minutes)).timestamp()
+
+
+def brute_force_required(schedules, t):
+    dt = datetime.fromtimestamp(t)
+    for schedule in schedules:
+        if schedule["type"] == "once":
+            if datetime.fromisoformat(schedule["start"]) <= dt < datetime.fromisoformat(schedule["end"]):
+                return True
+            continue
+        start_h, start_m = map(int, schedule["start"].split(":"))
+        end_h, end_m = map(int, schedule["end"].split(":"))
+        for back in (0, 1):
+            day = dt.date() - timedelta(days=back)
+            if day.weekday() not in schedule["days"]:
+                continue
+            begin = datetime.combine(day, datetime.min.time()) + timedelta(hours=start_h, minutes=start_m)
+            end = datetime.combine(day, datetime.min.time()) + timedelta(hours=end_h, minutes=end_m)
+            if end <= begin:
+                end += timedelta(days=1)
+            if begin <= dt < end:
+                return True
+    return False
+
+
+class TestIntervalSet(unittest.TestCase):
+    def test_merges_overlaps(self):
+        intervals = IntervalSet([(5, 10), (0, 3), (8, 12), (12, 14), (20, 20)])
+        self.assertEqual(intervals.starts, [0, 5])
+        self.assertEqual(intervals.ends, [3, 14])
+        self.assertEqual(intervals.covering_end(9), 14)
+        self.assertIsNone(intervals.covering_end(3))
+        self.assertEqual(intervals.next_start(3), 5)
+        self.assertIsNone(intervals.next_start(5))
+
+
+class TestSchedule(unittest.TestCase):
+    def test_week_offset(self):
+        self.assertEqual(week_offset(at(2, 3)), 2 * DAY + 3 * 3600)
+
+    def test_weekly_window(self):
+        schedule = Schedule([{"type": "weekly", "days": [0, 1, 2, 3, 4], "start": "09:00", "end": "17:30"}])
+        self.assertTrue(schedule.is_required(at(0, 9)))
+        self.assertFalse(schedule.is_required(at(0, 17, 30)))
+        self.assertFalse(schedule.is_required(at(5, 12)))
+        self.assertEqual(schedule.next_transition(at(0, 12)), (at(0, 17, 30), False))
+        self.assertEqual(schedule.next_transition(at(4, 18)), (at(7, 9), True))
+
+    def test_overnight_window(self):
+        schedule = Schedule([{"type": "weekly", "days": [6], "start": "22:00", "end": "07:00"}])
+        self.assertTrue(schedule.is_required(at(6, 23)))
+        # Sunday night wraps into Monday morning
+        self.assertTrue(schedule.is_required(at(7, 6)))
+        self.assertFalse(schedule.is_required(at(0, 8)))
+        self.assertEqual(schedule.next_transition(at(6, 23)), (at(7, 7), False))
+
+    def test_adjacent_windows_form_one_run(self):
+        schedule = Schedule([
+            {"type": "weekly", "days": [0], "start": "09:00", "end": "12:00"},
+            {"type": "once", "start": (MONDAY + timedelta(hours=12)).isoformat(),
+             "end": (MONDAY + timedelta(hours=15)).isoformat()},
+        ])
+        self.assertEqual(schedule.next_transition(at(0, 10)), (at(0, 15), False))
+        self.assertEqual(schedule.next_transition(at(0, 16)), (at(7, 9), True))
+
+    def test_no_schedules(self):
+        schedule = Schedule()
+        self.assertFalse(schedule.is_required())
+        self.assertIsNone(schedule.next_transition())
+
+    def test_invalid_schedule(self):
+        with self.assertRaises(ValueError):
+            Schedule([{"type": "weekly", "days": [0], "start": "25:00", "end": "07:00"}])
+        with self.assertRaises(ValueError):
+            Schedule([{"type": "monthly"}])
+
+    def test_thousands_of_schedules_match_brute_force(self):
+        rng = random.Random(8)
+        schedules = []
+        for _ in range(1000):
+            # Up to three hours long, some of them overnight
+            start = rng.randrange(24 * 60)
+            end = (start + rng.randrange(1, 180)) % (24 * 60)
+            schedules.append({"type": "weekly", "days": rng.sample(range(7), rng.randint(1, 3)),
+                              "start": f"{start // 60:02}:{start % 60:02}",
+                              "end": f"{end // 60:02}:{end % 60:02}"})
+        for _ in range(1000):
+            start = MONDAY + timedelta(minutes=rng.randrange(60 * 24 * 60))
+            schedules.append({"type": "once", "start": start.isoformat(),
+                              "end": (start + timedelta(minutes=rng.randrange(1, 120))).isoformat()})
+        sample = schedules[::25]
+        dense = Schedule(schedules)
+        sparse = Schedule(sample)
+        for _ in range(300):
+            t = at(0) + rng.randrange(60 * DAY)
+            self.assertEqual(dense.is_required(t), brute_force_required(schedules, t))
+            self.assertEqual(sparse.is_required(t), brute_force_required(sample, t))
+            transition = sparse.next_transition(t)
+            if transition is not None:
+                when, required = transition
+                self.assertEqual(sparse.is_required(when), required)
+                self.assertEqual(sparse.is_required(when - 1), not required)
+
+
+class TestScheduleEngine(unittest.TestCase):
+    def test_starts_session_for_current_run(self):
+        service = MagicMock()
+        service.get_deadline.return_value = None
+        dm = MagicMock()
+        dm.get_blocked_sites.return_value = ["example.com"]
+        now = datetime.now()
+        engine = ScheduleEngine(service, dm, schedules=[
+            {"type": "once", "start": (now - timedelta(minutes=5)).isoformat(),
+             "end": (now + timedelta(minutes=30)).isoformat()}])
+        engine.start()
+        engine.stop()
+        minutes, sites = service.start_blocking.call_args[0]
+        self.assertAlmostEqual(minutes, 30, delta=0.1)
+        self.assertEqual(sites, ["example.com"])
+
+    def test_fires_at_boundaries(self):
+        service = BlockingService()
+        events = []
+        service.on_state_change(lambda event, _: events.append((event, time.time())))
+        start = datetime.now() + timedelta(seconds=0.2)
+        end = start + timedelta(seconds=0.3)
+        engine = ScheduleEngine(service, schedules=[
+            {"type": "once", "start": start.isoformat(), "end": end.isoformat()}])
+        engine.start()
+        self.assertFalse(service.is_active())
+        time.sleep(0.35)
+        self.assertTrue(service.is_active())
+        time.sleep(0.35)
+        self.assertFalse(service.is_active())
+        engine.stop()
+        self.assertEqual([event for event, _ in events], ["start", "expire"])
+        self.assertAlmostEqual(events[0][1], start.timestamp(), delta=0.05)
+        self.assertAlmostEqual(events[1][1], end.timestamp(), delta=0.05)
+
+    def test_set_schedules_persists(self):
+        service = MagicMock()
+        dm = MagicMock()
+        dm.get_schedules.return_value = []
+        engine = ScheduleEngine(service, dm)
+        window = {"type": "weekly", "days": [0], "start": "09:00", "end": "10:00"}
+        engine.add_schedule(window)
+        dm.save_schedules.assert_called_with([window])
+
+    def test_add_once_drops_ended_windows(self):
+        now = datetime.now()
+        ended = {"type": "once", "start": (now - timedelta(hours=2)).isoformat(),
+                 "end": (now - timedelta(hours=1)).isoformat()}
+        weekly = {"type": "weekly", "days": [0], "start": "09:00", "end": "10:00"}
+        engine = ScheduleEngine(MagicMock(), schedules=[ended, weekly])
+        engine.add_once(now + timedelta(hours=1), now + timedelta(hours=2))
+        self.assertEqual(engine.schedule.schedules, [weekly, {
+            "type": "once", "start": (now + timedelta(hours=1)).isoformat(),
+            "end": (now + timedelta(hours=2)).isoformat()}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,28 @@
+import os
+import shutil
+import threading
 import unittest
 from datetime import datetime, timedelta
 from blocking_service import BlockingService
+from compiled_blocklist import CompiledMatcher
+from unittest.mock import MagicMock
 import time
 
+
+def lock_is_free(lock):
+    """:return: True if another thread can take lock"""
+    taken = []
+
+    def probe():
+        taken.append(lock.acquire(timeout=1))
+        if taken[0]:
+            lock.release()
+
+    thread = threading.Thread(target=probe)
+    thread.start()
+    thread.join()
+    return taken[0]
+
 class TestBlockingService(unittest.TestCase):
     def setUp(self):
         self.service = BlockingService()
@@ -11,22 +31,104 @@ class TestBlockingService(unittest.TestCase):
         sites = ["example.com"]
         self.service.start_blocking(duration_minutes=1, sites=sites)
         self.assertTrue(self.service.is_active())
-        self.assertEqual(self.service._blocked_sites, sites)
+        self.assertEqual(list(self.service.snapshot().matcher.rules()), sites)
 
     def test_stop_blocking(self):
         self.service.start_blocking(duration_minutes=1, sites=["example.com"])
         self.service.stop_blocking()
         self.assertFalse(self.service.is_active())
-        self.assertEqual(self.service._blocked_sites, [])
+        self.assertEqual(len(self.service.snapshot()), 0)
+
+    def test_is_blocked(self):
+        self.assertFalse(self.service.is_blocked("example.com"))
+        self.service.start_blocking(duration_minutes=1, sites=["example.com"])
+        self.assertTrue(self.service.is_blocked("www.example.com"))
+        self.assertFalse(self.service.is_blocked("example.org"))
+        self.service.stop_blocking()
+        self.assertFalse(self.service.is_blocked("example.com"))
+
+    def test_backends_follow_session(self):
+        backend = MagicMock()
+        service = BlockingService(backends=[backend])
+        service.start_blocking(duration_minutes=1, sites=["example.com"])
+        backend.start.assert_called_once_with(service.snapshot().view)
+        # The backends query the session's matcher through the verdict cache
+        self.assertIs(backend.start.call_args[0][0].matcher, service.snapshot().matcher)
+        service.stop_blocking()
+        backend.stop.assert_called_once()
 
     def test_expiration(self):
         # Start blocking for a very short duration (e.g., 0 minutes/seconds)
-        # Since we can't easily mock datetime without external libs or complex patching in this simple setup,
-        # we will manually set the _block_until to the past.
+        # Since we can't easily mock the clock without external libs or complex patching in this simple setup,
+        # we will manually set the monotonic _deadline to the past.
         self.service.start_blocking(duration_minutes=10, sites=["example.com"])
-        self.service._block_until = datetime.now() - timedelta(seconds=1)
+        self.service._deadline = time.monotonic() - 1
         
         self.assertFalse(self.service.is_active())
 
+    def test_state_change_events(self):
+        events = []
+        unsubscribe = self.service.on_state_change(lambda event, service: events.append(event))
+        self.service.start_blocking(duration_minutes=1, sites=["example.com"])
+        self.service.stop_blocking()
+        self.service.start_blocking(duration_minutes=0.001, sites=["example.com"])
+        time.sleep(0.3)
+        self.assertEqual(events, ["start", "stop", "start", "expire"])
+        self.assertFalse(self.service.is_active())
+        unsubscribe()
+        self.service.start_blocking(duration_minutes=1, sites=["example.com"])
+        self.assertEqual(len(events), 4)
+        self.service.stop_blocking()
+
+    def test_stop_after_expiry(self):
+        events = []
+        self.service.on_state_change(lambda event, service: events.append((event, lock_is_free(service._lock))))
+        self.service.start_blocking(duration_minutes=10, sites=["example.com"], strict=False)
+        self.service._deadline = time.monotonic() - 1
+        # is_active() inside stop_blocking finds the session expired: it ends once, and listeners
+        # only run once the lock is released
+        self.assertTrue(self.service.stop_blocking())
+        self.assertEqual(events, [("start", True), ("expire", True)])
+
+TEST_DATA_DIR = "tests/data"
+
+class TestBlockingServiceStateCache(unittest.TestCase):
+    def setUp(self):
+        self.data_manager = MagicMock()
+        self.data_manager.state_generation = 0
+        self.data_manager.get_blocking_state.return_value = {
+            "blocking_active": True,
+            "block_until": (datetime.now() + timedelta(minutes=30)).isoformat(),
+            "strict_mode": True,
+        }
+        self.data_manager.get_all_sites.return_value = ["example.com"]
+        self.service = BlockingService(self.data_manager)
+
+    def tearDown(self):
+        self.service._end_session("stop")
+
+    def test_state_read_once_per_generation(self):
+        for _ in range(100):
+            self.assertTrue(self.service.is_active())
+            self.service.get_remaining_time()
+        self.assertEqual(self.data_manager.get_blocking_state.call_count, 1)
+
+        self.data_manager.get_blocking_state.return_value = {"blocking_active": False, "block_until": None}
+        self.data_manager.state_generation += 1
+        self.assertFalse(self.service.is_active())
+
+    def test_strict_stop_denied(self):
+        self.assertFalse(self.service.stop_blocking())
+        self.assertTrue(self.service.is_active())
+
+    def test_resumes_with_compiled_blocklist(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.addCleanup(shutil.rmtree, TEST_DATA_DIR)
+        self.data_manager.sites_fingerprint.return_value = "v1"
+        service = BlockingService(self.data_manager, compiled_file=os.path.join(TEST_DATA_DIR, "blocklist.bin"))
+        self.assertIsInstance(service.snapshot().matcher, CompiledMatcher)
+        self.assertTrue(service.is_blocked("www.example.com"))
+        service._end_session("stop")
+
 if __name__ == '__main__':
     unittest.main()
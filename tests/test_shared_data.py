@@ -0,0 +1,204 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from blocking_service import BlockingService
+from models import DataManager
+from storage import FileWatcher, GenerationLock
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HAMMER_SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+from models import DataManager
+dm = DataManager({path!r}, shared=True)
+for i in range({count}):
+    dm.add_site(f"{tag}{{i}}.com")
+    if i % 3 == 0:
+        dm.remove_site(f"{tag}{{i}}.com")
+    if i % 10 == 0:
+        dm.add_sites([f"{tag}-batch{{i}}.com", f"{tag}-batch{{i}}.org"])
+print(dm.backend.reloads)
+dm.close()
+"""
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class TestSharedDataManager(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def expected_sites(self, tag, count):
+        sites = {f"{tag}{i}.com" for i in range(count) if i % 3}
+        for i in range(0, count, 10):
+            sites.update({f"{tag}-batch{i}.com", f"{tag}-batch{i}.org"})
+        return sites
+
+    def test_two_processes_lose_no_updates(self):
+        count = 150
+        DataManager(TEST_DATA_FILE, shared=True).close()
+        workers = [subprocess.Popen([sys.executable, "-c", HAMMER_SCRIPT.format(
+                       root=ROOT, path=os.path.abspath(TEST_DATA_FILE), count=count, tag=tag)],
+                       stdout=subprocess.PIPE, text=True)
+                   for tag in ("alpha", "beta")]
+        reloads = []
+        for worker in workers:
+            out, _ = worker.communicate(timeout=120)
+            self.assertEqual(worker.returncode, 0)
+            reloads.append(int(out.strip()))
+
+        dm = DataManager(TEST_DATA_FILE, shared=True)
+        try:
+            expected = self.expected_sites("alpha", count) | self.expected_sites("beta", count)
+            self.assertEqual(set(dm.get_blocked_sites()), expected)
+            self.assertEqual(dm.count_sites(), len(expected))
+        finally:
+            dm.close()
+        # A process only reloads after the other one wrote: at most once per foreign write
+        writes_per_worker = count + (count + 2) // 3 + (count + 9) // 10
+        self.assertTrue(all(r <= writes_per_worker for r in reloads), reloads)
+
+    def test_reader_picks_up_changes(self):
+        reader = DataManager(TEST_DATA_FILE, shared=True)
+        writer = DataManager(TEST_DATA_FILE, shared=True)
+        try:
+            changed = threading.Event()
+            reader.backend.add_change_listener(changed.set)
+            writer.add_site("example.com")
+            # No call on the reader: its watcher reloads in the background
+            self.assertTrue(changed.wait(5))
+            self.assertTrue(reader.has_site("example.com"))
+            self.assertEqual(reader.backend.reloads, 1)
+
+            # A burst of writes costs the reader at most one reload each
+            with writer.batch():
+                for i in range(100):
+                    writer.add_site(f"site{i}.com")
+            for i in range(20):
+                writer.remove_site(f"site{i}.com")
+            self.assertTrue(wait_until(lambda: reader.count_sites() == 81))
+            self.assertLessEqual(reader.backend.reloads, 1 + 1 + 20)
+            # Nothing changed, nothing to reload
+            self.assertFalse(reader.backend.refresh())
+        finally:
+            reader.close()
+            writer.close()
+
+    def test_session_started_elsewhere(self):
+        ui = DataManager(TEST_DATA_FILE, shared=True)
+        worker = DataManager(TEST_DATA_FILE, shared=True)
+        service = BlockingService(ui)
+        try:
+            self.assertFalse(service.is_active())
+            BlockingService(worker).start_blocking(30, ["example.com"], strict=False)
+            self.assertTrue(wait_until(service.is_active))
+        finally:
+            service.stop_blocking(force=True)
+            ui.close()
+            worker.close()
+
+    def test_shared_write_behind(self):
+        ui = DataManager(TEST_DATA_FILE, shared=True, write_behind=True, write_delay=0.05)
+        worker = DataManager(TEST_DATA_FILE, shared=True)
+        other_ui = DataManager(TEST_DATA_FILE, shared=True, write_behind=True, write_delay=0.05)
+        try:
+            for i in range(30):
+                ui.add_site(f"ui{i}.com")
+                worker.add_site(f"worker{i}.com")
+                other_ui.add_site(f"other{i}.com")
+                if i % 5 == 0:
+                    ui.remove_site(f"ui{i}.com")
+                    worker.update_user(username=f"worker{i}")
+            self.assertTrue(ui.flush(5))
+            self.assertTrue(other_ui.flush(5))
+            expected = ({f"ui{i}.com" for i in range(30) if i % 5} | {f"worker{i}.com" for i in range(30)} |
+                        {f"other{i}.com" for i in range(30)})
+            for dm in (ui, worker, other_ui):
+                self.assertTrue(wait_until(lambda: set(dm.get_blocked_sites()) == expected))
+            self.assertEqual(ui.get_user()["username"], "worker25")
+        finally:
+            ui.close()
+            worker.close()
+            other_ui.close()
+
+        dm = DataManager(TEST_DATA_FILE, shared=True)
+        self.addCleanup(dm.close)
+        self.assertEqual(dm.count_sites(), len(expected))
+
+    def test_shared_mode_cant_be_journaled(self):
+        with self.assertRaises(ValueError):
+            DataManager(TEST_DATA_FILE, shared=True, journaled=True)
+
+
+class TestGenerationLock(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.path = os.path.join(TEST_DATA_DIR, "test.lock")
+
+    def tearDown(self):
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_generation_and_exclusion(self):
+        first, second = GenerationLock(self.path), GenerationLock(self.path)
+        try:
+            self.assertEqual(first.generation(), 0)
+            acquired = threading.Event()
+
+            def contend():
+                with second.exclusive():
+                    acquired.set()
+
+            with first.exclusive():
+                with first.exclusive():  # Re-entrant
+                    self.assertEqual(first.bump(), 1)
+                thread = threading.Thread(target=contend)
+                thread.start()
+                self.assertFalse(acquired.wait(0.2))
+            self.assertTrue(acquired.wait(5))
+            thread.join()
+            self.assertEqual(second.generation(), 1)
+            with first.shared():
+                with self.assertRaises(RuntimeError):
+                    with first.exclusive():
+                        pass
+        finally:
+            first.close()
+            second.close()
+
+    def test_watcher_polling_fallback(self):
+        lock = GenerationLock(self.path)
+        changes = []
+        watcher = FileWatcher(self.path, lambda: changes.append(lock.generation()), poll_interval=0.02,
+                              use_inotify=False, probe=lock.generation)
+        watcher.start()
+        try:
+            self.assertEqual(watcher.mode, "poll")
+            with lock.exclusive():
+                lock.bump()
+            self.assertTrue(wait_until(lambda: changes == [1]))
+        finally:
+            watcher.stop()
+            lock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
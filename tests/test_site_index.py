@@ -0,0 +1,42 @@
+import random
+import unittest
+from site_index import SiteIndex
+
+
+class TestSiteIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SiteIndex(["youtube.com", "Facebook.com", "m.facebook.com", "facebook.net", "reddit.com"])
+
+    def test_sorted_and_deduped(self):
+        self.assertEqual(list(SiteIndex(["b.com", "a.com", "B.com"])), ["a.com", "B.com"])
+        self.assertEqual(len(self.index), 5)
+        self.assertIn("FACEBOOK.COM", self.index)
+
+    def test_prefix_matches_come_first(self):
+        self.assertEqual(self.index.search("face"), ["Facebook.com", "facebook.net", "m.facebook.com"])
+        self.assertEqual(self.index.search("book.c"), ["Facebook.com", "m.facebook.com"])
+        self.assertEqual(self.index.search(".com", limit=2), ["Facebook.com", "m.facebook.com"])
+        self.assertEqual(self.index.search("nothing"), [])
+        self.assertEqual(len(self.index.search("")), 5)
+
+    def test_incremental_updates(self):
+        self.index.search("o")  # builds the substring blob
+        self.assertEqual(self.index.add("a.facebook.com"), 0)
+        self.assertEqual(self.index.add("A.facebook.com"), -1)
+        self.assertIn("a.facebook.com", self.index.search("facebook"))
+        self.assertEqual(self.index.remove("YOUTUBE.com"), 5)
+        self.assertEqual(self.index.remove("youtube.com"), -1)
+        self.assertEqual(self.index.search("tube"), [])
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(12)
+        sites = [f"{rng.choice(['www', 'm', 'ads', 'cdn'])}{i}.{rng.choice(['foo', 'bar', 'baz'])}.com"
+                 for i in range(3000)]
+        index = SiteIndex(sites)
+        for query in ("ads1", "bar", "7.b", "m", "z.com", "www29"):
+            expected = sorted(site for site in sites if query in site)
+            self.assertEqual(sorted(index.search(query)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
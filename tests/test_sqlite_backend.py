@@ -0,0 +1,91 @@
+import unittest
+import os
+import shutil
+from models import DataManager
+from sqlite_backend import SqliteBackend
+
+TEST_DATA_DIR = "tests/data"
+TEST_DB_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.db")
+TEST_JSON_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+class TestSqliteBackend(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.dm = DataManager(backend=SqliteBackend(TEST_DB_FILE))
+
+    def tearDown(self):
+        self.dm.close()
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def test_add_remove(self):
+        self.dm.add_site("example.com")
+        self.dm.add_site("Example.com.")
+        self.assertEqual(self.dm.get_blocked_sites(), ["example.com"])
+        self.assertTrue(self.dm.has_site("EXAMPLE.com"))
+        self.dm.remove_site("example.com")
+        self.assertEqual(self.dm.count_sites(), 0)
+
+    def test_paging(self):
+        self.assertEqual(self.dm.add_sites([f"site{i:03}.com" for i in range(200)] + ["other.org"]), 201)
+        self.assertEqual(self.dm.get_blocked_sites(offset=10, limit=3), ["site010.com", "site011.com", "site012.com"])
+        self.assertEqual(self.dm.get_blocked_sites(prefix="site19", limit=2), ["site190.com", "site191.com"])
+        self.assertEqual(self.dm.get_blocked_sites(prefix="OTHER"), ["other.org"])
+
+    def test_sites_fingerprint(self):
+        fingerprint = self.dm.sites_fingerprint()
+        self.dm.add_site("a.com")
+        self.assertNotEqual(self.dm.sites_fingerprint(), fingerprint)
+        fingerprint = self.dm.sites_fingerprint()
+        self.dm.add_site("A.com")
+        self.assertEqual(self.dm.sites_fingerprint(), fingerprint)
+        self.dm.remove_site("a.com")
+        self.assertNotEqual(self.dm.sites_fingerprint(), fingerprint)
+
+    def test_persistence(self):
+        self.dm.update_user(username="Sql")
+        self.dm.update_blocking_state(True, until="2030-01-01T00:00:00")
+        with self.dm.batch():
+            self.dm.add_site("a.com")
+            self.dm.add_site("b.com")
+        self.dm.close()
+
+        self.dm = DataManager(backend=SqliteBackend(TEST_DB_FILE))
+        self.assertEqual(self.dm.get_user()["username"], "Sql")
+        self.assertTrue(self.dm.get_blocking_state()["blocking_active"])
+        self.assertEqual(self.dm.get_blocked_sites(), ["a.com", "b.com"])
+
+    def test_failed_batch_rolls_back(self):
+        self.dm.add_sites(["a.com", "b.com"])
+        self.dm.update_user(username="Before")
+        backend = self.dm.backend
+        def sites():
+            yield "c.com"
+            raise OSError("source went away")
+
+        with self.assertRaises(OSError):
+            # Fails after the DELETE has run
+            backend.replace_sites(sites())
+        with self.assertRaises(RuntimeError):
+            with self.dm.batch():
+                self.dm.update_user(username="After")
+                self.dm.add_site("d.com")
+                raise RuntimeError("interrupted")
+        self.assertEqual(self.dm.get_blocked_sites(), ["a.com", "b.com"])
+        self.assertEqual(self.dm.get_user()["username"], "Before")
+        self.dm.add_site("e.com")
+        self.assertEqual(self.dm.count_sites(), 3)
+
+    def test_migrates_json_file(self):
+        json_dm = DataManager(data_file=TEST_JSON_FILE)
+        json_dm.add_site("legacy.com")
+        json_dm.update_user(username="Legacy")
+
+        dm = DataManager(backend=SqliteBackend(os.path.join(TEST_DATA_DIR, "migrated.db"), json_file=TEST_JSON_FILE))
+        self.assertEqual(dm.get_blocked_sites(), ["legacy.com"])
+        self.assertEqual(dm.get_user()["username"], "Legacy")
+        self.assertEqual(dm.data["settings"], json_dm.data["settings"])
+        dm.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import gzip
+import os
+import shutil
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from blocking_service import BlockingService
+from compiled_blocklist import load_matcher
+from models import DataManager
+from sqlite_backend import SqliteBackend
+from subscriptions import FAILED, NOT_MODIFIED, UNCHANGED, UPDATED, SubscriptionManager
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+
+class ListServer:
+    """Serves blocklists from a dict of path -> body, honouring If-None-Match."""
+
+    def __init__(self):
+        self.lists = {}
+        self.requests = []
+        self.delay = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append((self.path, self.headers.get("If-None-Match")))
+                    server.active += 1
+                    server.peak = max(server.peak, server.active)
+                try:
+                    time.sleep(server.delay)
+                    body = server.lists.get(self.path)
+                    if body is None:
+                        self.send_error(404)
+                        return
+                    etag = f'"{hash(body) & 0xffffffff:x}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestSubscriptions(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+        self.addCleanup(shutil.rmtree, TEST_DATA_DIR, ignore_errors=True)
+        self.server = ListServer()
+        self.addCleanup(self.server.close)
+        self.dm = DataManager(TEST_DATA_FILE, journaled=True)
+        self.addCleanup(self.dm.close)
+        self.manager = SubscriptionManager(self.dm)
+
+    def test_conditional_refresh(self):
+        self.server.lists["/ads.txt"] = b"0.0.0.0 ads.example.com\n0.0.0.0 tracker.net\n"
+        self.dm.add_subscription("ads", self.server.url + "/ads.txt")
+        self.assertEqual(self.manager.refresh(), {"ads": UPDATED})
+        self.assertEqual(sorted(self.dm.get_subscribed_sites()), ["ads.example.com", "tracker.net"])
+        self.assertEqual(self.dm.get_blocked_sites(), [])
+
+        # Not due yet, then due but not modified: the server answers 304
+        self.assertEqual(self.manager.refresh(), {})
+        self.assertEqual(self.manager.refresh(["ads"]), {"ads": NOT_MODIFIED})
+        self.assertIsNotNone(self.server.requests[-1][1])
+
+        # The server lost its validators but the content is the same
+        self.assertEqual(self.manager.refresh(["ads"], force=True), {"ads": UPDATED})
+        self.dm.update_subscription("ads", etag=None)
+        generation = self.dm.sites_generation
+        self.assertEqual(self.manager.refresh(["ads"]), {"ads": UNCHANGED})
+        self.assertEqual(self.dm.sites_generation, generation)
+
+        # Survives a reload from the journal
+        self.dm.close()
+        reloaded = DataManager(TEST_DATA_FILE, journaled=True)
+        self.addCleanup(reloaded.close)
+        subscription, = reloaded.get_subscriptions()
+        self.assertEqual(subscription["count"], 2)
+        self.assertEqual(subscription["source"], self.server.url + "/ads.txt")
+
+    def test_delta_reaches_running_session(self):
+        self.server.lists["/list"] = b"a.com\nb.com\nc.com\n"
+        self.dm.add_site("b.com")
+        self.dm.add_subscription("list", self.server.url + "/list")
+        self.manager.refresh()
+        service = BlockingService(self.dm)
+        service.start_blocking(30, self.dm.get_blocked_sites(), strict=False)
+        self.addCleanup(service.stop_blocking, force=True)
+        self.assertTrue(service.is_blocked("www.a.com"))
+
+        self.server.lists["/list"] = gzip.compress(b"b.com\nc.com\nd.com\n")
+        generation = self.dm.sites_generation
+        self.assertEqual(self.manager.refresh(["list"]), {"list": UPDATED})
+        # Only the difference was logged; b.com stays blocked manually whatever the list says
+        self.assertEqual(self.dm.site_changes_since(generation), [(("d.com",), ("a.com",))])
+        service.is_active()
+        self.assertFalse(service.is_blocked("a.com"))
+        self.assertTrue(service.is_blocked("d.com"))
+
+        self.dm.remove_site("b.com")
+        self.assertEqual(self.dm.site_changes_since(generation + 1), [((), ())])
+        self.assertTrue(self.dm.remove_subscription("list"))
+        service.is_active()
+        self.assertFalse(service.is_blocked("c.com"))
+        self.assertFalse(service.is_blocked("b.com"))
+        self.assertEqual(self.dm.get_subscribed_sites(), [])
+
+    def test_concurrent_fetches_are_bounded(self):
+        self.server.delay = 0.2
+        for i in range(6):
+            self.server.lists[f"/list{i}"] = f"site{i}.com\n".encode()
+            self.dm.add_subscription(f"list{i}", f"{self.server.url}/list{i}")
+        self.dm.add_subscription("missing", self.server.url + "/missing")
+        manager = SubscriptionManager(self.dm, workers=3)
+        start = time.monotonic()
+        outcomes = manager.refresh()
+        self.assertLess(time.monotonic() - start, 7 * 0.2)
+        self.assertEqual(self.server.peak, 3)
+        self.assertEqual(outcomes.pop("missing"), FAILED)
+        self.assertEqual(set(outcomes.values()), {UPDATED})
+        self.assertEqual(len(self.dm.get_subscribed_sites()), 6)
+        failed, = [s for s in self.dm.get_subscriptions() if s["name"] == "missing"]
+        self.assertIn("404", failed["error"])
+
+    def test_truncated_body_is_a_failure(self):
+        # The gzip stream ends early: EOFError rather than an OSError
+        self.server.lists["/cut.gz"] = gzip.compress(b"a.com\nb.com\n" * 100)[:-20]
+        self.dm.add_subscription("cut", self.server.url + "/cut.gz")
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(self.manager.refresh(), {"cut": FAILED})
+        subscription, = self.dm.get_subscriptions()
+        self.assertIsNotNone(subscription["checked"])
+        self.assertIn("ended before", subscription["error"])
+        # Not due again until the retry interval has passed
+        self.assertEqual(self.manager.refresh(), {})
+
+    def test_local_file_and_sqlite(self):
+        path = os.path.join(TEST_DATA_DIR, "list.txt")
+        with open(path, "w") as f:
+            f.write("||ads.example.com^\nfacebook.com\n")
+        dm = DataManager(backend=SqliteBackend(os.path.join(TEST_DATA_DIR, "test.db")))
+        self.addCleanup(dm.close)
+        dm.add_site("reddit.com")
+        fingerprint = dm.sites_fingerprint()
+        dm.add_subscription("local", path)
+        manager = SubscriptionManager(dm)
+        self.assertEqual(manager.refresh(), {"local": UPDATED})
+        self.assertEqual(manager.refresh(["local"]), {"local": NOT_MODIFIED})
+        self.assertNotEqual(dm.sites_fingerprint(), fingerprint)
+        self.assertEqual(dm.get_all_sites(), ["reddit.com", "ads.example.com", "facebook.com"])
+
+        matcher = load_matcher(dm, os.path.join(TEST_DATA_DIR, "blocklist.bin"))
+        self.assertTrue(matcher.is_blocked("www.facebook.com"))
+        matcher.close()
+        self.assertTrue(dm.remove_subscription("local"))
+        self.assertEqual(dm.sites_fingerprint(), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
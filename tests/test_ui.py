@@ -2,6 +2,8 @@ import unittest
 from unittest.mock import MagicMock, patch
 import sys
 import os
+import subprocess
+import time
 
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -9,8 +11,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 # Mock Kivy Window to avoid window creation
 os.environ["KIVY_NO_WINDOW"] = "1"
 
-from main import MainLayout, AccountPopup, RefocusApp
-from kivy.uix.spinner import Spinner
+import main
+from main import MainLayout, AccountPopup, RefocusApp, format_remaining
+from startup_trace import StartupTrace
 from datetime import datetime, timedelta
 
 class TestMainLayoutLogic(unittest.TestCase):
@@ -39,22 +42,81 @@ class TestMainLayoutLogic(unittest.TestCase):
         self.assertEqual(self.layout.selected_duration, 60)
         self.assertIn("60 minutes", self.layout.selected_label.text)
 
+    def set_custom_timer(self, start, end, now):
+        """Enters a time range at the datetime `now`. :return: The (start, end) window scheduled"""
+        class FixedDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return now
+
+        self.app.schedule_engine = MagicMock()
+        self.layout.start_input.text = start
+        self.layout.end_input.text = end
+        with patch("main.datetime", FixedDatetime):
+            self.layout.set_custom_timer(None)
+        self.app.schedule_engine.add_once.assert_called_once()
+        return self.app.schedule_engine.add_once.call_args[0]
+
     def test_custom_timer_valid(self):
-        self.layout.start_input.text = "10:00"
-        self.layout.end_input.text = "11:00"
+        self.assertEqual(self.set_custom_timer("10:00", "11:00", datetime(2030, 1, 7, 8, 0)),
+                         (datetime(2030, 1, 7, 10, 0), datetime(2030, 1, 7, 11, 0)))
+        self.assertIn("Scheduled Mon 10:00", self.layout.selected_label.text)
+        # Already over today: tomorrow's
+        self.assertEqual(self.set_custom_timer("10:00", "11:00", datetime(2030, 1, 7, 20, 0)),
+                         (datetime(2030, 1, 8, 10, 0), datetime(2030, 1, 8, 11, 0)))
+
+    def test_custom_timer_overnight(self):
+        # Starts at the chosen time, not now
+        self.assertEqual(self.set_custom_timer("22:00", "07:30", datetime(2030, 1, 7, 20, 0)),
+                         (datetime(2030, 1, 7, 22, 0), datetime(2030, 1, 8, 7, 30)))
+        self.assertEqual(self.layout.selected_duration, 0)
+        # Entered inside the window: the engine starts blocking right away
+        self.assertEqual(self.set_custom_timer("22:00", "07:30", datetime(2030, 1, 7, 23, 0)),
+                         (datetime(2030, 1, 7, 22, 0), datetime(2030, 1, 8, 7, 30)))
+
+    def test_custom_timer_needs_scheduler(self):
+        self.layout.start_input.text = "22:00"
+        self.layout.end_input.text = "07:30"
         self.layout.set_custom_timer(None)
-        self.assertEqual(self.layout.selected_duration, 60)
+        self.assertIn("Error", self.layout.selected_label.text)
 
     def test_add_site(self):
         self.layout.new_site_input.text = "test.com"
         self.layout.add_site(None)
         self.app.data_manager.add_site.assert_called_with("test.com")
         self.assertEqual(self.layout.new_site_input.text, "")
+        self.assertEqual(self.layout.site_list.visible_sites, ["test.com"])
+        self.assertEqual(self.layout.site_list.selected, "test.com")
+
+    def test_add_site_canonicalizes(self):
+        self.layout.new_site_input.text = "https://www.YouTube.com/watch?v=1"
+        self.layout.add_site(None)
+        self.app.data_manager.add_site.assert_called_with("youtube.com")
+        self.assertEqual(self.layout.site_list.visible_sites, ["youtube.com"])
+
+        self.layout.new_site_input.text = "co.uk"
+        self.layout.add_site(None)
+        self.assertIn("public suffix", self.layout.selected_label.text)
+        self.assertEqual(self.layout.new_site_input.text, "co.uk")
+        self.assertEqual(self.layout.site_list.visible_sites, ["youtube.com"])
+
+    def test_site_search(self):
+        self.layout.site_list.set_sites(["facebook.com", "m.facebook.com", "youtube.com"])
+        self.layout.site_list.search_input.text = "face"
+        self.assertEqual(self.layout.site_list.visible_sites, ["facebook.com", "m.facebook.com"])
+        self.layout.site_list.add_site("facebook.net")
+        self.layout.site_list.add_site("reddit.com")
+        self.assertEqual(self.layout.site_list.visible_sites, ["facebook.com", "facebook.net", "m.facebook.com"])
+        self.layout.site_list.search_input.text = ""
+        self.assertEqual(len(self.layout.site_list.visible_sites), 5)
 
     def test_delete_site(self):
-        self.layout.site_spinner.text = "test.com"
+        self.layout.site_list.set_sites(["test.com", "other.com"])
+        self.layout.site_list.select("test.com")
         self.layout.delete_site(None)
         self.app.data_manager.remove_site.assert_called_with("test.com")
+        self.assertEqual(self.layout.site_list.visible_sites, ["other.com"])
+        self.assertEqual(self.layout.site_list.selected, "")
 
     def test_toggle_blocking_start(self):
         self.app.blocking_service.is_active.return_value = False
@@ -64,6 +126,7 @@ class TestMainLayoutLogic(unittest.TestCase):
         # Mock block_until for wording check
         mock_until = datetime.now() + timedelta(minutes=60)
         self.app.blocking_service.get_block_until.return_value = mock_until
+        self.app.blocking_service.get_deadline.return_value = time.monotonic() + 3600
         until_str = mock_until.strftime("%H:%M")
         
         self.layout.toggle_blocking(None)
@@ -90,6 +153,34 @@ class TestMainLayoutLogic(unittest.TestCase):
         self.app.blocking_service.stop_blocking.assert_called()
         self.assertIn("Status: Locked", self.layout.status_label.text)
 
+    def test_countdown(self):
+        service = self.app.blocking_service
+        service.get_deadline.return_value = time.monotonic() + 90.5
+        with patch.object(self.layout, '_countdown_tick') as tick:
+            self.layout.update_ui_state(True)
+            self.assertEqual(self.layout.countdown_label.text, "01:31 left")
+            # Armed for the moment the text changes, not a fixed interval
+            self.assertAlmostEqual(tick.timeout, 0.5, delta=0.05)
+            tick.assert_called_once()
+
+            self.layout.pause_countdown()
+            tick.reset_mock()
+            self.layout._update_countdown()
+            tick.assert_not_called()
+
+            # Expired while paused: resuming flips the UI back
+            service.is_active.return_value = False
+            self.layout.resume_countdown()
+        self.assertIn("Status: Inactive", self.layout.status_label.text)
+        self.assertEqual(self.layout.countdown_label.text, "")
+
+    def test_format_remaining(self):
+        self.assertEqual(format_remaining(4 * 3600), ("4h 00m left", 3600 * 4 - 60))
+        self.assertEqual(format_remaining(3600.5), ("1h 01m left", 3600))
+        self.assertEqual(format_remaining(3600), ("60:00 left", 3599))
+        self.assertEqual(format_remaining(0.2), ("00:01 left", 0))
+        self.assertEqual(format_remaining(-1), ("00:00 left", 0))
+
     def test_account_popup(self):
         # Combined test to reduce instantiation issues
         self.app.data_manager.get_user.return_value = {"username": "TestUser", "email": "test@example.com", "phone": "12345"}
@@ -105,5 +196,57 @@ class TestMainLayoutLogic(unittest.TestCase):
         popup.save_profile(MagicMock())
         self.app.data_manager.update_user.assert_called_with(username="NewUser", email="new@example.com", phone="98765")
 
+class TestFastStart(unittest.TestCase):
+    def setUp(self):
+        self.app_patcher = patch('kivy.app.App.get_running_app')
+        self.mock_get_app = self.app_patcher.start()
+        self.app = RefocusApp()
+        self.mock_get_app.return_value = self.app
+
+    def tearDown(self):
+        self.app_patcher.stop()
+
+    def fake_load_services(self):
+        self.app.data_manager = MagicMock()
+        self.app.data_manager.get_blocked_sites.return_value = ["site1.com"]
+        self.app.blocking_service = MagicMock()
+        self.app.blocking_service.is_active.return_value = False
+
+    def test_deferred_layout(self):
+        with patch('main.Clock') as clock, patch.object(RefocusApp, 'load_services', self.fake_load_services):
+            layout = self.app.build()
+            self.assertIsNotNone(layout.loading_label)
+            self.assertFalse(hasattr(layout, 'site_list'))
+            # Run the chain of deferred phases the way Clock would
+            while clock.schedule_once.call_args_list:
+                callback = clock.schedule_once.call_args_list.pop(0)[0][0]
+                callback(0)
+                if self.app.data_manager is not None and layout.loading_label is not None:
+                    # Backgrounded after the data loaded but before the body was built
+                    self.assertTrue(self.app.on_pause())
+                    self.app.on_resume()
+        self.assertIsNone(layout.loading_label)
+        self.assertEqual(layout.site_list.visible_sites, ["site1.com"])
+        self.assertEqual([phase for phase, _ in main.trace.phases[-4:]],
+                         ["layout shell", "first frame", "data load", "layout build"])
+
+    def test_imports_are_lazy(self):
+        code = "import sys, main; print(sorted({'models', 'filter_proxy', 'account_popup'} & set(sys.modules)))"
+        env = dict(os.environ, KIVY_NO_ARGS="1")
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(out.stdout.strip().splitlines()[-1], "[]")
+
+
+class TestStartupTrace(unittest.TestCase):
+    def test_report(self):
+        trace = StartupTrace(enabled=False)
+        trace.mark("imports")
+        trace.mark("data load")
+        report = trace.report()
+        self.assertIn("imports", report)
+        self.assertIn("total", report)
+        self.assertAlmostEqual(sum(seconds for _, seconds in trace.phases), trace.total())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,143 @@
+import os
+import random
+import shutil
+import unittest
+from blocking_service import BlockingService
+from models import DataManager
+from sqlite_backend import SqliteBackend
+from url_rules import AhoCorasick, UrlRuleEngine, parse_url_rule, url_text
+
+TEST_DATA_DIR = "tests/data"
+TEST_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_user_data.json")
+
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_search(self):
+        automaton = AhoCorasick({"he": 1, "she": 2, "his": 3, "hers": 4})
+        self.assertEqual(automaton.search("ushers"), 2)
+        self.assertEqual(automaton.search("ahis"), 3)
+        self.assertIsNone(automaton.search("hxex"))
+        self.assertIsNone(AhoCorasick().search("anything"))
+
+    def test_incremental_matches_rebuild(self):
+        rng = random.Random(20)
+        automaton = AhoCorasick()
+        live = set()
+        for _ in range(3000):
+            pattern = "".join(rng.choice("ab/") for _ in range(rng.randint(1, 5)))
+            if rng.random() < 0.6:
+                self.assertEqual(automaton.add(pattern, pattern), pattern not in live)
+                live.add(pattern)
+            else:
+                pattern = rng.choice(sorted(live)) if live else pattern
+                self.assertEqual(automaton.remove(pattern), pattern in live)
+                live.discard(pattern)
+            fresh = AhoCorasick({pattern: pattern for pattern in live})
+            for _ in range(3):
+                text = "".join(rng.choice("ab/") for _ in range(rng.randint(0, 10)))
+                found = automaton.search(text)
+                self.assertEqual(found, fresh.search(text), (sorted(live), text))
+                self.assertEqual(found is not None, any(pattern in text for pattern in live))
+        self.assertEqual(len(automaton), len(live))
+
+    def test_compacts_after_removals(self):
+        patterns = [f"pattern{i}" for i in range(3000)]
+        automaton = AhoCorasick({pattern: pattern for pattern in patterns})
+        for pattern in patterns[:2500]:
+            automaton.remove(pattern)
+        self.assertLess(len(automaton._tables[0]), 3 * automaton.node_count)
+        self.assertEqual(automaton.search("xpattern2999"), "pattern2999")
+        self.assertIsNone(automaton.search("pattern12"))
+
+
+class TestUrlRuleEngine(unittest.TestCase):
+    def test_rules(self):
+        self.assertEqual(parse_url_rule("  /Shorts/ "), "/shorts/")
+        self.assertEqual(parse_url_rule("re:/Reels?/"), "re:/Reels?/")
+        for rule in ("", "re:", "re:(unclosed", "re:(?i)global-flags"):
+            with self.assertRaises(ValueError):
+                parse_url_rule(rule)
+        self.assertEqual(url_text("WWW.YouTube.com.", "/Shorts/%41b?x=1"), "www.youtube.com/shorts/ab?x=1")
+
+    def test_match(self):
+        engine = UrlRuleEngine(["/shorts/", "casino", "re:/reels?(/|$)", r"re:/(\d+)/\1$"])
+        self.assertEqual(engine.match_url("youtube.com", "/shorts/abc"), "/shorts/")
+        self.assertEqual(engine.match_url("best-casino.example"), "casino")
+        self.assertEqual(engine.match_url("instagram.com", "/REEL"), "re:/reels?(/|$)")
+        self.assertEqual(engine.match_url("example.com", "/12/12"), r"re:/(\d+)/\1$")
+        self.assertIsNone(engine.match_url("youtube.com", "/watch?v=1"))
+        self.assertIsNone(engine.match_url("instagram.com", "/reeling"))
+
+        self.assertEqual(engine.update(["/shorts/", "re:/stories/"]), (1, 3))
+        self.assertEqual(sorted(engine.rules()), ["/shorts/", "re:/stories/"])
+        self.assertIsNone(engine.match_url("best-casino.example"))
+        self.assertEqual(engine.match_url("instagram.com", "/stories/x"), "re:/stories/")
+        self.assertTrue(engine.remove("/shorts/"))
+        self.assertFalse(engine.remove("/shorts/"))
+        self.assertEqual(len(engine), 1)
+
+    def test_uncombinable_stored_regex(self):
+        # Stored before such rules were rejected: matched on its own, and the others still work
+        engine = UrlRuleEngine(["re:(?i)/feed", "re:/reels?/", "re:[unclosed"])
+        self.assertEqual(engine.match_url("facebook.com", "/feed"), "re:(?i)/feed")
+        self.assertEqual(engine.match_url("instagram.com", "/reel/x"), "re:/reels?/")
+        self.assertIsNone(engine.match_url("example.com", "/"))
+
+
+class TestStoredRules(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(TEST_DATA_DIR, exist_ok=True)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DATA_DIR):
+            shutil.rmtree(TEST_DATA_DIR)
+
+    def check_persisted(self, open_manager):
+        dm = open_manager()
+        try:
+            self.assertTrue(dm.add_url_rule("/Shorts/"))
+            self.assertFalse(dm.add_url_rule("/shorts/"))
+            dm.add_url_rule("re:/reels?/")
+            dm.add_url_rule("casino")
+            self.assertTrue(dm.remove_url_rule("casino"))
+            with self.assertRaises(ValueError):
+                dm.add_url_rule("re:[")
+        finally:
+            dm.close()
+        dm = open_manager()
+        try:
+            self.assertEqual(dm.get_url_rules(), ["/shorts/", "re:/reels?/"])
+        finally:
+            dm.close()
+
+    def test_json(self):
+        self.check_persisted(lambda: DataManager(TEST_DATA_FILE))
+
+    def test_journaled(self):
+        self.check_persisted(lambda: DataManager(TEST_DATA_FILE, journaled=True))
+
+    def test_sqlite(self):
+        self.check_persisted(lambda: DataManager(backend=SqliteBackend(os.path.join(TEST_DATA_DIR, "test.db"))))
+
+    def test_service_follows_rules(self):
+        dm = DataManager(TEST_DATA_FILE)
+        service = BlockingService(dm)
+        try:
+            dm.add_url_rule("/shorts/")
+            self.assertFalse(service.is_url_blocked("youtube.com", "/shorts/1"))
+            service.start_blocking(30, ["facebook.com"], strict=False)
+            self.assertTrue(service.is_url_blocked("youtube.com", "/shorts/1"))
+            self.assertTrue(service.is_url_blocked("m.facebook.com", "/"))
+            self.assertFalse(service.is_url_blocked("youtube.com", "/watch"))
+            # Changes apply to the running session
+            dm.add_url_rule("/watch")
+            dm.remove_url_rule("/shorts/")
+            self.assertTrue(service.is_url_blocked("youtube.com", "/watch"))
+            self.assertFalse(service.is_url_blocked("youtube.com", "/shorts/1"))
+        finally:
+            service.stop_blocking(force=True)
+            dm.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,418 @@
+"""
+URL and keyword rules, enforced by the filtering proxy.
+
+Where a blocklist entry names a whole domain, a URL rule matches anywhere in
+the text of a request, "host/path?query" ("m.youtube.com/shorts/abc"):
+
+    /shorts/              literal, case-insensitive substring (keyword rule)
+    youtube.com/shorts    literals may span host and path
+    re:/reels?(/|$)       regular expression, searched case-insensitively
+
+Literals are compiled into one Aho-Corasick automaton, so a URL is scanned
+in a single pass whatever the number of rules. Regexes without capture groups
+are joined into one alternation and searched once; the rest are tried one by
+one. Adding or removing a literal patches the automaton in place (new trie
+nodes and the few fail links that now point to them) instead of rebuilding it.
+
+Scans may run on other threads while the rules are being changed: a scan
+sees the rules from before or after each single change.
+"""
+import logging
+import re
+from urllib.parse import unquote
+from canonical import canonical_host
+
+REGEX_PREFIX = "re:"
+
+# Nodes left unreachable by removals before the automaton is rebuilt compactly
+MIN_COMPACT_NODES = 1024
+
+
+def parse_url_rule(rule):
+    """
+    :return: The rule in stored form: literals lower-cased, regexes as written
+    :raises ValueError: if the rule is empty or an invalid regex
+    """
+    rule = rule.strip()
+    if rule.startswith(REGEX_PREFIX):
+        pattern = rule[len(REGEX_PREFIX):]
+        if not pattern:
+            raise ValueError("Empty regex rule")
+        try:
+            # As it will be combined with the other rules, which e.g. rules out global flags like "(?i)"
+            _combinable(pattern, "r0")
+        except re.error as e:
+            raise ValueError(f"Invalid regex {pattern!r}: {e}") from e
+        return rule
+    if not rule:
+        raise ValueError("Empty URL rule")
+    return rule.lower()
+
+
+def _combinable(pattern, name):
+    """:return: pattern compiled inside a named group, the way UrlRuleEngine combines regex rules"""
+    return re.compile(f"(?P<{name}>{pattern})", re.IGNORECASE)
+
+
+def url_text(host, path=""):
+    """
+    :param host: Host name, in any form canonical_host accepts
+    :param path: Request target path with optional query, e.g. "/shorts/abc?x=1"
+    :return: The text rules are matched against, e.g. "m.youtube.com/shorts/abc?x=1"
+    """
+    return canonical_host(host) + unquote(path).lower()
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton mapping literal patterns to values.
+
+    Nodes are integer ids into parallel lists. Besides the usual goto, fail
+    and output tables, each node records its text, a count of the patterns
+    running through it and the nodes whose fail link points to it, which is
+    what lets add() and remove() update only the nodes a change affects.
+    Those fail children are bucketed by the character just before the
+    target's text, so add() looks at the few that can end with a new node's text.
+    """
+
+    def __init__(self, patterns=None):
+        """:param patterns: Initial {pattern: value} mapping"""
+        self._build(patterns or {})
+
+    def _build(self, patterns):
+        goto, fail, out = [{}], [0], [None]
+        self._text = [""]
+        self._value = [None]
+        self._refs = [0]
+        self._fail_children = [{}]
+        self._index = {"": 0}
+        self._patterns = {}
+        self._dead = 0
+        for pattern, value in patterns.items():
+            if not pattern or pattern in self._patterns:
+                continue
+            self._patterns[pattern] = value
+            node = 0
+            self._refs[0] += 1
+            for i, ch in enumerate(pattern):
+                child = goto[node].get(ch)
+                if child is None:
+                    child = goto[node][ch] = self._new_node(goto, fail, out, pattern[:i + 1])
+                self._refs[child] += 1
+                node = child
+            self._value[node] = value
+
+        # Breadth-first, so a node's fail target is finished before the node itself
+        queue = list(goto[0].values())
+        for node in queue:
+            self._link(node, 0)
+            out[node] = self._value[node]
+        for node in queue:
+            for ch, child in goto[node].items():
+                state = fail[node]
+                while ch not in goto[state] and state:
+                    state = fail[state]
+                target = goto[state].get(ch, 0)
+                fail[child] = target
+                self._link(child, target)
+                out[child] = self._value[child] if self._value[child] is not None else out[target]
+                queue.append(child)
+        # Scans read the three tables through this one reference
+        self._tables = (goto, fail, out)
+
+    def _new_node(self, goto, fail, out, text):
+        node = len(goto)
+        goto.append({})
+        fail.append(0)
+        out.append(None)
+        self._text.append(text)
+        self._value.append(None)
+        self._refs.append(0)
+        self._fail_children.append({})
+        self._index[text] = node
+        return node
+
+    def _link(self, node, target):
+        key = self._text[node][-len(self._text[target]) - 1]
+        bucket = self._fail_children[target].get(key)
+        if bucket is None:
+            bucket = self._fail_children[target][key] = set()
+        bucket.add(node)
+
+    def _unlink(self, node, target):
+        children = self._fail_children[target]
+        key = self._text[node][-len(self._text[target]) - 1]
+        children[key].discard(node)
+        if not children[key]:
+            del children[key]
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __contains__(self, pattern):
+        return pattern in self._patterns
+
+    @property
+    def node_count(self):
+        return len(self._index)
+
+    def patterns(self):
+        return dict(self._patterns)
+
+    def search(self, text):
+        """
+        Scans text once.
+        :return: Value of the first pattern found (the one ending earliest), or None
+        """
+        goto, fail, out = self._tables
+        state = 0
+        for ch in text:
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            if nxt is not None:
+                state = nxt
+                value = out[state]
+                if value is not None:
+                    return value
+        return None
+
+    def add(self, pattern, value):
+        """
+        Adds a pattern, creating its missing trie nodes and re-pointing the fail
+        links of existing nodes that now have a longer suffix in the trie.
+        :return: True if the pattern was new
+        """
+        if not pattern or pattern in self._patterns:
+            return False
+        goto, fail, out = self._tables
+        self._patterns[pattern] = value
+        path = [0]
+        for ch in pattern:
+            child = goto[path[-1]].get(ch)
+            if child is None:
+                break
+            path.append(child)
+        for node in path:
+            self._refs[node] += 1
+        known = len(path) - 1
+
+        new = []
+        for i in range(known + 1, len(pattern) + 1):
+            node = self._new_node(goto, fail, out, pattern[:i])
+            self._refs[node] = 1
+            if new:
+                goto[new[-1]][pattern[i - 1]] = node
+            new.append(node)
+        if not new:
+            # The pattern was already a prefix of another one
+            node = path[-1]
+            self._value[node] = value
+            self._update_outputs(node)
+            return True
+        self._value[new[-1]] = value
+
+        created = set(new)
+        old_fails = {}
+        for node in new:
+            text = self._text[node]
+            target = self._longest_suffix(text, ())
+            fail[node] = target
+            self._link(node, target)
+            out[node] = self._value[node] if self._value[node] is not None else out[target]
+            old_fails[node] = self._longest_suffix(text, created)
+        # Publish the finished branch with one assignment
+        goto[path[-1]][pattern[known]] = new[0]
+
+        # An existing node whose text ends with a new node's text falls back to
+        # it if it is longer than the node's old fail target. That old target is
+        # then the new node's longest suffix among old nodes, so only its fail
+        # children in one bucket need checking, longest new node first.
+        texts = self._text
+        for node in reversed(new):
+            text = texts[node]
+            old_target = old_fails[node]
+            bucket = self._fail_children[old_target].get(text[-len(texts[old_target]) - 1], ())
+            # Texts are unique, so a node other than `node` ending with text is longer
+            redirect = [w for w in bucket if texts[w].endswith(text) and w not in created]
+            for w in redirect:
+                self._unlink(w, old_target)
+                self._link(w, node)
+                fail[w] = node
+                self._update_outputs(w)
+        return True
+
+    def _longest_suffix(self, text, exclude):
+        """:return: Node of the longest proper suffix of text in the trie, skipping nodes in exclude"""
+        index = self._index
+        for i in range(1, len(text)):
+            node = index.get(text[i:])
+            if node is not None and node not in exclude:
+                return node
+        return 0
+
+    def _update_outputs(self, node):
+        """Recomputes the output of node and of the nodes falling back to it."""
+        _, fail, out = self._tables
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            value = self._value[node]
+            out[node] = value if value is not None else out[fail[node]]
+            for bucket in self._fail_children[node].values():
+                stack.extend(w for w in bucket if self._value[w] is None)
+
+    def remove(self, pattern):
+        """
+        Removes a pattern, unlinking the trie nodes no other pattern runs through.
+        Nodes that fell back to a removed node fall back to its fail target instead.
+        :return: True if the pattern was present
+        """
+        if pattern not in self._patterns:
+            return False
+        del self._patterns[pattern]
+        goto, fail, out = self._tables
+        path = [0]
+        for ch in pattern:
+            path.append(goto[path[-1]][ch])
+        for node in path:
+            self._refs[node] -= 1
+        self._value[path[-1]] = None
+
+        dead = [node for node in path[1:] if not self._refs[node]]
+        if not dead:
+            self._update_outputs(path[-1])
+            return True
+        # Unpublish the dead branch first; scans already inside it still find their way out
+        del goto[path[-len(dead) - 1]][pattern[-len(dead)]]
+        dead_set = set(dead)
+        for node in dead:
+            del self._index[self._text[node]]
+            if fail[node] not in dead_set:
+                self._unlink(node, fail[node])
+        for node in dead:
+            target = fail[node]
+            while target in dead_set:
+                target = fail[target]
+            for bucket in self._fail_children[node].values():
+                for w in bucket:
+                    if w in dead_set:
+                        continue
+                    fail[w] = target
+                    self._link(w, target)
+                    self._update_outputs(w)
+            self._fail_children[node] = {}
+        self._dead += len(dead)
+        if self._dead > max(MIN_COMPACT_NODES, len(self._index)):
+            self._build(self._patterns)
+        return True
+
+
+class UrlRuleEngine:
+    """Matches request URLs against a set of URL rules (see the module docstring)."""
+
+    def __init__(self, rules=()):
+        """:param rules: Rules in stored form (see parse_url_rule)"""
+        rules = set(rules)
+        self._regexes = {rule for rule in rules if rule.startswith(REGEX_PREFIX)}
+        self._literals = AhoCorasick({rule: rule for rule in rules - self._regexes})
+        # (combined regex or None, {group name: rule}, ((rule, regex) tried one by one))
+        self._regex_state = (None, {}, ())
+        self._compile_regexes()
+
+    def __len__(self):
+        return len(self._literals) + len(self._regexes)
+
+    def __contains__(self, rule):
+        return rule in self._literals or rule in self._regexes
+
+    def rules(self):
+        return list(self._literals.patterns()) + sorted(self._regexes)
+
+    def add(self, rule):
+        """:return: True if the rule was new"""
+        if not rule.startswith(REGEX_PREFIX):
+            return self._literals.add(rule, rule)
+        if rule in self._regexes:
+            return False
+        self._regexes.add(rule)
+        self._compile_regexes()
+        return True
+
+    def remove(self, rule):
+        """:return: True if the rule was present"""
+        if not rule.startswith(REGEX_PREFIX):
+            return self._literals.remove(rule)
+        if rule not in self._regexes:
+            return False
+        self._regexes.discard(rule)
+        self._compile_regexes()
+        return True
+
+    def update(self, rules):
+        """
+        Makes the rule set equal to `rules`, applying only the difference.
+        :return: (rules added, rules removed)
+        """
+        rules = set(rules)
+        literals = {rule for rule in rules if not rule.startswith(REGEX_PREFIX)}
+        regexes = rules - literals
+        current = set(self._literals.patterns())
+        removed = current - literals
+        added = literals - current
+        for rule in removed:
+            self._literals.remove(rule)
+        for rule in added:
+            self._literals.add(rule, rule)
+        if regexes != self._regexes:
+            removed |= self._regexes - regexes
+            added |= regexes - self._regexes
+            self._regexes = regexes
+            self._compile_regexes()
+        return len(added), len(removed)
+
+    def _compile_regexes(self):
+        # Capture groups would shift the group numbers the combined pattern relies on
+        combined, separate = [], []
+        for rule in sorted(self._regexes):
+            source = rule[len(REGEX_PREFIX):]
+            try:
+                pattern = re.compile(source, re.IGNORECASE)
+            except re.error as e:
+                logging.warning(f"Skipping invalid URL rule {rule!r}: {e}")
+                continue
+            try:
+                _combinable(source, "r0")
+            except re.error:
+                # Stored before rules were checked in combined form: matched on its own
+                separate.append((rule, pattern))
+                continue
+            (separate if pattern.groups else combined).append((rule, pattern))
+        names = {f"r{i}": rule for i, (rule, _) in enumerate(combined)}
+        regex_set = None
+        if combined:
+            regex_set = re.compile("|".join(f"(?P<r{i}>{pattern.pattern})" for i, (_, pattern) in enumerate(combined)),
+                                   re.IGNORECASE)
+        self._regex_state = (regex_set, names, tuple(separate))
+
+    def match(self, text):
+        """
+        :param text: URL text as built by url_text()
+        :return: The first rule matching, or None
+        """
+        rule = self._literals.search(text)
+        if rule is not None:
+            return rule
+        regex_set, names, separate = self._regex_state
+        if regex_set is not None:
+            found = regex_set.search(text)
+            if found:
+                return names[found.lastgroup]
+        for rule, pattern in separate:
+            if pattern.search(text):
+                return rule
+        return None
+
+    def match_url(self, host, path=""):
+        return self.match(url_text(host, path))